@@ -0,0 +1,4 @@
+#!/usr/bin/env python3
+
+""" Performance benchmarks (run with python3 -m benchmarks.<name>)
+"""
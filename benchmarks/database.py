@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+""" Connection overhead: insert, get_all and fetch_one_or_none vs raw sqlite3
+
+    python3 -m benchmarks.database --rows 10000
+"""
+
+
+import os
+import sqlite3
+
+import financial_game.database
+from benchmarks import harness
+
+
+COLUMNS = {
+    "id": "INTEGER PRIMARY KEY AUTOINCREMENT",
+    "name": "VARCHAR(50)",
+    "value": "INTEGER",
+}
+KERNELS = {"Sqlite": "false", "Threadsafe": "true"}  # url threadsafe=
+
+
+def row(index: int) -> dict:
+    """The columns of a row to insert"""
+    return {"name": f"row {index}", "value": index}
+
+
+def raw_cases(path: str, rows: int) -> dict:
+    """{name: function()} using sqlite3 directly (the baseline)"""
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute(
+        "CREATE TABLE raw (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        + "name VARCHAR(50), value INTEGER);"
+    )
+
+    def insert():
+        with connection:  # one transaction
+            for index in range(0, rows):
+                connection.execute(
+                    "INSERT INTO raw (name, value) VALUES(?, ?);",
+                    (f"row {index}", index),
+                )
+
+    def get_all():
+        cursor = connection.execute("SELECT * FROM raw LIMIT :rows;", {"rows": rows})
+        labels = [d[0] for d in cursor.description]
+        return [dict(zip(labels, r)) for r in cursor.fetchall()]
+
+    def fetch_one_or_none():
+        for index in range(1, rows + 1):
+            cursor = connection.execute(
+                "SELECT * FROM raw WHERE id = :id;", {"id": index}
+            )
+            labels = [d[0] for d in cursor.description]
+            dict(zip(labels, cursor.fetchone()))
+
+    return {
+        "raw sqlite3 insert": insert,
+        "raw sqlite3 get_all": get_all,
+        "raw sqlite3 fetch_one_or_none": fetch_one_or_none,
+    }
+
+
+def connection_cases(kernel: str, connection, rows: int) -> dict:
+    """{name: function()} using a financial_game.database.Connection"""
+    table = f"bench_{kernel}"
+    connection.create_table(table, **COLUMNS)
+
+    def insert():
+        with connection.transaction():
+            for index in range(0, rows):
+                connection.insert(table, _commit_=False, **row(index))
+
+    def insert_many():
+        connection.insert_many(table, [row(i) for i in range(0, rows)])
+
+    return {
+        f"{kernel} insert": insert,
+        f"{kernel} insert_many": insert_many,
+        f"{kernel} get_all": lambda: connection.get_all(table, _limit_=rows),
+        f"{kernel} get_all (objects)": lambda: connection.get_all(
+            table, _limit_=rows, _as_objects_=True
+        ),
+        f"{kernel} fetch_one_or_none": lambda: [
+            connection.fetch_one_or_none(f"SELECT * FROM {table} WHERE id = :id;", id=i)
+            for i in range(1, rows + 1)
+        ],
+    }
+
+
+def run(workspace: str, rows: int, repeat: int) -> dict:
+    """{case: harness.measure()} raw sqlite3 first, then each kernel"""
+    results = {}
+    cases = raw_cases(os.path.join(workspace, "raw.sqlite3"), rows)
+    results.update({n: harness.measure(f, repeat) for n, f in cases.items()})
+
+    for kernel, threadsafe in KERNELS.items():
+        path = os.path.join(workspace, f"{kernel}.sqlite3")
+        connection = financial_game.database.Connection.connect(
+            f"sqlite://{path}?threadsafe={threadsafe}", default_return_objects=False
+        )
+        cases = connection_cases(kernel, connection, rows)
+        results.update({n: harness.measure(f, repeat) for n, f in cases.items()})
+        connection.close()
+
+    return results
+
+
+def main():
+    """Time each operation on --rows rows (inserts run before the reads)"""
+    args = harness.parser(__doc__.split("\n")[1].strip(), 10000).parse_args()
+    results = harness.in_workspace(run, args.rows, args.repeat)
+    harness.report(results, args.rows, args.output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
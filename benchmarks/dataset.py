@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+
+""" Synthetic dataset: many users, deep sponsor chains and months of statements
+
+    python3 -m benchmarks.dataset big.sqlite3 --users 100000 --seed 1
+
+    The same --seed and --users always give the same data (whatever --workers).
+    .yaml, .json and .snapshot paths are written in the serialize() format
+    (load them with python3 -m financial_game --db ... --reset <path>),
+    other paths are created as sqlite databases with bulk inserts.
+    Account and statement ids are spaced (by MAX_ACCOUNTS and MAX_MONTHS) so
+    each chunk of users can be generated on its own.
+"""
+
+
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import os
+import random
+import time
+
+import financial_game.database
+import financial_game.model
+import financial_game.snapshot
+from financial_game.table import Table
+from financial_game.model_bank import TypeOfAccount
+from financial_game.model_user import User, Account, Statement, AccountPurpose
+
+
+CHUNK_USERS = 1000  # users generated at a time by a worker
+MAX_ACCOUNTS = 6  # per user
+MAX_MONTHS = 36  # statements per account
+SPONSORED = 0.99  # chance a user has a sponsor (chains of about 100)
+SPONSOR_WINDOW = 5  # sponsors are one of the previous users (long chains)
+FEE_CHANCE = 0.05  # chance of a fee on a statement
+LAST_DAY = datetime.date(2022, 12, 31)  # the last statement ends on this day
+PASSWORD = "Setec astronomy"  # of every user
+INSERT_BATCH = 10000  # rows inserted at a time into sqlite
+SERIALIZED = {".yaml": "yaml", ".yml": "yaml", ".json": "json", ".snapshot": "snapshot"}
+PROFILES = {  # cents (balance, deposits, withdrawals) and yearly rate in 1/100 %
+    TypeOfAccount.CRED: {
+        "balance": (-300000, 0),
+        "deposits": (0, 200000),
+        "withdrawals": (0, 200000),
+        "rate": (1200, 2500),
+    },
+    TypeOfAccount.CHCK: {
+        "balance": (0, 500000),
+        "deposits": (100000, 600000),
+        "withdrawals": (50000, 600000),
+        "rate": (0, 50),
+    },
+    TypeOfAccount.SAVE: {
+        "balance": (0, 2000000),
+        "deposits": (0, 100000),
+        "withdrawals": (0, 50000),
+        "rate": (50, 450),
+    },
+    TypeOfAccount.MONM: {
+        "balance": (0, 5000000),
+        "deposits": (0, 200000),
+        "withdrawals": (0, 100000),
+        "rate": (100, 500),
+    },
+    TypeOfAccount.BROK: {
+        "balance": (0, 10000000),
+        "deposits": (0, 200000),
+        "withdrawals": (0, 100000),
+        "rate": (-2000, 3000),  # market returns, so interest can be negative
+    },
+}
+
+
+def email(user_id: int) -> str:
+    """The email address of a generated user"""
+    return f"user{user_id}@example.com"
+
+
+def banks(count: int) -> dict:
+    """{id: serialized bank} each with an account type of each TypeOfAccount
+    account type ids are in order from 1 (the same as when they are loaded)
+    """
+    kinds = list(TypeOfAccount)
+
+    def account_types(bank_id: int) -> dict:
+        first = (bank_id - 1) * len(kinds) + 1
+        return {
+            first + i: {"name": f"Bank {bank_id} {k.name}", "type": k.name, "url": None}
+            for i, k in enumerate(kinds)
+        }
+
+    return {
+        b: {
+            "name": f"Bank {b}",
+            "url": f"https://bank{b}.example.com/",
+            "type": "BANK",
+            "account_types": account_types(b),
+        }
+        for b in range(1, count + 1)
+    }
+
+
+def months(count: int) -> [(datetime.date, datetime.date)]:
+    """(first day, last day) of the count months ending on LAST_DAY, oldest first"""
+    found = []
+    end = LAST_DAY
+
+    for _ in range(0, count):
+        start = end.replace(day=1)
+        found.insert(0, (start, end))
+        end = start - datetime.timedelta(days=1)
+
+    return found
+
+
+def statements(generator: random.Random, kind: TypeOfAccount, count: int) -> list:
+    """count serialized statements of an account that each reconcile
+    (start + deposits - withdrawals + interest - fees == end, to the cent)
+    and start where the previous one ended
+    """
+    profile = PROFILES[kind]
+    balance = generator.randint(*profile["balance"])
+    rate = generator.randint(*profile["rate"])
+    found = []
+
+    for start_date, end_date in months(count):
+        deposits = generator.randint(*profile["deposits"])
+        withdrawals = generator.randint(*profile["withdrawals"])
+        interest = balance * rate // 120000  # a month at the yearly rate
+        fees = generator.randint(100, 3500) if generator.random() < FEE_CHANCE else 0
+
+        if kind == TypeOfAccount.CRED:  # payments never leave money owed to you
+            deposits = max(0, min(deposits, withdrawals - balance - interest + fees))
+        else:  # never overdrawn
+            withdrawals = max(0, min(withdrawals, balance + deposits + interest - fees))
+
+        end = balance + deposits - withdrawals + interest - fees
+        found.append(
+            {
+                "start_date": start_date.strftime("%Y-%m-%d"),
+                "end_date": end_date.strftime("%Y-%m-%d"),
+                "start_value": balance / 100,
+                "end_value": end / 100,
+                "withdrawals": withdrawals / 100,
+                "deposits": deposits / 100,
+                "interest": interest / 100,
+                "fees": fees / 100,
+                "rate": rate / 100,
+                "mileage": None,
+            }
+        )
+        balance = end
+
+    return found
+
+
+def user(generator: random.Random, user_id: int, kinds: dict, password_hash: str):
+    """A serialized user with accounts and statements
+    kinds - {account type id: TypeOfAccount}
+    """
+    window = min(user_id - 1, SPONSOR_WINDOW)
+    sponsored = window > 0 and generator.random() < SPONSORED
+    accounts = {}
+
+    for index in range(0, generator.randint(1, MAX_ACCOUNTS)):
+        account_type = generator.choice(list(kinds))
+        purpose = generator.choice([None] + [p.name for p in AccountPurpose])
+        account_id = (user_id - 1) * MAX_ACCOUNTS + index + 1
+        accounts[account_id] = {
+            "label": f"{kinds[account_type].name.title()} {index + 1}",
+            "hint": None,
+            "purpose": purpose,
+            "account_type": account_type,
+            "statements": {
+                (account_id - 1) * MAX_MONTHS + i + 1: s
+                for i, s in enumerate(
+                    statements(
+                        generator,
+                        kinds[account_type],
+                        generator.randint(1, MAX_MONTHS),
+                    )
+                )
+            },
+        }
+
+    return {
+        "name": f"User {user_id}",
+        "email": email(user_id),
+        "password_hash": password_hash,
+        "sponsor_id": user_id - generator.randint(1, window) if sponsored else None,
+        "accounts": accounts,
+    }
+
+
+def chunk(seed: int, first: int, count: int, bank_count: int, password_hash: str):
+    """[(id, serialized user)] for users first through first + count - 1
+    The users only depend on seed and first, so chunks can be made in any order
+    """
+    generator = random.Random(f"{seed}:{first}")
+    kinds = {
+        i: TypeOfAccount[t["type"]]
+        for b in banks(bank_count).values()
+        for i, t in b["account_types"].items()
+    }
+    return [
+        (u, user(generator, u, kinds, password_hash))
+        for u in range(first, first + count)
+    ]
+
+
+def table_rows(users: [tuple]) -> dict:
+    """{table name: [database row]} of [(id, serialized user)]"""
+    found = collections.defaultdict(list)
+
+    for user_id, record in users:
+        found[Table.name(User)].append(
+            User(
+                id=user_id,
+                email=record["email"],
+                password_hash=record["password_hash"],
+                name=record["name"],
+                sponsor_id=record["sponsor_id"],
+                _normalize_=False,
+            ).denormalize()
+        )
+
+        for account_id, account in record["accounts"].items():
+            found[Table.name(Account)].append(
+                Account(
+                    id=account_id,
+                    user_id=user_id,
+                    account_type_id=account["account_type"],
+                    label=account["label"],
+                    hint=account["hint"],
+                    purpose=(
+                        None
+                        if account["purpose"] is None
+                        else AccountPurpose[account["purpose"]]
+                    ),
+                    _normalize_=False,
+                ).denormalize()
+            )
+            found[Table.name(Statement)].extend(
+                financial_game.model.serialized_to_statement(
+                    i, account_id, s
+                ).denormalize()
+                for i, s in account["statements"].items()
+            )
+
+    return dict(found)
+
+
+def database_chunk(*arguments) -> dict:
+    """table_rows() of chunk(*arguments) (so workers do the conversion)"""
+    return table_rows(chunk(*arguments))
+
+
+def generate(users: int, seed: int = 0, bank_count: int = 10, **options):
+    """Yield chunk() results (or database_chunk() if database) in order
+    options - workers (processes, None for one per cpu), database (bool)
+    """
+    password_hash = User.hash_password(PASSWORD, random.Random(seed).randbytes(16))
+    make = database_chunk if options.get("database", False) else chunk
+    firsts = collections.deque(range(1, users + 1, CHUNK_USERS))
+    pending = collections.deque()
+
+    workers = options.get("workers", None) or os.cpu_count()
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        while firsts or pending:
+            while firsts and len(pending) < 2 * workers:  # only a few in memory
+                first = firsts.popleft()
+                count = min(CHUNK_USERS, users + 1 - first)
+                pending.append(
+                    pool.submit(make, seed, first, count, bank_count, password_hash)
+                )
+
+            yield pending.popleft().result()
+
+
+def write(path: str, users: int, seed: int = 0, bank_count: int = 10, **options):
+    """Write users generated users to path (see the module description)
+    options - workers (processes, None for one per cpu)
+    """
+    fmt = SERIALIZED.get(os.path.splitext(path)[1].lower(), None)
+    generated = generate(users, seed, bank_count, database=fmt is None, **options)
+
+    if fmt is None:
+        write_database(path, generated, bank_count)
+
+    elif fmt == "snapshot":
+        with open(path, "wb") as snapshot_file:
+            financial_game.snapshot.write(
+                snapshot_file,
+                (u for c in generated for u in c),
+                banks(bank_count).items(),
+            )
+
+    else:
+        with open(path, "w", encoding="utf-8") as text_file:
+            financial_game.model.write_section(
+                text_file, fmt, "users", (u for c in generated for u in c)
+            )
+            financial_game.model.write_section(
+                text_file, fmt, "banks", banks(bank_count).items()
+            )
+            text_file.write("" if fmt == "yaml" else "}\n")
+
+
+def write_database(path: str, generated, bank_count: int):
+    """Create a sqlite database at path and bulk insert the banks and generated rows"""
+    url = f"sqlite://{os.path.abspath(path)}"
+    financial_game.model.Database(url).close()  # create the tables
+    connection = financial_game.database.Connection.connect(f"{url}?threadsafe=false")
+    bank_list, type_list, _ = financial_game.model.bank_rows(banks(bank_count))
+
+    with connection.transaction():
+        for rows in (bank_list, type_list):
+            connection.insert_many(
+                Table.name(rows[0].__class__),
+                [r.denormalize() for r in rows],
+                _commit_=False,
+            )
+
+        for tables in generated:
+            for table, rows in tables.items():
+                for start in range(0, len(rows), INSERT_BATCH):
+                    end = start + INSERT_BATCH
+                    connection.insert_many(table, rows[start:end], _commit_=False)
+
+    connection.close()
+
+
+def main():
+    """Generate a dataset and report how long it took"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1].strip())
+    parser.add_argument("path", help="Where to write (.yaml, .json, .snapshot, sqlite)")
+    parser.add_argument("--users", type=int, default=100000, help="(default 100000)")
+    parser.add_argument("--seed", type=int, default=0, help="(default 0)")
+    parser.add_argument("--banks", type=int, default=10, help="(default 10)")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Processes (default one per cpu)"
+    )
+    args = parser.parse_args()
+    start = time.perf_counter()
+    write(args.path, args.users, args.seed, args.banks, workers=args.workers)
+    elapsed = time.perf_counter() - start
+    print(f"{args.users:,} users in {elapsed:0.1f}s ({args.users / elapsed:,.0f}/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+""" Statement date conversion: IntDate vs the old fromtimestamp() path
+
+    python3 -m benchmarks.dates --rows 1000000
+"""
+
+
+import datetime
+import random
+
+import financial_game.table
+from benchmarks import harness
+
+
+FIRST_DAY = 15000  # 2011-01-26
+LAST_DAY = 19000  # 2022-01-08
+
+
+def legacy_normalize(value):
+    """What Date.normalize used to do (depends on the local timezone)"""
+    return datetime.datetime.fromtimestamp(value * 86400).date()
+
+
+def legacy_denormalize(value):
+    """What Date.denormalize used to do (depends on the local timezone)"""
+    return datetime.datetime.combine(value, datetime.time()).timestamp() / 86400
+
+
+def uncached_normalize(value):
+    """IntDate.normalize without the memo"""
+    return datetime.date.fromordinal(value + financial_game.table.EPOCH_ORDINAL)
+
+
+def cases(days: [int]) -> dict:
+    """{name: function()} converting every day (or date) once"""
+    column = financial_game.table.IntDate()
+    dates = [column.normalize(d) for d in days]
+
+    def cached():
+        financial_game.table.date_from_days.cache_clear()
+        return [column.normalize(d) for d in days]
+
+    return {
+        "legacy normalize (fromtimestamp)": lambda: [legacy_normalize(d) for d in days],
+        "IntDate normalize (uncached)": lambda: [uncached_normalize(d) for d in days],
+        "IntDate normalize (memoized)": cached,
+        "legacy denormalize (timestamp)": lambda: [
+            legacy_denormalize(d) for d in dates
+        ],
+        "IntDate denormalize (toordinal)": lambda: [
+            column.denormalize(d) for d in dates
+        ],
+    }
+
+
+def main():
+    """Time each way of converting --rows statement dates"""
+    args = harness.parser(__doc__.split("\n")[1].strip(), 1000000).parse_args()
+    generator = random.Random(0)
+    days = [generator.randint(FIRST_DAY, LAST_DAY) for _ in range(0, args.rows)]
+    results = {n: harness.measure(f, args.repeat) for n, f in cases(days).items()}
+    harness.report(results, args.rows, args.output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
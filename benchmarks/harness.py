@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+""" Shared timing and reporting for the benchmarks
+"""
+
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+
+
+def parser(description: str, rows: int) -> argparse.ArgumentParser:
+    """Command line arguments shared by every benchmark
+    description - what the benchmark measures
+    rows - default number of rows to work on
+    """
+    arguments = argparse.ArgumentParser(description=description)
+    arguments.add_argument(
+        "--rows", type=int, default=rows, help=f"Rows to work on (default {rows})"
+    )
+    arguments.add_argument(
+        "--repeat", type=int, default=3, help="Times to run each case (default 3)"
+    )
+    arguments.add_argument(
+        "--output", type=str, default=None, help="Also write the results as JSON"
+    )
+    arguments.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="JSON --output of an earlier run to compare the results to",
+    )
+    return arguments
+
+
+def measure(function, repeat: int) -> dict:
+    """Time function() repeat times
+    returns {"best": seconds, "median": seconds, "runs": [seconds]}
+    """
+    runs = []
+
+    for _ in range(0, repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+
+    return {"best": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def speedup(name: str, per_row: float, baseline: dict) -> str:
+    """How many times faster per row than the baseline run of the case
+    ("" if the baseline did not run the case)
+    """
+    before = baseline.get("results", {}).get(name, None)
+
+    if before is None or per_row <= 0:
+        return ""
+
+    return f"  {before['best'] / baseline['rows'] / per_row:6.2f}x"
+
+
+def load_baseline(baseline: str = None) -> dict:
+    """The JSON output of an earlier run ({} if baseline is None)"""
+    if baseline is None:
+        return {}
+
+    with open(baseline, "r", encoding="utf-8") as baseline_file:
+        return json.load(baseline_file)
+
+
+def write_output(output: str, results: dict):
+    """Write results as JSON to output (if not None)"""
+    if output is not None:
+        with open(output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+def report(results: dict, rows: int, output: str = None, baseline: str = None):
+    """Print {case: measure()} (and write it as JSON to output, if given)
+    baseline - JSON output of an earlier run, to print how much faster each case is
+    """
+    width = max(len(n) for n in results)
+    before = load_baseline(baseline)
+
+    for name, timing in results.items():
+        rate = rows / timing["best"] if timing["best"] > 0 else float("inf")
+        print(
+            f"{name:<{width}}  best {timing['best']:8.4f}s"
+            + f"  median {timing['median']:8.4f}s  {rate:14,.0f} rows/s"
+            + f"  {1000000.0 * timing['best'] / rows:10.2f} us/row"
+            + speedup(name, timing["best"] / rows, before)
+        )
+
+    write_output(output, {"rows": rows, "results": results})
+    sys.stdout.flush()
+
+
+def in_workspace(run, *arguments):
+    """run(workspace, *arguments) with a temporary directory as the workspace"""
+    with tempfile.TemporaryDirectory() as workspace:
+        return run(workspace, *arguments)
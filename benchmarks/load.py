@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+""" HTTP load: concurrent clients logging in, viewing / and adding accounts
+
+    python3 -m benchmarks.load --rows 1000 --clients 1,8,32 --seconds 10 --repeat 3
+
+    --rows users (with accounts and statements) are made by benchmarks.dataset
+    each level is run --repeat times and the median of each number is reported
+    A login only succeeds if it gives a session (clients retry until they have one)
+    and an /add_account only succeeds if the account is in the database afterwards.
+"""
+
+
+import collections
+import http.client
+import http.cookies
+import itertools
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+import types
+import urllib.parse
+
+import werkzeug.serving
+
+import financial_game.model
+import financial_game.webserver
+from financial_game.model_bank import AccountType
+from financial_game.model_user import Account
+from financial_game.table import Table
+from benchmarks import dataset, harness
+
+
+MIX = {"/login": 1, "/": 16, "/add_account": 3}  # relative weight of each request
+EXPECTED = {"/login": 302, "/": 200, "/add_account": 302}  # status of a success
+USER_AGENT = "benchmarks.load"
+PERCENTILES = (50, 95, 99)
+WARM_UP = 1.0  # seconds of requests from one client before timing
+RUNS = itertools.count(1)  # keeps account labels unique across load() calls
+
+
+def serve(app):
+    """Start serving app on a free local port with a thread per request
+    returns the server (server.port, server.shutdown())
+    """
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no line per request
+    server = werkzeug.serving.make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentile(ordered: [float], percent: int) -> float:
+    """Nearest rank percentile of sorted values (0.0 if there are none)"""
+    if not ordered:
+        return 0.0
+
+    return ordered[max(0, -(-len(ordered) * percent // 100) - 1)]
+
+
+def client(port: int, user: int, account_types: dict, deadline: float, name: str):
+    """function() making requests as user until deadline
+    returns [(route, seconds, ok, label of the account added or None)]
+    account_types - {bank id: [account type id]} to add accounts with
+    name - unique to this client, the start of the labels of accounts it adds
+    Only /login is requested (again) until the client has a session
+    """
+    generator = random.Random(user)
+    routes, weights = list(MIX), list(MIX.values())
+    headers = {"User-Agent": USER_AGENT}
+    form = {"Content-Type": "application/x-www-form-urlencoded"}
+    labels = (f"{name} {n}" for n in itertools.count(1))
+
+    def body(route: str, label: str) -> dict:
+        if route == "/login":
+            return {"email": dataset.email(user), "password": dataset.PASSWORD}
+
+        bank_id = generator.choice(list(account_types))
+        return {
+            "bank": bank_id,
+            f"bank_{bank_id}_account_type": generator.choice(account_types[bank_id]),
+            "account_label": label,
+        }
+
+    def request(connection, route: str, label: str) -> bool:
+        if route == "/":
+            connection.request("GET", route, headers=headers)
+        else:
+            data = urllib.parse.urlencode(body(route, label))
+            connection.request("POST", route, data, headers=dict(headers, **form))
+
+        response = connection.getresponse()
+        response.read()
+        cookie = http.cookies.SimpleCookie(response.getheader("Set-Cookie", ""))
+        value = cookie.get(financial_game.webserver.COOKIE, None)
+
+        if value is not None and value.value:
+            headers["Cookie"] = f"{financial_game.webserver.COOKIE}={value.value}"
+
+        elif value is not None or route == "/login":  # logged out or login failed
+            headers.pop("Cookie", None)
+
+        return response.status == EXPECTED[route] and "Cookie" in headers
+
+    def run() -> list:
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        timings = []
+        route = "/login"
+
+        while time.perf_counter() < deadline:
+            label = next(labels) if route == "/add_account" else None
+            start = time.perf_counter()
+
+            try:
+                ok = request(connection, route, label)
+
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                ok = False
+
+            timings.append((route, time.perf_counter() - start, ok, label))
+            route = (
+                generator.choices(routes, weights)[0]
+                if "Cookie" in headers
+                else "/login"
+            )
+
+        connection.close()
+        return timings
+
+    return run
+
+
+def added(prefix: str) -> set:
+    """Labels of the accounts in the database that start with prefix"""
+    found = Account._db.get_all(  # pylint: disable=protected-access
+        Table.name(Account),
+        "label",
+        _where_="label LIKE :pattern",
+        _as_objects_=False,
+        pattern=f"{prefix}%",
+    )
+    return {a["label"] for a in found}
+
+
+def load(port: int, clients: int, seconds: float, users: int) -> (dict, float):
+    """Run clients concurrent clients (as users 1 through users) for seconds
+    returns {route: [(seconds, ok)]} ("all" is every request) and the elapsed time
+    """
+    banks, account_types = AccountType.every()
+    account_types = {b.id: [t.id for t in account_types[b.id]] for b in banks}
+    deadline = time.perf_counter() + seconds
+    results = [None] * clients
+    run = f"Load {next(RUNS)}"
+
+    def requests(index: int):
+        user = 1 + index % users
+        results[index] = client(port, user, account_types, deadline, f"{run}.{index}")()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=requests, args=(i,)) for i in range(0, clients)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - start
+    return by_route(verified(results, added(f"{run}."))), elapsed
+
+
+def verified(results: [list], accounts: set) -> [tuple]:
+    """[(route, seconds, ok)] of client() results
+    an /add_account is only ok if the account it added is in accounts
+    """
+    return [
+        (route, s, ok and (label is None or label in accounts))
+        for r in results
+        for route, s, ok, label in r
+    ]
+
+
+def by_route(timings: [tuple]) -> dict:
+    """{route: [(seconds, ok)]} ("all" is every request) of [(route, seconds, ok)]"""
+    found = {"all": [(s, ok) for _, s, ok in timings]}
+
+    for route, seconds, ok in timings:
+        found.setdefault(route, []).append((seconds, ok))
+
+    return found
+
+
+def summary(timings: [tuple], elapsed: float) -> dict:
+    """{"requests", "errors", "throughput" (per second), "p50", "p95", "p99" (seconds)}"""
+    ordered = sorted(s for s, _ in timings)
+    found = {
+        "requests": len(timings),
+        "errors": sum(1 for _, ok in timings if not ok),
+        "throughput": len(timings) / elapsed if elapsed > 0 else 0.0,
+    }
+    found.update({f"p{p}": percentile(ordered, p) for p in PERCENTILES})
+    return found
+
+
+def median(summaries: [dict]) -> dict:
+    """The (low) median of each number in summary() results"""
+    return {k: statistics.median_low(s[k] for s in summaries) for k in summaries[0]}
+
+
+def levels(workspace: str, args) -> dict:
+    """{"<clients> clients <route>": median(summary())} for each of args.clients
+    (of args.repeat runs)
+    """
+    path = os.path.join(workspace, "load.sqlite3")
+    dataset.write(path, args.rows)
+    database = financial_game.model.Database(f"sqlite://{path}")
+    server = serve(
+        financial_game.webserver.create_app(
+            types.SimpleNamespace(secret="benchmark secret", debug=False)
+        )
+    )
+    load(server.port, 1, WARM_UP, args.rows)  # imports, templates, caches
+    results = {}
+
+    for clients in args.clients:
+        runs = collections.defaultdict(list)
+
+        for _ in range(0, args.repeat):
+            routes, elapsed = load(server.port, clients, args.seconds, args.rows)
+
+            for route, timings in routes.items():
+                runs[f"{clients} clients {route}"].append(summary(timings, elapsed))
+
+        results.update({n: median(s) for n, s in runs.items()})
+
+    server.shutdown()
+    database.close()
+    return results
+
+
+def report(results: dict, rows: int, output: str = None, baseline: str = None):
+    """Print {case: summary()} (and write it as JSON to output, if given)
+    baseline - JSON output of an earlier run, to print how throughput changed
+    """
+    before = harness.load_baseline(baseline).get("results", {})
+    width = max(len(n) for n in results)
+
+    for name, found in results.items():
+        change = before.get(name, {}).get("throughput", 0.0)
+        print(
+            f"{name:<{width}}  {found['requests']:8,} requests"
+            + f"  {found['errors']:6,} errors  {found['throughput']:9,.1f} /s"
+            + "".join(f"  p{p} {1000.0 * found[f'p{p}']:9.2f} ms" for p in PERCENTILES)
+            + (f"  {found['throughput'] / change:6.2f}x" if change > 0 else "")
+        )
+
+    harness.write_output(output, {"rows": rows, "results": results})
+
+
+def main():
+    """Time --seconds of requests from each number of --clients"""
+    parser = harness.parser(__doc__.split("\n")[1].strip(), 1000)
+    parser.add_argument(
+        "--clients",
+        type=lambda s: [int(c) for c in s.split(",")],
+        default=[1, 8, 32],
+        help="Comma separated numbers of concurrent clients (default 1,8,32)",
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=10.0, help="Time at each level (default 10)"
+    )
+    args = parser.parse_args()
+    results = harness.in_workspace(levels, args)
+    report(results, args.rows, args.output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
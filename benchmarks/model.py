@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+""" Model create/fetch round trip latency (each create is committed)
+
+    python3 -m benchmarks.model --rows 1000
+"""
+
+
+import datetime
+import os
+
+import financial_game.model
+from financial_game.model_bank import Bank, AccountType, TypeOfAccount
+from financial_game.model_user import User, Account, Statement
+from benchmarks import harness
+
+
+KERNELS = {"Sqlite": "false", "Threadsafe": "true"}  # url threadsafe=
+FIRST_DAY = datetime.date(2022, 1, 1)
+
+
+def cases(kernel: str, rows: int) -> dict:
+    """{name: function()} creating or fetching rows of each model"""
+    account_type = AccountType.create(
+        Bank.create("Bank"), "Checking", TypeOfAccount.CHCK
+    )
+    user = User.create("bench@apple.com", "hash", "Bench", pw_hashed=True)
+
+    def create_users():
+        for index in range(0, rows):
+            User.create(
+                f"user{index}@apple.com", "hash", f"User {index}", pw_hashed=True
+            )
+
+    def create_accounts():
+        for index in range(0, rows):
+            Account.create(user, account_type, f"account {index}")
+
+    def create_statements():
+        for index in range(0, rows):
+            Statement.create(
+                account=1 + index,
+                start_date=FIRST_DAY,
+                end_date=FIRST_DAY + datetime.timedelta(days=30),
+                start_value=100.00,
+                end_value=112.50,
+                withdrawals=2.50,
+                deposits=15.25,
+                fees=0.50,
+                interest=0.25,
+                rate=0.50,
+            )
+
+    return {
+        f"{kernel} User.create": create_users,
+        f"{kernel} User.fetch": lambda: [User.fetch(1 + i) for i in range(0, rows)],
+        f"{kernel} Account.create": create_accounts,
+        f"{kernel} Account.fetch": lambda: [
+            Account.fetch(1 + i) for i in range(0, rows)
+        ],
+        f"{kernel} Statement.create": create_statements,
+        f"{kernel} Account.statements": lambda: [
+            Account.fetch(1 + i).statements() for i in range(0, rows)
+        ],
+    }
+
+
+def run(workspace: str, rows: int, repeat: int) -> dict:
+    """{case: harness.measure()} for each kernel"""
+    results = {}
+
+    for kernel, threadsafe in KERNELS.items():
+        path = os.path.join(workspace, f"{kernel}.sqlite3")
+        database = financial_game.model.Database(
+            f"sqlite://{path}?threadsafe={threadsafe}"
+        )
+        found = cases(kernel, rows)
+        results.update({n: harness.measure(f, repeat) for n, f in found.items()})
+        database.close()
+
+    return results
+
+
+def main():
+    """Time --rows creates and fetches of each model (us/row is the latency)"""
+    args = harness.parser(__doc__.split("\n")[1].strip(), 1000).parse_args()
+    results = harness.in_workspace(run, args.rows, args.repeat)
+    harness.report(results, args.rows, args.output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
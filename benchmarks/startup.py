@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+""" Cold start: new interpreters importing the game and starting the server
+
+    python3 -m benchmarks.startup --rows 10
+"""
+
+
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import harness
+
+
+APP_READY = """
+import sys, types
+import financial_game.model
+import financial_game.webserver
+args = types.SimpleNamespace(secret="secret", debug=False)
+database = financial_game.model.Database("sqlite:///" + sys.argv[1])
+financial_game.webserver.create_app(args)
+database.close()
+"""
+
+
+def start(arguments: [str], times: int):
+    """function() starting a new interpreter with arguments times"""
+
+    def run():
+        for _ in range(0, times):
+            subprocess.run(
+                [sys.executable] + arguments, check=True, stdout=subprocess.DEVNULL
+            )
+
+    return run
+
+
+def cases(database: str, times: int) -> dict:
+    """{name: function()} each starting times interpreters"""
+    return {
+        "interpreter (python -c pass)": start(["-c", "pass"], times),
+        "python -m financial_game --help": start(
+            ["-m", "financial_game", "--help"], times
+        ),
+        "import financial_game.__main__": start(
+            ["-c", "import financial_game.__main__"], times
+        ),
+        "import financial_game.webserver": start(
+            ["-c", "import financial_game.webserver"], times
+        ),
+        "app ready (open database, create_app)": start(
+            ["-c", APP_READY, database], times
+        ),
+    }
+
+
+def main():
+    """Time --rows cold starts of each case (rows/s is starts per second)"""
+    args = harness.parser(__doc__.split("\n")[1].strip(), 10).parse_args()
+
+    with tempfile.TemporaryDirectory() as workspace:
+        database = os.path.join(workspace, "startup.sqlite3")
+        results = {
+            n: harness.measure(f, args.repeat)
+            for n, f in cases(database, args.rows).items()
+        }
+
+    harness.report(results, args.rows, args.output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+""" Table normalize/denormalize throughput for each field type
+
+    python3 -m benchmarks.table --rows 100000
+"""
+
+
+import random
+
+import financial_game.table
+from financial_game.model_bank import TypeOfAccount
+from financial_game.model_user import Statement, AccountPurpose
+from benchmarks import harness
+
+
+def columns(generator: random.Random) -> dict:
+    """{field type name: (column, function() returning a database value)}"""
+    purposes = list(AccountPurpose)
+    account_types = [t.name for t in TypeOfAccount]
+    return {
+        "Integer": (financial_game.table.Integer(), lambda: generator.randint(0, 1000)),
+        "Fixed(2)": (
+            financial_game.table.Fixed(2),
+            lambda: generator.randint(0, 100000),
+        ),
+        "Money": (financial_game.table.Money(), lambda: generator.randint(0, 100000)),
+        "String": (
+            financial_game.table.String(50),
+            lambda: f"name {generator.randint(0, 1000)}",
+        ),
+        "Enum": (
+            financial_game.table.Enum(TypeOfAccount),
+            lambda: generator.choice(account_types),
+        ),
+        "IntEnum": (
+            financial_game.table.IntEnum(AccountPurpose),
+            lambda: generator.choice(purposes).value,
+        ),
+        "Date": (
+            financial_game.table.Date(),
+            lambda: f"2022-{generator.randint(1, 12):02}-15 00:00:00.000",
+        ),
+        "IntDate": (
+            financial_game.table.IntDate(),
+            lambda: generator.randint(15000, 19000),
+        ),
+    }
+
+
+def statement_row(generator: random.Random) -> dict:
+    """A Statement as stored in the database"""
+    start = generator.randint(15000, 19000)
+    return {
+        "id": generator.randint(1, 1000000),
+        "account_id": generator.randint(1, 1000),
+        "start_date": start,
+        "end_date": start + 30,
+        "start_value": 0,
+        "end_value": 0,
+        "withdrawals": generator.randint(0, 100000),
+        "deposits": generator.randint(0, 100000),
+        "interest": generator.randint(0, 1000),
+        "fees": generator.randint(0, 1000),
+        "rate": generator.randint(0, 500),
+        "mileage": None,
+    }
+
+
+def cases(rows: int) -> dict:
+    """{name: function()} converting rows values of each type (and rows Statements)"""
+    generator = random.Random(0)
+    found = {}
+
+    for name, (column, value) in columns(generator).items():
+        stored = [value() for _ in range(0, rows)]
+        usable = [column.normalize(v) for v in stored]
+        found[f"{name} normalize"] = lambda c=column, s=stored: [
+            c.normalize(v) for v in s
+        ]
+        found[f"{name} denormalize"] = lambda c=column, u=usable: [
+            c.denormalize(v) for v in u
+        ]
+
+    stored = [statement_row(generator) for _ in range(0, rows)]
+    statements = [Statement(**r) for r in stored]
+    found["Statement(**row) normalize"] = lambda: [Statement(**r) for r in stored]
+    found["Statement.denormalize()"] = lambda: [s.denormalize() for s in statements]
+    return found
+
+
+def main():
+    """Time converting --rows values of each field type"""
+    args = harness.parser(__doc__.split("\n")[1].strip(), 100000).parse_args()
+    results = {n: harness.measure(f, args.repeat) for n, f in cases(args.rows).items()}
+    harness.report(results, args.rows, args.output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
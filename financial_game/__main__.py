@@ -11,14 +11,22 @@
 ##############################################################
 
 import argparse
+import datetime
 import os
 import sys
 
-import financial_game.webserver
 import financial_game.settings
+import financial_game.backup
+import financial_game.campaign
+import financial_game.email
+import financial_game.database
+import financial_game.delivery
+import financial_game.model
+import financial_game.startup
+import financial_game.table
 
 
-def parse_command_line():
+def parse_command_line():  # pylint: disable=too-many-statements
     """Parses command line options"""
     parser = argparse.ArgumentParser(description="A web-based real-life financial game")
     parser.add_argument(
@@ -62,7 +70,6 @@ def parse_command_line():
     parser.add_argument(
         "--smtp-port",
         dest="smtp_port",
-        default=587,
         type=int,
         help=f"The smtp port ({financial_game.settings.DEFAULT_SMTP_PORT})",
     )
@@ -70,7 +77,6 @@ def parse_command_line():
         "--smtp-server",
         dest="smtp_server",
         type=str,
-        default="smtp.gmail.com",
         help=f"SMTP server ({financial_game.settings.DEFAULT_SMTP_SERVER})",
     )
     parser.add_argument(
@@ -97,39 +103,247 @@ def parse_command_line():
         action="store_true",
         help="Should we use TLS",
     )
+    parser.add_argument(
+        "--smtp-pool-size",
+        dest="smtp_pool_size",
+        type=int,
+        help="Most idle SMTP sessions kept open for reuse "
+        + f"({financial_game.email.SMTP_POOL_SIZE})",
+    )
+    parser.add_argument(
+        "--delivery-workers",
+        dest="delivery_workers",
+        type=int,
+        help="Threads delivering queued emails "
+        + f"({financial_game.delivery.DELIVERY_WORKERS})",
+    )
+    parser.add_argument(
+        "--delivery-rate",
+        dest="delivery_rate",
+        type=float,
+        help="Most queued emails sent per second "
+        + f"({financial_game.delivery.DELIVERY_RATE})",
+    )
+    parser.add_argument(
+        "--digest",
+        dest="digest",
+        type=str,
+        metavar="CHECKPOINT",
+        help="Email every user a digest of their recent statements (then exit), "
+        + "saving progress to (and resuming from) the CHECKPOINT file",
+    )
+    parser.add_argument(
+        "--digest-days",
+        dest="digest_days",
+        type=int,
+        help=f"Days of statements in a --digest ({financial_game.campaign.DIGEST_DAYS})",
+    )
+    parser.add_argument(
+        "--campaign-workers",
+        dest="campaign_workers",
+        type=int,
+        help="Processes rendering --digest emails "
+        + f"({financial_game.campaign.CAMPAIGN_WORKERS})",
+    )
+    parser.add_argument(
+        "--campaign-rate",
+        dest="campaign_rate",
+        type=float,
+        help="Most --digest emails sent per second "
+        + f"({financial_game.campaign.CAMPAIGN_RATE})",
+    )
+    parser.add_argument(
+        "--startup-profile",
+        dest="startup_profile",
+        action="store_true",
+        help="Report the time to import each module and to initialize (then exit)",
+    )
+    parser.add_argument(
+        "--server",
+        dest="server",
+        action="store_true",
+        help="Run under the multi-process production server instead of flask's",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        help="Number of worker processes for --server (2 x cores + 1)",
+    )
+    parser.add_argument(
+        "--threads",
+        dest="threads",
+        type=int,
+        help="Number of threads in each --server worker (4)",
+    )
+    parser.add_argument(
+        "--slow-query-ms",
+        dest="slow_query_ms",
+        type=float,
+        help="Log database statements that take at least this many milliseconds "
+        + "(with their query plan) to <database>.slow_queries.log",
+    )
+    parser.add_argument(
+        "--slow-query-summary",
+        dest="slow_query_summary",
+        type=str,
+        help="Path to a slow query log to summarize (then exit)",
+    )
+    parser.add_argument(
+        "--convert",
+        dest="convert",
+        nargs=2,
+        metavar=("SOURCE", "DESTINATION"),
+        help="Convert a yaml database script to a binary snapshot, "
+        + "or a snapshot to yaml (then exit)",
+    )
+    parser.add_argument(
+        "--backup",
+        dest="backup",
+        type=str,
+        help="Path to back up the database to, while it is in use (then exit)",
+    )
+    parser.add_argument(
+        "--compress",
+        dest="compress",
+        action="store_true",
+        help="gzip the --backup",
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        action="store_true",
+        help="Only add the pages changed since the last --backup to the same path",
+    )
+    parser.add_argument(
+        "--restore",
+        dest="restore",
+        type=str,
+        help="Path of a --backup to restore the database from (then exit) "
+        + "(only valid if db is a file path and the server is not running)",
+    )
     args = financial_game.settings.load(parser.parse_args())
 
-    if args.secret is None:
+    if args.convert:
+        financial_game.model.convert(*args.convert)
+        sys.exit(0)
+
+    if args.slow_query_summary:
+        print_slow_queries(args.slow_query_summary)
+        sys.exit(0)
+
+    if args.secret is None and not financial_game.settings.maintenance(args):
         parser.print_help()
         print(f"You must either specify --secret or set secret in {args.settings}")
         sys.exit(1)
 
     if "://" not in args.database:
 
+        if args.restore:
+            financial_game.backup.restore(args.restore, args.database)
+            sys.exit(0)
+
         if args.reset:
             if not os.path.isfile(args.reset):
                 parser.print_help()
                 print(f"Reset file not found: {args.reset}")
                 sys.exit(1)
 
-            if os.path.isfile(args.database):
-                os.unlink(args.database)
+            for path in (args.database, f"{args.database}-wal", f"{args.database}-shm"):
+                if os.path.isfile(path):
+                    os.unlink(path)
 
         args.database = f"sqlite:///{os.path.abspath(args.database)}"
 
+    if args.slow_query_ms is not None:
+        separator = "&" if "?" in args.database else "?"
+        args.database += f"{separator}slow_query_ms={args.slow_query_ms}"
+
     return args
 
 
+def print_slow_queries(log_path):
+    """Print the summary of a slow query log"""
+    for query in financial_game.database.slow_query_summary(log_path):
+        print(
+            f"{query['count']:6} x {query['total_ms'] / query['count']:9.3f} ms avg "
+            + f"{query['max_ms']:9.3f} ms max: {query['statement']}"
+        )
+        print(f"{'':8}parameters: {query['parameters']}")
+
+        for step in query["plan"]:
+            print(f"{'':8}{'!! ' if step in query['scans'] else ''}{step}")
+
+
+def send_digests(args):
+    """Email every user (after the --digest checkpoint) a digest of their statements"""
+    database = financial_game.model.Database(args.database)
+    end = datetime.date.today()
+    days = args.digest_days
+    start = end - datetime.timedelta(
+        days=financial_game.campaign.DIGEST_DAYS if days is None else days
+    )
+    progress = financial_game.campaign.Campaign(
+        args,
+        f"Your statements from {start.isoformat()} through {end.isoformat()}",
+        financial_game.campaign.digest(start, end),
+        checkpoint=args.digest,
+    ).run()
+    database.close()
+    print(f"{progress['sent']} sent, {progress['failed']} failed")
+
+    for user_id, error in progress["errors"]:
+        print(f"user {user_id}: {error}")
+
+
 def main():
     """main entrypoint"""
     args = parse_command_line()
+
+    if args.backup:  # prepare=False does not create or migrate tables
+        database = financial_game.model.Database(args.database, prepare=False)
+        print(database.backup(args.backup, args.compress, args.incremental))
+        database.close()
+        return
+
+    if args.digest:
+        send_digests(args)
+        return
+
+    if args.startup_profile:
+        imports = financial_game.startup.import_times()
+        steps = financial_game.startup.init_times(args)
+        print("\n".join(financial_game.startup.report(imports, steps)))
+        return
+
+    if args.server:
+        from financial_game.server import (  # pylint: disable=import-outside-toplevel
+            Server,
+        )
+
+        Server(args).run()
+        return
+
+    from financial_game.webserver import (  # pylint: disable=import-outside-toplevel
+        create_app,
+    )
+
     database = financial_game.model.Database(args.database, serialized=args.reset)
-    app = financial_game.webserver.create_app(args)
+    delivery = financial_game.delivery.Delivery(args).start()
+    app = create_app(args, delivery)
+    watcher = financial_game.settings.Watcher(args)
+    delivery.watch(watcher)
+    financial_game.settings.watch_log_level(watcher)
+    financial_game.table.watch(watcher)
+    financial_game.email.watch(watcher)
+    watcher.start()
 
     try:
         app.run(host="0.0.0.0", debug=args.debug, port=args.port)
 
     except KeyboardInterrupt:
+        watcher.stop()
+        delivery.stop()
         database.close()
 
 
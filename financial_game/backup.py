@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+""" Online backups of the database, optionally compressed and incremental
+
+    Incremental backups are a chain of page files: <destination> has every
+    page, <destination>.1, <destination>.2, ... only the pages that changed.
+    <destination>.pages has the sha256 of each page as of the last backup.
+    Page files are PAGES_MAGIC <u32 page size> <u32 page count>
+    then (<u32 page index> <page bytes>) for each page, little endian.
+"""
+
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+
+import financial_game.database
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+PAGES_MAGIC = b"FGPAGES1"
+CHUNK_BYTES = 1024 * 1024  # bytes copied at a time when compressing
+
+
+def open_backup(path: str):
+    """Open a backup file for reading, whether it is gzip compressed or not"""
+    with open(path, "rb") as backup_file:
+        compressed = backup_file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+    return gzip.open(path, "rb") if compressed else open(path, "rb")
+
+
+def create_backup(path: str, compress: bool):
+    """Open a backup file for writing, gzip compressed or not"""
+    return gzip.open(path, "wb") if compress else open(path, "wb")
+
+
+def page_size(path: str) -> int:
+    """The page size from the header of an sqlite database file"""
+    with open(path, "rb") as database_file:
+        database_file.seek(16)
+        (size,) = struct.unpack(">H", database_file.read(2))
+
+    return 65536 if size == 1 else size
+
+
+def increments(destination: str) -> [str]:
+    """The paths of the page files in an incremental backup, oldest first"""
+    paths = [destination] if os.path.isfile(destination) else []
+
+    while os.path.isfile(f"{destination}.{len(paths)}"):
+        paths.append(f"{destination}.{len(paths)}")
+
+    return paths
+
+
+def is_page_file(path: str) -> bool:
+    """Is the backup at path a page file (part of an incremental backup)"""
+    with open_backup(path) as backup_file:
+        return backup_file.read(len(PAGES_MAGIC)) == PAGES_MAGIC
+
+
+def write_increment(copy: str, destination: str, compress: bool) -> str:
+    """Write the pages of copy that changed since the last backup to destination
+    returns the path of the page file written
+    raises ValueError if destination is a full (not incremental) backup
+    """
+    manifest_path = f"{destination}.pages"
+    paths = increments(destination)
+
+    if paths and not is_page_file(destination):
+        raise ValueError(f"Not an incremental backup (use another path): {destination}")
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            previous = json.load(manifest_file) if paths else []
+
+    except FileNotFoundError:
+        previous = []
+
+    path = f"{destination}.{len(paths)}" if paths else destination
+    size = page_size(copy)
+    hashes = []
+
+    with open(copy, "rb") as database_file:
+        with create_backup(path, compress) as page_file:
+            page_count = os.path.getsize(copy) // size
+            page_file.write(PAGES_MAGIC + struct.pack("<II", size, page_count))
+
+            for index in range(0, page_count):
+                page = database_file.read(size)
+                hashes.append(hashlib.sha256(page).hexdigest())
+
+                if index >= len(previous) or previous[index] != hashes[-1]:
+                    page_file.write(struct.pack("<I", index) + page)
+
+    with open(manifest_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(hashes, manifest_file)
+
+    return path
+
+
+def backup(
+    connection,
+    destination: str,
+    compress: bool = False,
+    incremental: bool = False,
+    **options,
+) -> str:
+    """Back up a live database
+    connection - financial_game.database.Connection to back up
+    destination - path of the backup (or the start of an incremental chain)
+    compress - gzip the backup
+    incremental - only store the pages changed since the last backup
+    options - pages and spacing (see Connection.backup)
+    returns the path of the file written
+    """
+    copy = f"{destination}.partial"
+    connection.backup(
+        copy,
+        options.get("pages", financial_game.database.BACKUP_PAGES),
+        options.get("spacing", financial_game.database.BACKUP_SPACING),
+    )
+
+    try:
+        if incremental:
+            return write_increment(copy, destination, compress)
+
+        if compress:
+            with open(copy, "rb") as database_file:
+                with create_backup(destination, True) as backup_file:
+                    shutil.copyfileobj(database_file, backup_file, CHUNK_BYTES)
+
+            return destination
+
+        os.replace(copy, destination)
+        return destination
+
+    finally:
+        if os.path.isfile(copy):
+            os.unlink(copy)
+
+
+def restore(destination: str, output: str):
+    """Rebuild a database file from a backup (or incremental chain)
+    destination - the path passed to backup()
+    output - path of the sqlite database file to write (the database must not be open)
+    """
+    for stale in (f"{output}-wal", f"{output}-shm"):  # would be applied to the restore
+        if os.path.isfile(stale):
+            os.unlink(stale)
+
+    if not is_page_file(destination):
+        with open_backup(destination) as backup_file, open(output, "wb") as out:
+            shutil.copyfileobj(backup_file, out, CHUNK_BYTES)
+
+        return
+
+    with open(output, "wb") as out:
+        for path in increments(destination):
+            with open_backup(path) as page_file:
+                assert page_file.read(len(PAGES_MAGIC)) == PAGES_MAGIC, path
+                size, page_count = struct.unpack("<II", page_file.read(8))
+
+                while True:
+                    header = page_file.read(4)
+
+                    if not header:
+                        break
+
+                    out.seek(struct.unpack("<I", header)[0] * size)
+                    out.write(page_file.read(size))
+
+        out.truncate(page_count * size)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+""" Batches of emails personalized for every user (eg. statement digests)
+
+    Users are read a batch at a time (by name, id), their bodies are
+    rendered from Mako templates in a pool of processes (the next batch
+    renders while this one is delivered), formed into messages and
+    delivered over pooled SMTP sessions, no faster than the rate limit.
+    After each message the (name, id) of its user is written to the
+    checkpoint file, so a campaign that stopped part way resumes with
+    the next user. Use a new checkpoint file for each campaign.
+"""
+
+
+import concurrent.futures
+import datetime
+import functools
+import itertools
+import json
+import os
+import smtplib
+import threading
+
+import financial_game.delivery
+import financial_game.email
+import financial_game.template
+from financial_game.model_user import User
+
+
+CAMPAIGN_BATCH = 100  # users read (and rendered) at a time
+CAMPAIGN_WORKERS = 2  # processes rendering bodies
+CAMPAIGN_RATE = 5.0  # most messages per second handed to the SMTP server
+DIGEST_DAYS = 30  # days of statements in a digest
+DIGEST_HTML = "templates/digest.html.mako"
+DIGEST_TEXT = "templates/digest.txt.mako"
+
+
+def digest(start: datetime.date = None, end: datetime.date = None):
+    """Template arguments for a digest of the user's statements from start to end
+    returns context(user) -> {"user_name", "start", "end", "totals": {purpose: totals}}
+        purpose is the AccountPurpose name (or "OTHER") see User.purpose_totals()
+    """
+
+    def context(user: User) -> dict:
+        totals = user.purpose_totals(start, end)
+        return {
+            "user_name": user.name,
+            "start": start,
+            "end": end,
+            "totals": {
+                "OTHER" if p is None else p.name: totals[p]
+                for p in sorted(totals, key=lambda p: 0 if p is None else p.value)
+            },
+        }
+
+    return context
+
+
+def render_bodies(html_template: str, text_template: str, arguments: dict):
+    """The (html, text) bodies of a message (either template may be None)"""
+    return tuple(
+        None if t is None else financial_game.template.render(t, **arguments)
+        for t in (html_template, text_template)
+    )
+
+
+def read_checkpoint(path: str) -> dict:
+    """The progress saved at path: {"after": (name, id) or None, "sent", "failed"}"""
+    if path is None or not os.path.isfile(path):
+        return {"after": None, "sent": 0, "failed": 0}
+
+    with open(path, "r", encoding="utf-8") as checkpoint_file:
+        saved = json.load(checkpoint_file)
+
+    return {**saved, "after": None if saved["after"] is None else tuple(saved["after"])}
+
+
+def write_checkpoint(path: str, progress: dict):
+    """Atomically replace the progress saved at path"""
+    with open(path + ".tmp", "w", encoding="utf-8") as checkpoint_file:
+        json.dump(progress, checkpoint_file)
+
+    os.replace(path + ".tmp", path)
+
+
+class Campaign:  # pylint: disable=too-many-instance-attributes
+    """Sends a message personalized for every user"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        args,
+        subject: str,
+        context,
+        html_template: str = DIGEST_HTML,
+        text_template: str = DIGEST_TEXT,
+        checkpoint: str = None,
+    ):
+        """args - smtp settings passed to financial_game.email.deliver
+            (args.campaign_workers or CAMPAIGN_WORKERS) processes rendering bodies
+            (args.campaign_rate or CAMPAIGN_RATE) most messages per second
+            (args.campaign_batch or CAMPAIGN_BATCH) users read at a time
+        subject - the subject of every message
+        context - context(user) returns the template arguments for the user
+        html_template, text_template - Mako templates of the bodies (None for no body)
+        checkpoint - path to save progress to (and resume from)
+        """
+        workers = getattr(args, "campaign_workers", None)
+        rate = getattr(args, "campaign_rate", None)
+        batch = getattr(args, "campaign_batch", None)
+        self.__args = args
+        self.__subject = subject
+        self.__context = context
+        self.__templates = (html_template, text_template)
+        self.__checkpoint = checkpoint
+        self.__workers = CAMPAIGN_WORKERS if workers is None else workers
+        self.__delay = financial_game.delivery.rate_limiter(
+            CAMPAIGN_RATE if rate is None else rate
+        )
+        self.__batch = CAMPAIGN_BATCH if batch is None else batch
+        self.__stopping = threading.Event()
+        self.__progress = read_checkpoint(checkpoint)
+        self.__errors = []
+
+    def __users(self, after: (str, int)) -> list:
+        return User.every(after=after, limit=self.__batch)
+
+    def __rendered(self, executor):
+        """Generates (user, (html, text)), rendering the next batch in the background"""
+
+        def render(users):
+            return executor.map(
+                functools.partial(render_bodies, *self.__templates),
+                [self.__context(u) for u in users],
+            )
+
+        users = self.__users(self.__progress["after"])
+        bodies = render(users)
+
+        while users:
+            following = self.__users((users[-1].name, users[-1].id))
+            following_bodies = render(following)
+            yield from zip(users, bodies)
+            users, bodies = following, following_bodies
+
+    def run(self, limit: int = None) -> dict:
+        """Send to the users after the checkpoint, returns to_dict()
+        limit - most messages to send (None for every remaining user)
+        raises the delivery error unless retrying cannot help (checkpoint is before it)
+        """
+        self.__stopping.clear()
+
+        with concurrent.futures.ProcessPoolExecutor(self.__workers) as executor:
+            rendered = self.__rendered(executor)
+
+            for user, (html, text) in itertools.islice(rendered, limit):
+                if self.__stopping.wait(self.__delay()):
+                    break
+
+                self.__send(user, html, text)
+
+            rendered.close()
+
+        return self.to_dict()
+
+    def __send(self, user: User, html: str, text: str):
+        message = financial_game.email.form(
+            self.__args, user.email, self.__subject, html, text
+        )
+
+        try:
+            financial_game.email.deliver(self.__args, user.email, message)
+            self.__progress["sent"] += 1
+
+        except (smtplib.SMTPException, OSError) as error:
+            if not financial_game.delivery.permanent(error):
+                raise
+
+            self.__progress["failed"] += 1
+            self.__errors.append((user.id, str(error)))
+
+        self.__progress["after"] = (user.name, user.id)
+
+        if self.__checkpoint is not None:
+            write_checkpoint(self.__checkpoint, self.__progress)
+
+    def stop(self):
+        """Stop run() after the message being sent"""
+        self.__stopping.set()
+
+    def to_dict(self) -> dict:
+        """Progress: {"after": (name, id) of the last user, "sent", "failed",
+        "errors": [(user id, error) this run]}
+        """
+        return {**self.__progress, "errors": list(self.__errors)}
@@ -10,6 +10,15 @@ import queue
 import types
 import urllib.parse
 import enum
+import time
+import json
+import datetime
+import logging
+import logging.handlers
+import os
+import contextlib
+
+import financial_game.metrics
 
 
 class JoinType(enum.Enum):
@@ -36,44 +45,229 @@ class Join:
         return [self][item]
 
 
+SLOW_QUERY_LOG_BYTES = 1024 * 1024  # size of slow query log before rotating
+SLOW_QUERY_LOG_BACKUPS = 5  # number of rotated slow query logs to keep
+BACKUP_PAGES = 256  # database pages copied in each backup step
+BACKUP_SPACING = 0.01  # seconds between backup steps for other statements to run
+IN_MEMORY = ("", ":memory:")  # sqlite paths that are not a database file
+JOURNAL_MODE = (
+    "wal"  # of database files, readers (exports, backups) do not block writers
+)
+JOURNAL_MODES = ("delete", "truncate", "persist", "memory", "wal", "off")
+
+
+def parameter_shapes(replacements: any) -> any:
+    """The types (not values) of statement parameters"""
+    if replacements is None:
+        return None
+
+    if isinstance(replacements, dict):
+        return {
+            n: type(v).__name__
+            for n, v in sorted(replacements.items())
+            if not n.startswith("_")
+        }
+
+    return [type(v).__name__ for v in replacements]
+
+
+def slow_query_logger(path: str) -> logging.Logger:
+    """Get the (rotating) logger for slow queries written to path"""
+    logger = logging.getLogger(f"financial_game.slow_queries.{os.path.abspath(path)}")
+
+    if not logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(
+            path,
+            maxBytes=SLOW_QUERY_LOG_BYTES,
+            backupCount=SLOW_QUERY_LOG_BACKUPS,
+            encoding="utf-8",
+            delay=True,
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    return logger
+
+
+def slow_query_summary(path: str) -> [dict]:
+    """Summarize a slow query log (and its rotated backups), slowest total first
+    returns [{statement, count, total_ms, max_ms, parameters, plan, scans}]
+    """
+    paths = [f"{path}.{i}" for i in range(SLOW_QUERY_LOG_BACKUPS, 0, -1)] + [path]
+    summary = {}
+
+    for log_path in [p for p in paths if os.path.isfile(p)]:
+        with open(log_path, "r", encoding="utf-8") as log_file:
+            for line in log_file:
+                entry = json.loads(line)
+                info = summary.setdefault(
+                    entry["statement"],
+                    {"statement": entry["statement"], "count": 0, "total_ms": 0.0},
+                )
+                info["count"] += 1
+                info["total_ms"] += entry["ms"]
+                info["max_ms"] = max(info.get("max_ms", 0.0), entry["ms"])
+                info["parameters"] = entry["parameters"]
+                info["plan"] = entry["plan"]
+                info["scans"] = [p for p in entry["plan"] if p.startswith("SCAN")]
+
+    return sorted(summary.values(), key=lambda i: i["total_ms"], reverse=True)
+
+
 class Sqlite:
     """Basic kernel for sqlite3 database"""
 
-    def __init__(self, description):
+    def __init__(
+        self,
+        description,
+        slow_query_ms=None,
+        slow_query_log=None,
+        journal_mode=JOURNAL_MODE,
+    ):
+        """Open the database
+        slow_query_ms - log statements that take at least this many milliseconds
+        slow_query_log - (<description>.slow_queries.log) where to log them
+        journal_mode - set on a database file (None leaves it as it is)
+            wal is stored in the file and adds <file>-wal and <file>-shm while open
+        """
         self.__db = sqlite3.connect(description)
         self.__thread = threading.current_thread().ident
 
+        if journal_mode is not None and journal_mode.lower() not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal_mode: {journal_mode}")
+
+        if journal_mode is not None and description not in IN_MEMORY:
+            self.__db.execute(f"PRAGMA journal_mode={journal_mode};")
+
+        self.__slow_query_ms = slow_query_ms
+        self.__slow_queries = (
+            None
+            if slow_query_ms is None
+            else slow_query_logger(
+                f"{description}.slow_queries.log"
+                if slow_query_log is None
+                else slow_query_log
+            )
+        )
+
+    def __log_slow_query(self, statement, replacements, milliseconds):
+        try:
+            plan = [
+                r[3]
+                for r in self.__db.execute(
+                    f"EXPLAIN QUERY PLAN {statement}",
+                    tuple() if replacements is None else replacements,
+                ).fetchall()
+            ]
+
+        except sqlite3.Error as error:
+            plan = [f"ERROR: {error}"]
+
+        self.__slow_queries.info(
+            json.dumps(
+                {
+                    "time": datetime.datetime.now().isoformat(),
+                    "ms": milliseconds,
+                    "statement": statement,
+                    "parameters": parameter_shapes(replacements),
+                    "plan": plan,
+                }
+            )
+        )
+
+    # pylint: disable=too-many-arguments
     def execute(
         self,
         statement: str,
         replacements: any = None,
         fetch_all: bool = None,
         commit: bool = False,
+        many: bool = False,
     ) -> (int, [str], list, int):
         """Executes an sqlite3 statement
         replacements - dictionary (:name -> dict['name']) or list (? -> [0])
         fetch_all - None= no values to return, False = fetch one or none
         commit - tell the database to commit after executing
+        many - replacements is a list of replacements, execute once for each
         """
         assert (
             self.__thread == threading.current_thread().ident
         ), f"Thread mismatch {self.__thread} bs {threading.current_thread().ident}"
+        start = time.perf_counter()
         cursor = self.__db.cursor()
-        cursor.execute(statement, tuple() if replacements is None else replacements)
 
-        if commit:
-            self.__db.commit()
+        if many:
+            cursor.executemany(statement, replacements)
+        else:
+            cursor.execute(statement, tuple() if replacements is None else replacements)
 
-        if fetch_all is not None:
+        if fetch_all is not None:  # before commit, which fails while rows are pending
             results = cursor.fetchall() if fetch_all else cursor.fetchone()
         else:
             results = None
 
+        if commit:
+            self.__db.commit()
+
         labels = (
             [] if cursor.description is None else [c[0] for c in cursor.description]
         )
+        milliseconds = 1000.0 * (time.perf_counter() - start)
+
+        if self.__slow_query_ms is not None and milliseconds >= self.__slow_query_ms:
+            self.__log_slow_query(
+                statement, replacements[0] if many else replacements, milliseconds
+            )
+
         return cursor.lastrowid, labels, results, cursor.rowcount
 
+    def iterate(
+        self, statement: str, replacements: any = None, batch_size: int = 1000
+    ) -> ([str], list):
+        """Yields (labels, rows) for a query, fetching batch_size rows at a time
+        replacements - dictionary (:name -> dict['name']) or list (? -> [0])
+        """
+        assert (
+            self.__thread == threading.current_thread().ident
+        ), f"Thread mismatch {self.__thread} bs {threading.current_thread().ident}"
+        cursor = self.__db.cursor()
+        cursor.execute(statement, tuple() if replacements is None else replacements)
+        labels = [c[0] for c in cursor.description]
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+
+            if not rows:
+                break
+
+            yield labels, rows
+
+    def backup(
+        self, path: str, pages: int = BACKUP_PAGES, spacing=BACKUP_SPACING, between=None
+    ):
+        """Copy the database to path, pages at a time, while it is in use
+        spacing - seconds to pause between steps so others can write
+        between - called between steps instead of pausing
+        """
+        assert (
+            self.__thread == threading.current_thread().ident
+        ), f"Thread mismatch {self.__thread} bs {threading.current_thread().ident}"
+        target = sqlite3.connect(path)
+
+        try:
+            self.__db.backup(
+                target,
+                pages=pages,
+                progress=lambda *_: (
+                    time.sleep(spacing) if between is None else between()
+                ),
+            )
+
+        finally:
+            target.close()
+
     def close(self):
         """Close the database"""
         self.__db.close()
@@ -82,52 +276,95 @@ class Sqlite:
 class Threadsafe(threading.Thread):
     """Wrapper to make a database kernel threadsafe"""
 
-    def __init__(self, description, db_type):
+    def __init__(self, description, db_type, **options):
+        """Start the thread that owns the database
+        options - passed on to db_type
+        """
         self.__description = description
         self.__type = db_type
+        self.__options = options
         self.__messages = queue.Queue()
+        self.__closing = False
         threading.Thread.__init__(self, daemon=True)
         self.start()
 
     def run(self):
         """handle the messages"""
-        database = self.__type(self.__description)
+        database = self.__type(self.__description, **self.__options)
 
-        while True:
+        while not self.__closing:
             message = self.__messages.get()
 
             if message is None:
                 break
 
-            message[1].put(database.execute(**message[0]))
+            Threadsafe.__handle(database, message)
 
         database.close()
 
+    @staticmethod
+    def __handle(database, message):
+        try:
+            message[1].put(message[0](database))
+
+        except sqlite3.Error as error:
+            message[1].put(error)
+
+    def __serve(self, database, seconds: float):
+        """Handle messages for up to seconds (between backup steps)"""
+        deadline = time.perf_counter() + seconds
+
+        while not self.__closing and time.perf_counter() < deadline:
+            try:
+                message = self.__messages.get(
+                    timeout=max(0.0, deadline - time.perf_counter())
+                )
+
+            except queue.Empty:
+                return
+
+            if message is None:
+                self.__closing = True
+            else:
+                Threadsafe.__handle(database, message)
+
+    def __call(self, function):
+        """Call function(database) on the execution thread and return its result"""
+        response = queue.Queue()
+        self.__messages.put((function, response))
+        result = response.get()
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    # pylint: disable=too-many-arguments
     def execute(
         self,
         statement: str,
         replacements: tuple = None,
         fetch_all: bool = None,
         commit: bool = False,
+        many: bool = False,
     ) -> (int, [str], list):
         """Pass an sqlite3 statement to the execution thread
         replacements - dictionary (:name -> dict['name']) or list (? -> [0])
         fetch_all - None= no values to return, False = fetch one or none
         commit - tell the database to commit after executing
+        many - replacements is a list of replacements, execute once for each
         """
-        response = queue.Queue()
-        self.__messages.put(
-            (
-                {
-                    "statement": statement,
-                    "replacements": replacements,
-                    "fetch_all": fetch_all,
-                    "commit": commit,
-                },
-                response,
-            )
+        return self.__call(
+            lambda d: d.execute(statement, replacements, fetch_all, commit, many)
+        )
+
+    def backup(self, path: str, pages: int = BACKUP_PAGES, spacing=BACKUP_SPACING):
+        """Copy the database to path on the execution thread, pages at a time
+        Other threads' statements are run for spacing seconds between steps
+        """
+        return self.__call(
+            lambda d: d.backup(path, pages, between=lambda: self.__serve(d, spacing))
         )
-        return response.get()
 
     def close(self):
         """pass the close message to the execution thread and wait for completion"""
@@ -135,7 +372,7 @@ class Threadsafe(threading.Thread):
         self.join()
 
 
-class Connection:
+class Connection:  # pylint: disable=too-many-public-methods
     """A database connection"""
 
     ACCPEPTED_SCHEMES = ["sqlite"]
@@ -143,7 +380,8 @@ class Connection:
     @staticmethod
     def connect(url: str, default_return_objects=True):
         """Connect to a database
-        url - sqlite://<path>?threadsafe=true
+        url - sqlite://<path>?threadsafe=true&slow_query_ms=100&slow_query_log=<path>
+            &journal_mode=delete (see JOURNAL_MODE)
         """
         parts = urllib.parse.urlparse(url)
         assert parts.scheme in Connection.ACCPEPTED_SCHEMES, parts.scheme
@@ -151,20 +389,49 @@ class Connection:
 
         if parts.scheme == "sqlite":
             query = urllib.parse.parse_qs(parts.query)
+            options = {}
+
+            if "slow_query_ms" in query:
+                options["slow_query_ms"] = float(query["slow_query_ms"][-1])
+
+            if "slow_query_log" in query:
+                options["slow_query_log"] = query["slow_query_log"][-1]
+
+            if "journal_mode" in query:
+                options["journal_mode"] = query["journal_mode"][-1]
 
             if "false" in [v.lower() for v in query.get("threadsafe", [])]:
-                database = Sqlite(parts.path)
+                database = Sqlite(parts.path, **options)
             else:
-                database = Threadsafe(parts.path, Sqlite)
+                database = Threadsafe(parts.path, Sqlite, **options)
 
-        return Connection(database, default_return_objects)
+        return Connection(database, default_return_objects, url)
 
-    def __init__(self, database, default_return_objects=True):
+    def __init__(self, database, default_return_objects=True, url=None):
         """Create the connection
         database - an instance of Sqlite or equivalent
+        url - the url the database was opened with (if any)
         """
         self.__db = database
+        self.__transaction = threading.RLock()  # held by the thread in transaction()
         self.default_return_objects = default_return_objects
+        self.url = url
+
+    def reader(self):
+        """A new connection to the same database for use only on this thread
+        Its queries do not wait behind other threads' queries and it can
+        fetch_each() (stream) results, for long reads like exports.
+        raises ValueError for an in-memory database (a reader would see an empty one)
+        """
+        assert self.url is not None, "Connection was not opened from a url"
+        parts = urllib.parse.urlparse(self.url)
+
+        if parts.path in IN_MEMORY:
+            raise ValueError(f"Only a database file can have readers: {self.url}")
+
+        return Connection(
+            Sqlite(parts.path, journal_mode=None), self.default_return_objects
+        )
 
     @staticmethod
     def __convert(description: [str], row: list, as_object: bool):
@@ -174,28 +441,51 @@ class Connection:
         data = dict(zip(description, row))
         return types.SimpleNamespace(**data) if as_object else data
 
+    def __execute(self, statement, replacements, **options):
+        with self.__transaction, financial_game.metrics.measure("db"):
+            return self.__db.execute(statement, replacements, **options)
+
     def execute(
         self, sql_command: str, replacements: any, commit: bool = True
     ) -> (int, [str], list, int):
         """execute SQL command w/ the given replacements and optionally committing"""
-        return self.__db.execute(sql_command, replacements, commit=commit)
+        return self.__execute(sql_command, replacements, commit=commit)
 
     def fetch_one_or_none(self, _sql_command_: str, **_replacements_) -> any:
         """Return the first match or None if no matches
         _as_object_ - (True) If True return objects, False return dictionaries
         """
         as_object = _replacements_.get("_as_object_", self.default_return_objects)
-        results = self.__db.execute(_sql_command_, _replacements_, fetch_all=False)
+        results = self.__execute(_sql_command_, _replacements_, fetch_all=False)
         return Connection.__convert(results[1], results[2], as_object)
 
     def fetch_all(self, _sql_command_: str, **_replacements_) -> [any]:
         """Return all results from the query
         _as_objects_ - (True) If True return objects, False return dictionaries
+        _commit_ - (False) commit after the query (eg. UPDATE ... RETURNING)
         """
         as_objects = _replacements_.get("_as_objects_", self.default_return_objects)
-        results = self.__db.execute(_sql_command_, _replacements_, fetch_all=True)
+        commit = _replacements_.get("_commit_", False)
+        results = self.__execute(
+            _sql_command_, _replacements_, fetch_all=True, commit=commit
+        )
         return [Connection.__convert(results[1], r, as_objects) for r in results[2]]
 
+    def fetch_each(self, _sql_command_: str, **_replacements_) -> any:
+        """Yield each result of the query, without holding all results in memory
+        Only for kernels that can iterate (Sqlite, see reader())
+        _as_objects_ - (True) If True return objects, False return dictionaries
+        _batch_size_ - (1000) number of rows to fetch from the database at a time
+        """
+        as_objects = _replacements_.get("_as_objects_", self.default_return_objects)
+        batch_size = _replacements_.get("_batch_size_", 1000)
+
+        for labels, rows in self.__db.iterate(
+            _sql_command_, _replacements_, batch_size
+        ):
+            for row in rows:
+                yield Connection.__convert(labels, row, as_objects)
+
     def create_table(self, _table_name_: str, **_description_):
         """Create a table
         _table_name_ - the name of the table to create
@@ -203,7 +493,9 @@ class Connection:
         _if_not_exists_ - (True) If True add the "IF NOT EXISTS" clause
         """
         if_not_exists = _description_.get("_if_not_exists_", True)
-        description_string = ", ".join(f'"{n}" {v}' for n, v in _description_.items())
+        description_string = ", ".join(
+            f'"{n}" {v}' for n, v in _description_.items() if not n.startswith("_")
+        )
         exists_string = " IF NOT EXISTS" if if_not_exists else ""
         self.execute(
             f"""CREATE TABLE{exists_string} "{_table_name_}" ({description_string});""",
@@ -219,9 +511,84 @@ class Connection:
         if_not_exists = _description_.get("_if_not_exists_", True)
 
         for table_name, table_description in _description_.items():
-            self.create_table(
-                table_name, **table_description, _if_not_exists_=if_not_exists
+            if not table_name.startswith("_"):
+                self.create_table(
+                    table_name, **table_description, _if_not_exists_=if_not_exists
+                )
+
+    def create_index(self, _table_name_: str, *_columns_, **_options_):
+        """Create an index on columns of a table
+        _table_name_ - the table to index
+        _columns_ - the columns to index, in order
+        _name_ - (<table>_<column>_<column>...) name of the index
+        _if_not_exists_ - (True) If True add the "IF NOT EXISTS" clause
+        """
+        name = _options_.get("_name_", "_".join([_table_name_, *_columns_]))
+        exists_string = (
+            " IF NOT EXISTS" if _options_.get("_if_not_exists_", True) else ""
+        )
+        column_string = ", ".join(f'"{c}"' for c in _columns_)
+        self.execute(
+            f"""CREATE INDEX{exists_string} "{name}" ON "{_table_name_}" ({column_string});""",
+            {},
+            commit=False,
+        )
+
+    def create_indexes(self, **_indexes_):
+        """Create indexes from descriptions
+        _indexes_ - keyword arguments of table=[(column, column, ...), ...]
+        _if_not_exists_ - (True) If True add the "IF NOT EXISTS" clause
+        """
+        if_not_exists = _indexes_.get("_if_not_exists_", True)
+
+        for table_name, indexes in _indexes_.items():
+            if not table_name.startswith("_"):
+                for columns in indexes:
+                    self.create_index(
+                        table_name, *columns, _if_not_exists_=if_not_exists
+                    )
+
+    def table_columns(self, _table_name_: str) -> dict:
+        """Get {column name: declared type} for a table ({} if it does not exist)"""
+        return {
+            c["name"]: c["type"]
+            for c in self.fetch_all(
+                f"""PRAGMA table_info("{_table_name_}");""", _as_objects_=False
             )
+        }
+
+    def rebuild_table(self, _table_name_: str, _description_: dict, **_conversions_):
+        """Recreate a table with a new description, converting the existing rows
+        _description_ - column name mapped to SQL description (as in create_table)
+        _conversions_ - column name mapped to an SQL expression of the old columns
+            (columns not listed are copied as is)
+        _commit_ - (True) If False the caller's transaction() is used
+        """
+        if _conversions_.pop("_commit_", True):
+            with self.transaction():
+                self.rebuild_table(
+                    _table_name_, _description_, _commit_=False, **_conversions_
+                )
+
+            return
+
+        columns = [c for c in _description_ if not c.startswith("_")]
+        expressions = ", ".join(_conversions_.get(c, c) for c in columns)
+        column_string = ", ".join(f'"{c}"' for c in columns)
+        rebuilt = f"_rebuilt_{_table_name_}"
+        self.create_table(rebuilt, **_description_, _if_not_exists_=False)
+        self.execute(
+            f"""INSERT INTO "{rebuilt}" ({column_string}) """
+            + f"""SELECT {expressions} FROM "{_table_name_}";""",
+            None,
+            commit=False,
+        )
+        self.execute(f"""DROP TABLE "{_table_name_}";""", None, commit=False)
+        self.execute(
+            f"""ALTER TABLE "{rebuilt}" RENAME TO "{_table_name_}";""",
+            None,
+            commit=False,
+        )
 
     def insert(self, _table_name_: str, **_data_) -> any:
         """Insert a new row in the table
@@ -251,6 +618,51 @@ class Connection:
 
         return types.SimpleNamespace(**_data_) if as_object else _data_
 
+    def insert_many(self, _table_name_: str, _rows_: [dict], **_options_) -> int:
+        """Insert rows (all with the same columns) with one executemany
+        _table_name_ - the table to insert data into
+        _rows_ - list of maps of column name to data to put in the table
+        _commit_ - (True) should a commit be done after the operation
+        returns the number of rows inserted
+        """
+        if not _rows_:
+            return 0
+
+        columns = sorted(_rows_[0])
+        placeholders = ", ".join("?" for _ in range(0, len(columns)))
+        column_string = ", ".join(f"{c}" for c in columns)
+        results = self.__execute(
+            f"""INSERT INTO {_table_name_} ({column_string}) VALUES({placeholders});""",
+            [[r[c] for c in columns] for r in _rows_],
+            commit=_options_.get("_commit_", True),
+            many=True,
+        )
+        assert results[3] == len(_rows_), f"Not all rows were inserted {results}"
+        return results[3]
+
+    @contextlib.contextmanager
+    def transaction(self, immediate=False):
+        """Run the enclosed statements (with _commit_=False) in one transaction
+        The transaction is rolled back if there is an exception
+        immediate - take the write lock before the first statement (BEGIN IMMEDIATE)
+            so nothing read in the transaction can change before it writes
+        Other threads' statements on this connection wait until it is done
+        (so they are not run, or committed, in the middle of it)
+        """
+        with self.__transaction:
+            self.execute(
+                "BEGIN IMMEDIATE;" if immediate else "BEGIN;", None, commit=False
+            )
+
+            try:
+                yield self
+
+            except BaseException:
+                self.execute("ROLLBACK;", None, commit=False)
+                raise
+
+            self.execute("COMMIT;", None, commit=False)
+
     def change(self, _table_name_, *_where_columns_, **_data_):
         """Insert a new row in the table
         _table_name_ - the table to insert data into
@@ -301,23 +713,101 @@ class Connection:
         _table_name_ - The table to query
         _where_ - The WHERE clause
         _join_ - A Join object or list of Join objects
+        _group_by_ - A column (or list of columns) to group results by
+        _order_by_ - A column (or list of columns) to sort by
+        _descending_ - (False) If True sort by _order_by_ from largest to smallest
+        _limit_ - most results to return (None for all)
+        _offset_ - number of results to skip
+        _after_ - values of the _order_by_ columns of the last result of the previous
+                    page, only results sorted after it are returned (keyset pagination,
+                    the last _order_by_ column should be unique, eg. id)
         _columns_ - list the names of any columns you want returned or none for all columns
         _replacements_ - :name in where will be replaced with name=value
         _as_objects_ - (True) If True return objects, False return dictionaries
         """
-        where = _replacements_.get("_where_", None)
+        where = Connection.__after_clause(_replacements_)
         column_string = (
             "*" if len(_columns_) == 0 else ", ".join(f"{c}" for c in _columns_)
         )
         where_string = "" if where is None else f" WHERE {where}"
         join_clause = _replacements_.get("_join_", [""])
         join_string = "".join(str(j) for j in join_clause)
+        group_by = Connection.__column_list(_replacements_, "_group_by_")
+        group_string = f" GROUP BY {', '.join(group_by)}" if group_by else ""
         return self.fetch_all(
-            f"""SELECT {column_string} FROM {_table_name_}{join_string}{where_string};""",
+            f"""SELECT {column_string} FROM {_table_name_}{join_string}{where_string}"""
+            + f"""{group_string}{Connection.__order_clause(_replacements_)};""",
             **_replacements_,
         )
-        # group_by:list=None, order_clause=None
-        # order_ascending=True, limit=None, offset=None
+
+    def aggregate(self, _table_name_: str, **_replacements_) -> [any]:
+        """Get sums and counts, optionally per group, calculated by the database
+        _table_name_ - The table to query
+        _group_by_ - A column (or list of columns) to group by (None for one result)
+        _sums_ - list of columns to total, returned as sum_<column> (0 if no rows)
+        _counts_ - (True) True for count (rows), or list of columns to count
+                    the non-null values of, returned as count_<column>
+        _where_, _join_, _order_by_ (default _group_by_), _as_objects_ - see get_all
+        returns one result per group, group columns are returned by name (no table)
+        """
+        group_by = Connection.__column_list(_replacements_, "_group_by_")
+        counts = _replacements_.get("_counts_", True)
+        columns = [f"{c} AS {c.split('.')[-1]}" for c in group_by]
+        columns.extend(
+            f"COALESCE(SUM({c}), 0) AS sum_{c.split('.')[-1]}"
+            for c in _replacements_.get("_sums_", [])
+        )
+        columns.extend(
+            ["COUNT(*) AS count"]
+            if counts is True
+            else [f"COUNT({c}) AS count_{c.split('.')[-1]}" for c in counts or []]
+        )
+        assert columns, "Nothing to aggregate"
+        _replacements_.setdefault("_order_by_", group_by)
+        return self.get_all(_table_name_, *columns, **_replacements_)
+
+    @staticmethod
+    def __column_list(options: dict, name: str) -> [str]:
+        """The column (or columns) in options[name] as a list"""
+        value = options.get(name, None)
+        return [value] if isinstance(value, str) else list(value or [])
+
+    @staticmethod
+    def __after_clause(options: dict) -> str:
+        """The WHERE clause (or None) with the _after_ comparison added
+        adds the _after_ values to options as :_after<n>_
+        """
+        where = options.get("_where_", None)
+        after = options.get("_after_", None)
+
+        if after is None:
+            return where
+
+        columns = Connection.__column_list(options, "_order_by_")
+        assert len(after) == len(columns), f"_after_ {after} does not match {columns}"
+        names = [f"_after{i}_" for i in range(0, len(columns))]
+        options.update(zip(names, after))
+        comparison = "<" if options.get("_descending_", False) else ">"
+        keyset = (
+            f"({', '.join(columns)}) {comparison} ({', '.join(':' + n for n in names)})"
+        )
+        return keyset if where is None else f"({where}) AND {keyset}"
+
+    @staticmethod
+    def __order_clause(options: dict) -> str:
+        """The ORDER BY, LIMIT and OFFSET clauses for get_all() options"""
+        columns = Connection.__column_list(options, "_order_by_")
+        direction = " DESC" if options.get("_descending_", False) else ""
+        order_string = "".join(
+            f"{', ' if i else ' ORDER BY '}{c}{direction}"
+            for i, c in enumerate(columns)
+        )
+        has_limit = options.get("_limit_", None) is not None
+        has_offset = options.get("_offset_", None) is not None
+        limit_string = " LIMIT :_limit_" if has_limit else ""
+        limit_string += " LIMIT -1" if has_offset and not has_limit else ""
+        offset_string = " OFFSET :_offset_" if has_offset else ""
+        return f"{order_string}{limit_string}{offset_string}"
 
     def delete(self, _table_name_: str, _where_: str, **_replacements_) -> int:
         """delete a row from the table
@@ -333,6 +823,13 @@ class Connection:
         )
         return results[3]
 
+    def backup(self, path: str, pages: int = BACKUP_PAGES, spacing=BACKUP_SPACING):
+        """Copy the database to path (sqlite file) while it is in use
+        pages - database pages copied in each step
+        spacing - seconds between steps for other statements to run
+        """
+        self.__db.backup(path, pages, spacing)
+
     def close(self):
         """Close out the database"""
         self.__db.close()
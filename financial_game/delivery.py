@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+""" Background delivery of the emails in the outbox
+
+    Request handlers enqueue() (one insert) and return, a pool of worker
+    threads claims due messages and hands them to the SMTP server, no
+    faster than the rate limit. Failed attempts are retried with
+    exponential backoff, permanent failures and messages that fail
+    max_attempts times are dead-lettered (see Outbox.dead()).
+    Database errors (another process holding the lock) are logged and the
+    worker backs off for ERROR_SECONDS.
+"""
+
+
+import logging
+import smtplib
+import sqlite3
+import threading
+import time
+
+import financial_game.email
+import financial_game.metrics
+import financial_game.settings
+from financial_game.model_outbox import Outbox
+
+
+DELIVERY_WORKERS = 2  # threads delivering messages
+DELIVERY_RATE = 5.0  # most messages per second handed to the SMTP server
+MAX_ATTEMPTS = 6  # attempts before a message is dead-lettered
+RETRY_SECONDS = 30.0  # wait before the first retry, doubles with each attempt
+RETRY_MAX_SECONDS = 3600.0  # longest wait between attempts
+POLL_SECONDS = 1.0  # longest a worker waits before looking for due messages
+ERROR_SECONDS = 5.0  # wait after a database error before trying again
+LATENCY_BUCKETS = (1, 5, 15, 60, 300, 900, 3600, 14400, 86400)  # seconds
+
+
+def backoff(attempts: int) -> float:
+    """Seconds to wait after a message has failed attempts times"""
+    return min(RETRY_SECONDS * pow(2, attempts - 1), RETRY_MAX_SECONDS)
+
+
+def permanent(error: Exception) -> bool:
+    """Will retrying never help (the server rejected the message or recipient)"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+
+    return (
+        isinstance(error, smtplib.SMTPResponseException)
+        and 500 <= error.smtp_code < 600
+    )
+
+
+def rate_limiter(rate: float):
+    """Spaces out events so there are at most rate per second
+    returns delay(), which reserves the next slot and returns the seconds until it
+    """
+    spacing = 1.0 / rate
+    lock = threading.Lock()
+    next_slot = [time.monotonic()]
+
+    def delay() -> float:
+        with lock:
+            now = time.monotonic()
+            start = max(now, next_slot[0])
+            next_slot[0] = start + spacing
+
+        return start - now
+
+    return delay
+
+
+class Delivery:  # pylint: disable=too-many-instance-attributes
+    """Worker threads that deliver the outbox"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        args,
+        workers: int = None,
+        rate: float = None,
+        max_attempts: int = MAX_ATTEMPTS,
+        poll: float = POLL_SECONDS,
+    ):
+        """args - smtp settings passed to financial_game.email.deliver
+        workers - (args.delivery_workers or DELIVERY_WORKERS) number of threads
+        rate - (args.delivery_rate or DELIVERY_RATE) most messages per second
+        max_attempts - attempts before a message is dead-lettered
+        poll - longest to wait before looking for due messages
+        """
+        workers = (
+            getattr(args, "delivery_workers", None) if workers is None else workers
+        )
+        rate = getattr(args, "delivery_rate", None) if rate is None else rate
+        self.__args = args
+        self.__workers = DELIVERY_WORKERS if workers is None else workers
+        self.__delay = rate_limiter(DELIVERY_RATE if rate is None else rate)
+        self.__max_attempts = max_attempts
+        self.__poll = poll
+        self.__wake = threading.Event()
+        self.__stopping = threading.Event()
+        self.__threads = []
+        self.__lock = threading.Lock()
+        self.__latency = financial_game.metrics.Histogram(LATENCY_BUCKETS)
+        self.__counts = {"sent": 0, "retried": 0, "dead": 0, "errors": 0}
+
+    def enqueue(
+        self,
+        recipient,
+        subject,
+        html_body=None,
+        text_body=None,
+        attachments=None,
+        inlined=None,
+        encoding="utf-8",
+    ) -> Outbox:
+        """Form an email (see financial_game.email.form) and add it to the outbox
+        returns without waiting for it to be sent
+        """
+        message = financial_game.email.form(
+            self.__args,
+            recipient,
+            subject,
+            html_body,
+            text_body,
+            attachments,
+            inlined,
+            encoding,
+        )
+        queued = Outbox.enqueue(recipient, message)
+        self.__wake.set()
+        return queued
+
+    def reconfigure(self, args):
+        """Use new smtp settings for the messages after this"""
+        self.__args = args
+
+    def watch(self, watcher: financial_game.settings.Watcher):
+        """reconfigure() when the watcher's smtp settings change"""
+
+        def changed(_, new):
+            self.reconfigure(new)
+            financial_game.email.close_pools()  # idle sessions with the old settings
+
+        watcher.subscribe(financial_game.settings.SMTP_KEYS, changed)
+
+    def start(self):
+        """Start the worker threads"""
+        self.__stopping.clear()
+        self.__threads = [
+            threading.Thread(target=self.__work, name=f"delivery{i}", daemon=True)
+            for i in range(0, self.__workers)
+        ]
+
+        for thread in self.__threads:
+            thread.start()
+
+        return self
+
+    def stop(self):
+        """Stop the worker threads (after the messages they are sending)"""
+        self.__stopping.set()
+        self.__wake.set()
+
+        for thread in self.__threads:
+            thread.join()
+
+        self.__threads = []
+
+    def __work(self):
+        while not self.__stopping.is_set():
+            try:
+                if self.deliver_one():
+                    continue
+
+            except sqlite3.Error as error:  # eg. database is locked
+                logging.getLogger(__name__).warning("Delivery failed: %s", error)
+
+                with self.__lock:
+                    self.__counts["errors"] += 1
+
+                self.__stopping.wait(ERROR_SECONDS)
+
+            self.__wake.wait(self.__poll)
+            self.__wake.clear()
+
+    def deliver_one(self) -> bool:
+        """Claim the next due message (if any), wait for the rate limit, deliver it
+        returns False if there was no message due
+        """
+        if self.__stopping.is_set():
+            return False
+
+        claimed = Outbox.claim(1)
+
+        if not claimed:
+            return False
+
+        message = claimed[0]
+        time.sleep(self.__delay())  # only sends use up the rate
+
+        try:
+            financial_game.email.deliver(
+                self.__args, message.recipient, message.message
+            )
+
+        except (smtplib.SMTPException, OSError) as error:
+            self.__failed(message, error)
+            return True
+
+        message.delivered()
+
+        with self.__lock:
+            self.__counts["sent"] += 1
+            self.__latency.add(message.sent - message.created)
+
+        return True
+
+    def __failed(self, message: Outbox, error: Exception):
+        give_up = permanent(error) or message.attempts >= self.__max_attempts
+        message.failed(
+            error, None if give_up else time.time() + backoff(message.attempts)
+        )
+
+        with self.__lock:
+            self.__counts["dead" if give_up else "retried"] += 1
+
+    def to_dict(self) -> dict:
+        """Queue depth by state, delivery counts and latency (seconds, enqueue to sent)"""
+        with self.__lock:
+            counts = dict(self.__counts)
+            latency = self.__latency.to_dict()
+
+        return {
+            "queue": {s.name: c for s, c in Outbox.depth().items()},
+            "workers": len(self.__threads),
+            "latency": latency,
+            **counts,
+        }
@@ -14,47 +14,190 @@
 """
 
 
+import atexit
+import base64
+import collections
+import copy
+import functools
+import hashlib
+import mmap
+import re
 import smtplib
 import os
+import threading
+import uuid
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 from email.header import Header
 from email.mime.base import MIMEBase
 from email import encoders
+from email import policy
 
 
-def add_attachments(message, attachments):
-    """Attach files to an email message"""
-    for filename in {} if attachments is None else attachments:
-        contents = attachments[filename].get("contents", None)
+PART_CACHE_BYTES = 32 * 1024 * 1024  # most encoded attachment and image bytes kept
+SMTP_POOL_SIZE = 2  # most idle sessions kept open to each SMTP server
+SMTP_TIMEOUT = 30  # seconds to wait on the SMTP server
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+STREAM_CHUNK = 57 * 4096  # attachment bytes encoded at a time (57 bytes per line)
+WIRE_POLICY = policy.compat32.clone(linesep="\r\n")
+
+
+class PartCache:
+    """Encoded MIME parts, least recently used evicted past max_bytes of payload"""
+
+    def __init__(self, max_bytes: int = PART_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__parts = collections.OrderedDict()  # key: (part, payload bytes)
+        self.__lock = threading.Lock()
+
+    def part(self, key: tuple, create):
+        """A copy of the part cached for key, create() it if it is not cached"""
+        with self.__lock:
+            found = self.__parts.get(key, None)
+
+            if found is not None:
+                self.__parts.move_to_end(key)
+
+            self.hits += found is not None
+            self.misses += found is None
+
+        if found is None:
+            created = create()
+            found = (created, len(created.get_payload()))
+            self.__add(key, found)
+
+        return copy.deepcopy(found[0])  # payload strings are shared, not copied
+
+    def __add(self, key: tuple, found: tuple):
+        with self.__lock:
+            if key in self.__parts or found[1] > self.max_bytes:
+                return
+
+            self.__parts[key] = found
+            self.bytes += found[1]
+
+            while self.bytes > self.max_bytes:
+                self.bytes -= self.__parts.popitem(last=False)[1][1]
+
+    def resize(self, max_bytes: int):
+        """Keep at most max_bytes of payload, evicting the least recently used parts"""
+        with self.__lock:
+            self.max_bytes = max_bytes
+
+            while self.bytes > self.max_bytes:
+                self.bytes -= self.__parts.popitem(last=False)[1][1]
+
+    def clear(self):
+        """Forget every part"""
+        with self.__lock:
+            self.__parts.clear()
+            self.bytes = 0
+
+
+PARTS = PartCache()
+
+
+def file_key(path: str, *kind) -> tuple:
+    """Cache key for a part made from the file at path as it is now"""
+    info = os.stat(path)
+    return kind + (os.path.realpath(path), info.st_mtime_ns, info.st_size)
+
+
+def contents_key(contents: bytes, *kind) -> tuple:
+    """Cache key for a part made from contents"""
+    return kind + (hashlib.sha256(contents).hexdigest(),)
+
+
+def read_file(path: str) -> bytes:
+    """The contents of the file at path"""
+    with open(path, "rb") as content_file:
+        return content_file.read()
+
+
+def attachment_part(mime_type: str, contents: bytes = None, path: str = None):
+    """base64 encoded attachment (without its filename) of contents or file at path"""
+    payload = MIMEBase(*mime_type.split("/"))
+    payload.set_payload(read_file(path) if contents is None else contents)
+    encoders.encode_base64(payload)
+    return payload
+
+
+def image_part(path: str):
+    """base64 encoded image (without its Content-ID) of the file at path"""
+    return MIMEImage(read_file(path))
+
+
+def streamed_part(mime_type: str, path: str, streamed: dict):
+    """base64 attachment whose payload is a marker for the file at path
+    streamed - {marker: path} the marker is added to, see message_chunks()
+    """
+    payload = MIMEBase(*mime_type.split("/"))
+    payload["Content-Transfer-Encoding"] = "base64"
+    marker = f"streamed-attachment-{uuid.uuid4().hex}"
+    payload.set_payload(marker)
+    streamed[marker] = path
+    return payload
+
+
+def encoded_file(path: str, chunk_bytes: int = STREAM_CHUNK):
+    """Generates the base64 (CRLF lines) of the file at path
+    the file is memory mapped and encoded chunk_bytes at a time
+    """
+    assert chunk_bytes % 57 == 0, f"{chunk_bytes} would split base64 lines"
+
+    if os.path.getsize(path) == 0:
+        return
 
-        if contents is None:
-            with open(
-                attachments[filename].get("path", filename), "rb"
-            ) as content_file:
-                contents = content_file.read()
+    with open(path, "rb") as content_file, mmap.mmap(
+        content_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as contents:
+        for start in range(0, len(contents), chunk_bytes):
+            end = start + chunk_bytes
+            encoded = base64.encodebytes(contents[start:end]).replace(b"\n", b"\r\n")
+            yield encoded[:-2] if end >= len(contents) else encoded
 
+
+def add_attachments(message, attachments, streamed: dict = None):
+    """Attach files to an email message (encoded parts are reused, see PARTS)
+    streamed - if not None, attachments from files are left as markers {marker: path}
+    """
+    for filename in {} if attachments is None else attachments:
+        contents = attachments[filename].get("contents", None)
         mime_type = attachments[filename].get("mime", "application/octet-stream")
         assert (
             mime_type.count("/") == 1
         ), f"bad mime_type: '{mime_type}' for {filename}'"
-        payload = MIMEBase(*mime_type.split("/"))
-        payload.set_payload(contents)
-        encoders.encode_base64(payload)
+
+        if contents is None and streamed is not None:
+            path = attachments[filename].get("path", filename)
+            payload = streamed_part(mime_type, path, streamed)
+        elif contents is None:
+            path = attachments[filename].get("path", filename)
+            payload = PARTS.part(
+                file_key(path, "attachment", mime_type),
+                functools.partial(attachment_part, mime_type, path=path),
+            )
+        else:
+            payload = PARTS.part(
+                contents_key(contents, "attachment", mime_type),
+                functools.partial(attachment_part, mime_type, contents),
+            )
+
         payload.add_header("Content-Decomposition", "attachment", filename=filename)
         message.attach(payload)
 
 
 def add_inlined_images(related, inlined):
-    """adds inlined images to a message"""
+    """adds inlined images to a message (encoded parts are reused, see PARTS)"""
     for image_id in {} if inlined is None else inlined:
         image_path = inlined[image_id]
-
-        with open(image_path, "rb") as image_file:
-            contents = image_file.read()
-
-        inline_image = MIMEImage(contents)
+        inline_image = PARTS.part(
+            file_key(image_path, "image"), functools.partial(image_part, image_path)
+        )
         inline_image.add_header("Content-ID", image_id)
         inline_image.add_header(
             "Content-Disposition", "inline", filename=os.path.split(image_path)[1]
@@ -73,7 +216,24 @@ def form(
     inlined=None,
     encoding="utf-8",
 ):
-    """Formats an email to be sent
+    """Formats an email to be sent (see mime())"""
+    return mime(
+        args, recipient, subject, html_body, text_body, attachments, inlined, encoding
+    ).as_string()
+
+
+def mime(
+    args,
+    recipient,
+    subject,
+    html_body=None,
+    text_body=None,
+    attachments=None,
+    inlined=None,
+    encoding="utf-8",
+    streamed=None,
+):
+    """The MIME message for an email
     attachments - {
                     <filename>: {
                         'path': path to file (optional),
@@ -86,6 +246,7 @@ def form(
     }
         To get inlined images to show up in your html:
             <img src="cid:<image_id>"
+    streamed - see add_attachments()
     """
     assert html_body is not None or text_body is not None
     message = MIMEMultipart("mixed")
@@ -118,8 +279,280 @@ def form(
     if body is not message:
         message.attach(body)
 
-    add_attachments(message, attachments)
-    return message.as_string()
+    add_attachments(message, attachments, streamed)
+    return message
+
+
+def dot_stuffed(data: bytes) -> bytes:
+    """Escape lines starting with . for the SMTP DATA stream"""
+    return re.sub(rb"(?m)^\.", b"..", data)
+
+
+def message_chunks(*args, smtp=False, **kwargs):
+    """Generates the message mime(*args, **kwargs) makes, as CRLF bytes, a chunk at a time
+    attachments from files are never read whole, see encoded_file()
+    smtp - dot-stuff the message for the SMTP DATA stream
+    """
+    streamed = {}
+    generated = mime(*args, streamed=streamed, **kwargs).as_bytes(policy=WIRE_POLICY)
+    markers = re.compile(b"|".join(m.encode() for m in streamed) or b"(?!)")
+    start = 0
+
+    for marker in markers.finditer(generated):
+        end = marker.start()
+        segment = generated[start:end]
+        yield dot_stuffed(segment) if smtp else segment
+        yield from encoded_file(streamed[marker.group().decode()])
+        start = marker.end()
+
+    segment = generated[start:]
+    yield dot_stuffed(segment) if smtp else segment
+
+
+def spool(path: str, *args, **kwargs) -> int:
+    """Write the message_chunks(*args, **kwargs) to a file, returns the bytes written"""
+    written = 0
+
+    with open(path, "wb") as spool_file:
+        for chunk in message_chunks(*args, **kwargs):
+            written += spool_file.write(chunk)
+
+    return written
+
+
+class Pool:
+    """Logged in SMTP sessions to one server, reused between sends"""
+
+    def __init__(self, args, size: int = SMTP_POOL_SIZE):
+        """args - smtp_server, smtp_port, smtp_tls, smtp_user, smtp_password, email_from
+        size - most idle sessions to keep open
+        """
+        self.__args = args
+        self.__size = size
+        self.__idle = []
+        self.__lock = threading.Lock()
+        self.connects = 0
+
+    def __connect(self) -> smtplib.SMTP:
+        session = smtplib.SMTP(
+            self.__args.smtp_server, self.__args.smtp_port, timeout=SMTP_TIMEOUT
+        )
+        self.connects += 1
+
+        if self.__args.smtp_tls:
+            session.starttls()
+
+        if self.__args.smtp_password is not None:
+            # TODO: Add support for encrypted password in args   # pylint: disable=fixme
+            username = (
+                self.__args.email_from
+                if self.__args.smtp_user is None
+                else self.__args.smtp_user
+            )
+            session.login(username, self.__args.smtp_password)
+
+        return session
+
+    @staticmethod
+    def __alive(session: smtplib.SMTP) -> bool:
+        """Is the session still usable (NOOP keepalive check)"""
+        try:
+            return session.noop()[0] == 250
+
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def __close(session: smtplib.SMTP):
+        try:
+            session.quit()
+
+        except (smtplib.SMTPException, OSError):
+            session.close()
+
+    def acquire(self) -> smtplib.SMTP:
+        """Get an idle session that is still alive, or a new one"""
+        while True:
+            with self.__lock:
+                session = self.__idle.pop() if self.__idle else None
+
+            if session is None:
+                return self.__connect()
+
+            if Pool.__alive(session):
+                return session
+
+            session.close()
+
+    def release(self, session: smtplib.SMTP):
+        """Return a session to the pool (or close it if the pool is full)"""
+        with self.__lock:
+            keep = len(self.__idle) < self.__size
+
+            if keep:
+                self.__idle.append(session)
+
+        if not keep:
+            Pool.__close(session)
+
+    def sendmail(self, sender: str, recipient: str, body: str):
+        """Send on a pooled session, reconnecting once if the server hung up"""
+        self.__use(lambda s: s.sendmail(sender, recipient, body))
+
+    def stream(self, sender: str, recipient: str, chunks):
+        """Send the bytes chunks() generates straight to the DATA stream
+        chunks - called again if the server hung up, see message_chunks(smtp=True)
+        """
+        self.__use(functools.partial(Pool.__data, sender, recipient, chunks))
+
+    @staticmethod
+    def __data(sender: str, recipient: str, chunks, session: smtplib.SMTP):
+        session.ehlo_or_helo_if_needed()
+        code, response = session.mail(sender)
+
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, response, sender)
+
+        code, response = session.rcpt(recipient)
+
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({recipient: (code, response)})
+
+        code, response = session.docmd("data")
+
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+
+        last = b"\r\n"
+
+        for chunk in chunks():
+            session.sock.sendall(chunk)
+            last = chunk or last
+
+        session.sock.sendall((b"" if last.endswith(b"\r\n") else b"\r\n") + b".\r\n")
+        code, response = session.getreply()
+
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+
+    def __use(self, action):
+        """action(session) on a pooled session, reconnecting once if the server hung up"""
+        session = self.acquire()
+        used = False
+
+        try:
+            try:
+                action(session)
+
+            except RECONNECT_ERRORS:
+                session.close()
+                session = self.__connect()
+                action(session)
+
+            used = True
+
+        finally:
+            if used:
+                self.release(session)
+
+            else:  # discarded, the session could be part way through a message
+                session.close()
+
+    def resize(self, size: int):
+        """Keep at most size idle sessions, closing the extra ones"""
+        with self.__lock:
+            self.__size = size
+            extra = self.__idle[size:]
+            del self.__idle[size:]
+
+        for session in extra:
+            Pool.__close(session)
+
+    def close(self):
+        """Close all the idle sessions"""
+        with self.__lock:
+            idle = list(self.__idle)
+            self.__idle.clear()
+
+        for session in idle:
+            Pool.__close(session)
+
+
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+
+def pool(args) -> Pool:
+    """The shared session pool for the SMTP server and login in args
+    pool size is args.smtp_pool_size (if set) or SMTP_POOL_SIZE
+    """
+    key = (
+        args.smtp_server,
+        args.smtp_port,
+        args.smtp_tls,
+        args.smtp_user,
+        args.smtp_password,
+        args.email_from,
+    )
+
+    with POOLS_LOCK:
+        if key not in POOLS:
+            size = getattr(args, "smtp_pool_size", None)
+            POOLS[key] = Pool(args, SMTP_POOL_SIZE if size is None else size)
+
+        return POOLS[key]
+
+
+def cache_sizes(args):
+    """Resize every pool to args.smtp_pool_size and PARTS to args.part_cache_bytes
+    (SMTP_POOL_SIZE and PART_CACHE_BYTES if they are not set)
+    """
+    size = getattr(args, "smtp_pool_size", None)
+    max_bytes = getattr(args, "part_cache_bytes", None)
+    PARTS.resize(PART_CACHE_BYTES if max_bytes is None else max_bytes)
+
+    with POOLS_LOCK:
+        pools = list(POOLS.values())
+
+    for smtp_pool in pools:
+        smtp_pool.resize(SMTP_POOL_SIZE if size is None else size)
+
+
+def watch(watcher):
+    """cache_sizes() now and whenever the watcher's pool or part cache size changes"""
+    cache_sizes(watcher.current)
+    watcher.subscribe(
+        ["smtp_pool_size", "part_cache_bytes"], lambda _, new: cache_sizes(new)
+    )
+
+
+@atexit.register
+def close_pools():
+    """Close every idle SMTP session (sessions reconnect when used again)"""
+    with POOLS_LOCK:
+        pools = list(POOLS.values())
+
+    for smtp_pool in pools:
+        smtp_pool.close()
+
+
+def deliver(args, recipient, body):
+    """Send a message from form() (on a pooled SMTP session, see pool())"""
+    pool(args).sendmail(args.email_from, recipient, body)
+
+
+def send_streamed(args, recipient, *parts, **options):
+    """Sends an email generated straight to the SMTP server
+    parts, options - the rest of the arguments to mime() (subject, html_body, ...)
+    attachments from files are sent without reading them whole, see message_chunks()
+    """
+    pool(args).stream(
+        args.email_from,
+        recipient,
+        functools.partial(
+            message_chunks, args, recipient, *parts, smtp=True, **options
+        ),
+    )
 
 
 # pylint: disable=too-many-arguments
@@ -132,29 +565,22 @@ def send(
     attachments=None,
     inlined=None,
     encoding="utf-8",
+    quiet=True,
 ):
-    """Sends an email"""
+    """Sends an email (on a pooled SMTP session, see pool())
+    quiet - False to print the whole message
+    """
     body = form(
         args, recipient, subject, html_body, text_body, attachments, inlined, encoding
     )
-    print("=" * 80 + "\n" + body + "\n" + "=" * 80)
-    session = smtplib.SMTP(args.smtp_server, args.smtp_port)
-    print("session started")
-    if args.smtp_tls:
-        session.starttls()
-        print("tls started")
-
-    if args.smtp_password is not None:
-        # TODO: Add support for encrypted password in args   # pylint: disable=fixme
-        username = args.email_from if args.smtp_user is None else args.smtp_user
-        session.login(username, args.smtp_password)
-        print("logged in")
-
-    print("sending email")
-    session.sendmail(args.email_from, recipient, body)
-    print("mail sent")
-    session.quit()
-    print("quit")
+
+    if not quiet:
+        print("=" * 80 + "\n" + body + "\n" + "=" * 80)
+
+    deliver(args, recipient, body)
+
+    if not quiet:
+        print("mail sent")
 
 
 # pylint: disable=pointless-string-statement
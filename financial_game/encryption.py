@@ -1,17 +1,19 @@
 #!/usr/bin/env python3
 
 """ Handle encrypting data
+
+    Crypto is imported on first use (it is slow to import)
 """
 
 
 import hashlib
 
-from Crypto.Cipher import AES
-from Crypto import Random
-
 
 def encrypt(key_data: str, data: bytes):
     """Encrypt data from the key_data"""
+    from Crypto.Cipher import AES  # pylint: disable=import-outside-toplevel
+    from Crypto import Random  # pylint: disable=import-outside-toplevel
+
     key = hashlib.sha256(key_data.encode("utf-8")).digest()
     initialization_vector = Random.new().read(AES.block_size)
     cipher = AES.new(key, AES.MODE_CBC, initialization_vector)
@@ -22,6 +24,8 @@ def encrypt(key_data: str, data: bytes):
 
 def decrypt(key_data: str, encrypted: bytes):
     """Decrypt data using the key_data"""
+    from Crypto.Cipher import AES  # pylint: disable=import-outside-toplevel
+
     block_size = AES.block_size
     initialization_vector = encrypted[:block_size]
     key = hashlib.sha256(key_data.encode("utf-8")).digest()
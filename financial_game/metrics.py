@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+""" Per-request timing and metrics
+"""
+
+
+import threading
+import time
+import bisect
+import functools
+import contextlib
+
+
+DURATION_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+CURRENT = threading.local()  # the Timings for the request on this thread
+
+
+class Histogram:
+    """Counts of values falling at or under each bucket's upper bound"""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last is overflow
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, value: float):
+        """Add a value to the histogram"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    def to_dict(self) -> dict:
+        """Describe the histogram"""
+        labels = [f"<={b}" for b in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            "count": self.count,
+            "total": self.total,
+            "average": self.total / self.count if self.count else 0.0,
+            "maximum": self.maximum,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class Timings:
+    """Time spent (and calls made) in each category during a request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = {}  # name -> seconds
+        self.calls = {}  # name -> count
+
+    def add(self, name: str, seconds: float):
+        """Record a call that took the given time"""
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def elapsed(self) -> float:
+        """Seconds since the timings started"""
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header"""
+        entries = [
+            f'{n};dur={1000.0 * d:0.3f};desc="{self.calls[n]} calls"'
+            for n, d in sorted(self.durations.items())
+        ]
+        entries.append(f"total;dur={1000.0 * self.elapsed():0.3f}")
+        return ", ".join(entries)
+
+
+class Metrics:
+    """Histograms of request timings per route"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__routes = {}
+
+    def record(self, route: str, timings: Timings, names: list):
+        """Add a request's timings to the route's histograms
+        names - categories to always record (even if there were no calls)
+        """
+        with self.__lock:
+            histograms = self.__routes.setdefault(
+                route, {"total": Histogram(DURATION_BUCKETS)}
+            )
+            histograms["total"].add(1000.0 * timings.elapsed())
+
+            for name in set(names) | set(timings.durations):
+                histograms.setdefault(name, Histogram(DURATION_BUCKETS)).add(
+                    1000.0 * timings.durations.get(name, 0.0)
+                )
+                histograms.setdefault(f"{name} calls", Histogram(COUNT_BUCKETS)).add(
+                    timings.calls.get(name, 0)
+                )
+
+    def to_dict(self) -> dict:
+        """Describe all the histograms (durations are in milliseconds)"""
+        with self.__lock:
+            return {
+                r: {n: h.to_dict() for n, h in sorted(histograms.items())}
+                for r, histograms in sorted(self.__routes.items())
+            }
+
+
+def begin() -> Timings:
+    """Start timing a request on this thread"""
+    CURRENT.timings = Timings()
+    return CURRENT.timings
+
+
+def end() -> Timings:
+    """Stop timing the request on this thread and return its timings"""
+    timings = getattr(CURRENT, "timings", None)
+    CURRENT.timings = None
+    return Timings() if timings is None else timings
+
+
+@contextlib.contextmanager
+def measure(name: str):
+    """Time the enclosed block if a request is being timed on this thread"""
+    timings = getattr(CURRENT, "timings", None)
+    start = time.perf_counter()
+
+    try:
+        yield
+
+    finally:
+        if timings is not None:
+            timings.add(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """Decorator to measure() every call to a function"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with measure(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -5,216 +5,524 @@
 
 
 import datetime
+import json
+import textwrap
 
-import yaml
-
+import financial_game.backup
 import financial_game.database
+import financial_game.snapshot
 from financial_game.table import Table
 from financial_game.model_user import User, Account, Statement, AccountPurpose
 from financial_game.model_bank import Bank, TypeOfBank, AccountType, TypeOfAccount
+from financial_game.model_outbox import Outbox
 
 
 class Database:
     """stored information"""
 
-    tables = [User, Bank, AccountType, Account, Statement]
+    tables = [User, Bank, AccountType, Account, Statement, Outbox]
 
-    def __init__(self, db_url, serialized=None):
+    def __init__(self, db_url, serialized=None, prepare=True):
         """create db
         db_url - a SqlAlchemy URL for the database
         serialized - optional dictionary or path to yaml file
+        prepare - create missing tables and indexes and migrate old tables
+            (do it once, before forking, when several processes use the database)
         """
         self.__db = financial_game.database.Connection.connect(
             db_url, default_return_objects=False
         )
-        description = Table.database_description(*Database.tables)
-        self.__db.create_tables(**description)
+
+        if prepare:
+            description = Table.database_description(*Database.tables)
+            self.__db.create_tables(**description)
+            migrate(self.__db)
+            self.__db.create_indexes(**Table.database_indexes(*Database.tables))
 
         for table in Database.tables:
             table._db = self.__db
 
         if serialized is not None:
             try:
-                with open(serialized, "r", encoding="utf-8") as script_file:
-                    serialized_data = yaml.safe_load(script_file.read())
+                serialized_data = load(serialized)
 
             except TypeError:
                 serialized_data = serialized
 
             self.__deserialize(serialized_data)
 
-    def __deserialize_statements(self, accounts_created):
-        for serailized_account, created_account in accounts_created:
-            for statement_id in sorted(serailized_account.get("statements", [])):
-                statement = serailized_account["statements"][statement_id]
-                assert statement["start_date"] is not None
-                assert statement["end_date"] is not None
-                assert statement["start_value"] is not None
-                assert statement["end_value"] is not None
-                assert statement["withdrawals"] is not None
-                assert statement["deposits"] is not None
-                assert statement["interest"] is not None
-                assert statement["fees"] is not None
-                assert statement["rate"] is not None
-                Statement.create(
-                    created_account,
-                    datetime.datetime.strptime(
-                        statement["start_date"], "%Y-%m-%d"
-                    ).date(),
-                    datetime.datetime.strptime(
-                        statement["end_date"], "%Y-%m-%d"
-                    ).date(),
-                    statement["start_value"],
-                    statement["end_value"],
-                    statement["withdrawals"],
-                    statement["deposits"],
-                    statement["fees"],
-                    statement["interest"],
-                    statement["rate"],
-                    statement["mileage"],
-                )
-
-    def __deserialize_users(self, serialized, account_type_mappings):
+    def __deserialize(self, serialized):
+        """Bulk load serialized data (ids are reassigned, in order, from 1)
+        Rows are built and foreign keys mapped in memory, then each table is
+        validated and inserted in batches of LOAD_BATCH in one transaction
+        """
+        assert len(serialized) == 2
         assert "users" in serialized
+        assert "banks" in serialized
         assert User.total() == 0, "database already exists, cannot deserialize"
-        users = serialized["users"]
-        users_created = {}
-        accounts_created = []
-
-        for user_id in sorted(users):
-            user = users[user_id]
-            sponsor_id = user.get("sponsor_id", None)
-            assert (
-                sponsor_id is None or sponsor_id in users
-            ), f"invalid sponsor_id: {sponsor_id}"
-            sponsor_email = None if sponsor_id is None else users[sponsor_id]["email"]
-            assert (
-                sponsor_email is None or sponsor_email in users_created
-            ), f"We haven't created {sponsor_email} yet"
-            sponsor_id = (
-                None if sponsor_email is None else users_created[sponsor_email].id
+        assert Bank.total() == 0, "database already exists, cannot deserialize"
+        serialized = with_integer_ids(serialized)
+        banks, account_types, account_type_ids = bank_rows(serialized["banks"])
+        users, accounts, statements = user_rows(serialized["users"], account_type_ids)
+
+        with self.__db.transaction():
+            for rows in (banks, account_types, users, accounts, statements):
+                for start in range(0, len(rows), LOAD_BATCH):
+                    end = start + LOAD_BATCH
+                    batch = rows[start:end]
+                    Table.validate(batch)
+                    self.__db.insert_many(
+                        Table.name(batch[0].__class__),
+                        [r.denormalize() for r in batch],
+                        _commit_=False,
+                    )
+
+    def close(self):
+        """close down the connection to the database"""
+        self.__db.close()
+
+    def backup(self, destination: str, compress=False, incremental=False) -> str:
+        """Back up the database while it is in use (see financial_game.backup)
+        destination - path of the backup (or the start of an incremental chain)
+        compress - gzip the backup
+        incremental - only store the pages changed since the last backup
+        returns the path of the file written
+        """
+        return financial_game.backup.backup(
+            self.__db, destination, compress, incremental
+        )
+
+    def serialize(self):
+        """Converts the database contents to a dictionary that can be deserialized
+        Every user and bank (of any type) by id, the same as export()
+        """
+        users = [
+            User(**u) for u in self.__db.get_all(Table.name(User), _order_by_="id")
+        ]
+        banks = [
+            Bank(**b) for b in self.__db.get_all(Table.name(Bank), _order_by_="id")
+        ]
+        Table.preload(users, ["accounts.statements"])
+        Table.preload(banks, ["account_types"])
+        return {
+            "users": {
+                u.id: serialized_user(u, [(a, a.statements()) for a in u.accounts()])
+                for u in users
+            },
+            "banks": {b.id: serialized_bank(b, b.account_types()) for b in banks},
+        }
+
+    def export(self, stream, fmt: str = "yaml", progress=None):
+        """Write the database to a stream in the serialize() format, incrementally
+        Reads are done in one transaction on a separate connection, so the export
+        is a consistent snapshot (writers are not blocked in the wal JOURNAL_MODE).
+        The database must be a file (see Connection.reader).
+        Only one user (and their accounts and statements) is in memory at a time
+        (EXPORT_BATCH users for yaml).
+        stream - text stream (yaml, json) or binary stream (snapshot)
+        fmt - "yaml", "json" or "snapshot" (see financial_game.snapshot)
+        progress - called with (section name, records written so far in section)
+        """
+        assert fmt in EXPORT_FORMATS, f"Unknown format: {fmt}"
+        reader = self.__db.reader()
+        reader.execute("BEGIN;", None, commit=False)
+
+        try:
+            if fmt == "snapshot":
+                financial_game.snapshot.write(
+                    stream, exported_users(reader), exported_banks(reader), progress
+                )
+            else:
+                write_section(stream, fmt, "users", exported_users(reader), progress)
+                write_section(stream, fmt, "banks", exported_banks(reader), progress)
+                stream.write("}\n" if fmt == "json" else "")
+
+        finally:
+            reader.execute("ROLLBACK;", None, commit=False)
+            reader.close()
+
+
+EXPORT_FORMATS = ("yaml", "json", "snapshot")
+LOAD_BATCH = 1000  # rows validated and inserted at a time when deserializing
+EXPORT_BATCH = 100  # yaml records dumped at a time when exporting
+
+
+def migrate(connection):
+    """Update tables created by earlier versions to the current description
+    only takes the write lock if there is something to migrate
+    connection - financial_game.database.Connection
+    """
+    statement = Table.name(Statement)
+    days = (  # dates were YYYY-MM-DD 00:00:00.000, days are already converted
+        "CASE WHEN typeof({0}) = 'integer' THEN {0} "
+        + "ELSE CAST(julianday(substr({0}, 1, 10)) - 2440587.5 AS INTEGER) END"
+    )
+
+    def varchar_dates() -> bool:
+        return connection.table_columns(statement)["start_date"].startswith("VARCHAR")
+
+    if not varchar_dates():  # nothing to migrate, do not wait for the write lock
+        return
+
+    with connection.transaction(immediate=True):  # one process migrates at a time
+        if varchar_dates():  # unless another process migrated while we waited
+            connection.rebuild_table(
+                statement,
+                Table.database_description(Statement)[statement],
+                start_date=days.format("start_date"),
+                end_date=days.format("end_date"),
+                _commit_=False,
             )
-            users_created[user["email"]] = User.create(
-                user["email"],
-                user.get("password_hash", user.get("password", None)),
-                user["name"],
-                sponsor_id,
-                pw_hashed="password_hash" in user,
+
+
+def load(path: str) -> dict:
+    """Read a serialized database from a YAML or snapshot file"""
+    if financial_game.snapshot.is_snapshot(path):
+        return financial_game.snapshot.read(path)
+
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    with open(path, "r", encoding="utf-8") as script_file:  # libyaml is much faster
+        return yaml.load(
+            script_file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        )
+
+
+def convert(source: str, destination: str):
+    """Convert a snapshot file to YAML, or a YAML file to a snapshot"""
+    serialized = load(source)
+
+    if financial_game.snapshot.is_snapshot(source):
+        with open(destination, "w", encoding="utf-8") as yaml_file:
+            write_section(yaml_file, "yaml", "users", serialized["users"].items())
+            write_section(yaml_file, "yaml", "banks", serialized["banks"].items())
+
+    else:
+        with open(destination, "wb") as snapshot_file:
+            financial_game.snapshot.write(
+                snapshot_file, serialized["users"].items(), serialized["banks"].items()
+            )
+
+
+def bank_rows(banks: dict) -> ([Bank], [AccountType], dict):
+    """Banks and account types to insert, with ids assigned in order
+    banks - serialized banks (with integer ids)
+    returns (banks, account types, {serialized account type id: new id})
+    """
+    bank_list = []
+    type_list = []
+    type_ids = {}
+
+    for bank in banks.values():
+        assert bank["type"] in dir(TypeOfBank)
+        bank_list.append(
+            Bank(
+                id=len(bank_list) + 1,
+                name=bank["name"],
+                url=bank.get("url", None),
+                type=TypeOfBank[bank["type"]],
+                _normalize_=False,
+            )
+        )
+
+        for type_id, type_info in bank["account_types"].items():
+            assert type_info["type"] in dir(TypeOfAccount)
+            type_ids[type_id] = len(type_list) + 1
+            type_list.append(
+                AccountType(
+                    id=type_ids[type_id],
+                    bank_id=bank_list[-1].id,
+                    name=type_info["name"],
+                    type=TypeOfAccount[type_info["type"]],
+                    url=type_info.get("url", None),
+                    _normalize_=False,
+                )
             )
 
-        for user_id in sorted(users):
-            for account_id in sorted(users[user_id].get("accounts", [])):
-                account = users[user_id]["accounts"][account_id]
-                assert account["label"] is not None
-                assert account["account_type"] in account_type_mappings
-                user = users_created[users[user_id]["email"]]
-                account_type = account_type_mappings[account["account_type"]]
-                created = Account.create(
-                    user,
-                    account_type,
-                    account["label"],
-                    account.get("hint", None),
-                    (
+    return bank_list, type_list, type_ids
+
+
+def user_rows(users: dict, account_type_ids: dict) -> ([User], [Account], [Statement]):
+    """Users, accounts and statements to insert, with ids assigned in order
+    users - serialized users (with integer ids)
+    account_type_ids - {serialized account type id: new id}
+    Legacy plain text passwords are hashed in parallel on User.hashers()
+    """
+    user_ids = {u: i + 1 for i, u in enumerate(sorted(users))}
+    plain_text = [u for u in sorted(users) if "password_hash" not in users[u]]
+    hashed = dict(
+        zip(
+            plain_text,
+            User.hashers().map(
+                User.hash_password, [users[u]["password"] for u in plain_text]
+            ),
+        )
+    )
+    user_list = []
+    account_list = []
+    statement_list = []
+
+    for user_id in sorted(users):
+        user = users[user_id]
+        sponsor_id = user.get("sponsor_id", None)
+        assert (
+            sponsor_id is None or sponsor_id in users
+        ), f"invalid sponsor_id: {sponsor_id}"
+        user_list.append(
+            User(
+                id=user_ids[user_id],
+                email=user["email"],
+                password_hash=user.get("password_hash", hashed.get(user_id, None)),
+                name=user["name"],
+                sponsor_id=user_ids.get(sponsor_id, None),
+                _normalize_=False,
+            )
+        )
+
+    for user_id in sorted(users):
+        for account_id in sorted(users[user_id]["accounts"]):
+            account = users[user_id]["accounts"][account_id]
+            assert account["account_type"] in account_type_ids
+            account_list.append(
+                Account(
+                    id=len(account_list) + 1,
+                    user_id=user_ids[user_id],
+                    account_type_id=account_type_ids[account["account_type"]],
+                    label=account["label"],
+                    hint=account.get("hint", None),
+                    purpose=(
                         None
-                        if account["purpose"] is None
+                        if account.get("purpose", None) is None
                         else AccountPurpose[account["purpose"]]
                     ),
+                    _normalize_=False,
+                )
+            )
+
+            for statement_id in sorted(account["statements"]):
+                statement_list.append(
+                    serialized_to_statement(
+                        len(statement_list) + 1,
+                        account_list[-1].id,
+                        account["statements"][statement_id],
+                    )
                 )
-                accounts_created.append((account, created))
 
-        self.__deserialize_statements(accounts_created)
+    return user_list, account_list, statement_list
 
-    def __deserialize_banks(self, serialized):
-        assert "banks" in serialized
-        assert Bank.total() == 0, "database already exists, cannot deserialize"
-        account_type_mappings = {}
-
-        for bank_id in serialized["banks"]:
-            bank = serialized["banks"][bank_id]
-            assert bank["type"] is not None
-            assert bank["type"] in dir(TypeOfBank)
-            assert bank["name"] is not None
-            new_bank = Bank.create(
-                bank["name"], bank.get("url", None), TypeOfBank[bank["type"]]
+
+def serialized_to_statement(statement_id: int, account_id: int, statement: dict):
+    """Statement (not normalized) from its serialized form"""
+
+    def date(text: str) -> datetime.date:  # YYYY-MM-DD
+        return None if text is None else datetime.date.fromisoformat(text)
+
+    return Statement(
+        id=statement_id,
+        account_id=account_id,
+        start_date=date(statement.get("start_date", None)),
+        end_date=date(statement.get("end_date", None)),
+        start_value=statement.get("start_value", None),
+        end_value=statement.get("end_value", None),
+        withdrawals=statement.get("withdrawals", None),
+        deposits=statement.get("deposits", None),
+        fees=statement.get("fees", None),
+        interest=statement.get("interest", None),
+        rate=statement.get("rate", None),
+        mileage=statement.get("mileage", None),
+        _normalize_=False,
+    )
+
+
+def with_integer_ids(serialized: dict) -> dict:
+    """serialized data with all id keys as integers (JSON keys are always strings)"""
+
+    def by_id(records: dict, to_record=lambda r: r) -> dict:
+        return {int(i): to_record(r) for i, r in (records or {}).items()}
+
+    def account(record: dict) -> dict:
+        return dict(record, statements=by_id(record.get("statements")))
+
+    def user(record: dict) -> dict:
+        return dict(record, accounts=by_id(record.get("accounts"), account))
+
+    def bank(record: dict) -> dict:
+        return dict(record, account_types=by_id(record.get("account_types")))
+
+    return {
+        "users": by_id(serialized.get("users"), user),
+        "banks": by_id(serialized.get("banks"), bank),
+    }
+
+
+def serialized_statement(statement: Statement) -> dict:
+    """The serialized form of a statement"""
+    return {
+        "start_date": statement.start_date.strftime("%Y-%m-%d"),
+        "end_date": statement.end_date.strftime("%Y-%m-%d"),
+        "start_value": float(statement.start_value),
+        "end_value": float(statement.end_value),
+        "withdrawals": float(statement.withdrawals),
+        "deposits": float(statement.deposits),
+        "interest": float(statement.interest),
+        "fees": float(statement.fees),
+        "rate": statement.rate,
+        "mileage": statement.mileage,
+    }
+
+
+def serialized_user(user: User, accounts: list) -> dict:
+    """The serialized form of a user
+    accounts - [(Account, [Statement])]
+    """
+    return {
+        "name": user.name,
+        "email": user.email,
+        "password_hash": user.password_hash,
+        "sponsor_id": user.sponsor_id,
+        "accounts": {
+            a.id: {
+                "label": a.label,
+                "hint": a.hint,
+                "purpose": None if a.purpose is None else a.purpose.name,
+                "account_type": a.account_type_id,
+                "statements": {s.id: serialized_statement(s) for s in statements},
+            }
+            for a, statements in accounts
+        },
+    }
+
+
+def serialized_bank(bank: Bank, account_types: list) -> dict:
+    """The serialized form of a bank and its account types"""
+    return {
+        "name": bank.name,
+        "url": bank.url,
+        "type": bank.type.name,
+        "account_types": {
+            t.id: {
+                "name": t.name,
+                "type": t.type.name,
+                "url": t.url,
+            }
+            for t in account_types
+        },
+    }
+
+
+def following(rows, key):
+    """Rows ordered the same as their parents, taken a parent at a time
+    rows - iterator of rows
+    key - function that gets the (ordered) parent key from a row
+    returns take(parent_key) that gets the rows for the parent
+        (skipping any for parents before it)
+    """
+    pending = [next(rows, None)]
+
+    def take(parent_key) -> list:
+        taken = []
+
+        while pending[0] is not None and key(pending[0]) <= parent_key:
+            if key(pending[0]) == parent_key:
+                taken.append(pending[0])
+
+            pending[0] = next(rows, None)
+
+        return taken
+
+    return take
+
+
+def exported_users(reader) -> (int, dict):
+    """Yield (id, serialized user) for each user, read with cursors"""
+    take_accounts = following(
+        reader.fetch_each(
+            f"SELECT * FROM {Table.name(Account)} ORDER BY user_id, id;",
+            _as_objects_=False,
+        ),
+        lambda r: (r["user_id"],),
+    )
+    take_statements = following(
+        reader.fetch_each(
+            f"""SELECT {Table.name(Statement)}.*, {Table.name(Account)}.user_id AS owner_id
+                FROM {Table.name(Statement)} INNER JOIN {Table.name(Account)}
+                ON {Table.name(Account)}.id = {Table.name(Statement)}.account_id
+                ORDER BY owner_id, account_id, {Table.name(Statement)}.id;""",
+            _as_objects_=False,
+        ),
+        lambda r: (r["owner_id"], r["account_id"]),
+    )
+
+    for row in reader.fetch_each(
+        f"SELECT * FROM {Table.name(User)} ORDER BY id;", _as_objects_=False
+    ):
+        user = User(**row)
+        user_accounts = [Account(**a) for a in take_accounts((user.id,))]
+        yield user.id, serialized_user(
+            user,
+            [
+                (a, [Statement(**s) for s in take_statements((user.id, a.id))])
+                for a in user_accounts
+            ],
+        )
+
+
+def exported_banks(reader) -> (int, dict):
+    """Yield (id, serialized bank) for each bank, read with cursors"""
+    take_account_types = following(
+        reader.fetch_each(
+            f"SELECT * FROM {Table.name(AccountType)} ORDER BY bank_id, id;",
+            _as_objects_=False,
+        ),
+        lambda r: r["bank_id"],
+    )
+
+    for row in reader.fetch_each(
+        f"SELECT * FROM {Table.name(Bank)} ORDER BY id;", _as_objects_=False
+    ):
+        bank = Bank(**row)
+        types = [AccountType(**t) for t in take_account_types(bank.id)]
+        yield bank.id, serialized_bank(bank, types)
+
+
+def write_section(stream, fmt: str, name: str, records, progress=None):
+    """Write a top-level section of serialized records to the stream
+    fmt - "yaml" or "json" (the json object is left open)
+    records - iterator of (id, record)
+    progress - called with (name, records written so far)
+    """
+    import yaml  # pylint: disable=import-outside-toplevel
+
+    dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)  # libyaml is much faster
+    count = 0
+    batch = {}
+    stream.write(f"{name}:" if fmt == "yaml" else ("{" if name == "users" else ", "))
+    stream.write("" if fmt == "yaml" else f"{json.dumps(name)}: {{")
+
+    def write_batch(written: int):
+        if fmt == "yaml":
+            text = yaml.dump(batch, Dumper=dumper, sort_keys=False, indent=4)
+            stream.write("\n" + textwrap.indent(text, "    ").rstrip("\n"))
+        else:
+            stream.write(
+                (", " if written else "")
+                + ", ".join(f'"{i}": {json.dumps(r)}' for i, r in batch.items())
             )
-            assert new_bank.id is not None
-
-            for type_id in bank.get("account_types", []):
-                type_info = bank["account_types"][type_id]
-                assert type_info["name"] is not None
-                assert type_info["type"] is not None
-                assert type_info["type"] in dir(TypeOfAccount)
-                created = AccountType.create(
-                    new_bank.id,
-                    type_info["name"],
-                    TypeOfAccount[type_info["type"]],
-                    url=type_info.get("url", None),
-                )
-                account_type_mappings[type_id] = created.id
 
-        return account_type_mappings
+        for index in range(written + 1, written + len(batch) + 1):
+            if progress is not None:
+                progress(name, index)
 
-    def __deserialize(self, serialized):
-        assert len(serialized) == 2
-        account_type_mappings = self.__deserialize_banks(serialized)
-        self.__deserialize_users(serialized, account_type_mappings)
+        batch.clear()
 
-    def close(self):
-        """close down the connection to the database"""
-        self.__db.close()
+    for record_id, record in records:
+        batch[record_id] = record
+        count += 1
 
-    def serialize(self):
-        """Converts the database contents to a dictionary that can be deserialized"""
-        users = User.every()
-        banks = Bank.every()
-        return {
-            "users": {
-                u.id: {
-                    "name": u.name,
-                    "email": u.email,
-                    "password_hash": u.password_hash,
-                    "sponsor_id": u.sponsor_id,
-                    "accounts": {
-                        a.id: {
-                            "label": a.label,
-                            "hint": a.hint,
-                            "purpose": None if a.purpose is None else a.purpose.name,
-                            "account_type": a.account_type_id,
-                            "statements": {
-                                s.id: {
-                                    "start_date": s.start_date.strftime("%Y-%m-%d"),
-                                    "end_date": s.end_date.strftime("%Y-%m-%d"),
-                                    "start_value": s.start_value,
-                                    "end_value": s.end_value,
-                                    "withdrawals": s.withdrawals,
-                                    "deposits": s.deposits,
-                                    "interest": s.interest,
-                                    "fees": s.fees,
-                                    "rate": s.rate,
-                                    "mileage": s.mileage,
-                                }
-                                for s in a.statements()
-                            },
-                        }
-                        for a in u.accounts()
-                    },
-                }
-                for u in users
-            },
-            "banks": {
-                b.id: {
-                    "name": b.name,
-                    "url": b.url,
-                    "type": b.type.name,
-                    "account_types": {
-                        t.id: {
-                            "name": t.name,
-                            "type": t.type.name,
-                            "url": t.url,
-                        }
-                        for t in b.account_types()
-                    },
-                }
-                for b in banks
-            },
-        }
+        if fmt != "yaml" or len(batch) >= EXPORT_BATCH:  # json a record at a time
+            write_batch(count - len(batch))
+
+    if batch:
+        write_batch(count - len(batch))
+
+    stream.write(("\n" if count else " {}\n") if fmt == "yaml" else "}")
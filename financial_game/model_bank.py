@@ -8,6 +8,7 @@ import enum
 
 
 from financial_game.table import Table, Identifier, String, Enum, ForeignKey
+from financial_game.table import preloadable
 from financial_game.database import Join
 
 
@@ -20,6 +21,7 @@ class TypeOfBank(enum.Enum):
 class Bank(Table):
     """bank info"""
 
+    __indexes__ = [("type", "name", "id")]
     _db = None
     id = Identifier()
     name = String(50, allow_null=False)
@@ -47,29 +49,36 @@ class Bank(Table):
         return None if found is None else Bank(**found)
 
     @staticmethod
-    def every(bank_type=TypeOfBank.BANK):
-        """Get list of all banks"""
-        return [
-            Bank(**u)
-            for u in Bank._db.get_all(
-                Table.name(Bank), _where_="type = :bank_type", bank_type=bank_type.name
-            )
-        ]
+    def every(bank_type=TypeOfBank.BANK, after: (str, int) = None, limit: int = None):
+        """Get list of all banks, by name
+        after - (name, id) of the last bank of the previous page
+        limit - most banks to return (None for all)
+        """
+        found = Bank._db.get_all(
+            Table.name(Bank),
+            _where_="type = :bank_type",
+            _order_by_=["name", "id"],
+            _after_=after,
+            _limit_=limit,
+            bank_type=bank_type.name,
+        )
+        return [Bank(**b) for b in found]
 
     @staticmethod
     def total(bank_type=TypeOfBank.BANK):
         """Count total banks"""
-        return Bank._db.get_one_or_none(
-            Table.name(Bank),
-            "COUNT(*)",
-            _where_="type = :bank_type",
-            bank_type=bank_type.name,
-        )["COUNT(*)"]
+        return Bank._db.aggregate(
+            Table.name(Bank), _where_="type = :bank_type", bank_type=bank_type.name
+        )[0]["count"]
 
+    @preloadable
     def account_types(self):
         """get the types of accounts at the bank"""
         found = Bank._db.get_all(
-            Table.name(AccountType), _where_="bank_id = :bank_id", bank_id=self.id
+            Table.name(AccountType),
+            _where_="bank_id = :bank_id",
+            _order_by_="id",
+            bank_id=self.id,
         )
         return [AccountType(**t) for t in found]
 
@@ -169,9 +178,18 @@ class AccountType(Table):
         )
         return None if found is None else AccountType(**found)
 
+    @preloadable
     def bank(self):
         """Get the bank this type is for"""
         found = AccountType._db.get_one_or_none(
             Table.name(Bank), _where_="id = :bank_id", bank_id=self.bank_id
         )
         return Bank(**found)
+
+
+Bank.__relations__ = {
+    "account_types": (AccountType, "bank_id", "id", True, ["id"]),
+}
+AccountType.__relations__ = {
+    "bank": (Bank, "id", "bank_id", False, ["id"]),
+}
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+""" The Outbox model data, emails waiting to be delivered
+"""
+
+
+import enum
+import time
+
+
+from financial_game.table import Table, Identifier, String, Enum, Fixed, Integer
+from financial_game.table import Text
+
+
+CLAIM_SECONDS = 300  # a claimed message not marked sent or failed by then is retried
+ERROR_LENGTH = 1024  # longest error message kept
+
+
+class OutboxState(enum.Enum):
+    """Where a message is in delivery"""
+
+    PENDING = 1  # waiting for its next attempt
+    SENDING = 2  # claimed by a delivery worker
+    SENT = 3  # handed to the SMTP server
+    DEAD = 4  # given up on, see error
+
+
+class Outbox(Table):
+    """email message to deliver"""
+
+    __indexes__ = [("state", "next_attempt", "id")]
+    _db = None
+    id = Identifier()
+    recipient = String(320, allow_null=False)
+    message = Text(allow_null=False)  # the whole message, see financial_game.email.form
+    state = Enum(OutboxState, allow_null=False)
+    attempts = Integer(allow_null=False)
+    created = Fixed(3, allow_null=False)  # seconds since the epoch
+    next_attempt = Fixed(3, allow_null=False)  # (or when the claim expires if SENDING)
+    sent = Fixed(3)
+    error = String(ERROR_LENGTH)
+
+    @staticmethod
+    def enqueue(recipient: str, message: str, now: float = None):
+        """Add a message to be delivered as soon as possible"""
+        assert recipient is not None
+        assert message is not None
+        now = time.time() if now is None else now
+        outbox = Outbox(
+            recipient=recipient,
+            message=message,
+            state=OutboxState.PENDING,
+            attempts=0,
+            created=now,
+            next_attempt=now,
+            _normalize_=False,
+        ).denormalize()
+        created = Outbox._db.insert(Table.name(Outbox), **outbox)
+        return Outbox(**created)
+
+    @staticmethod
+    def fetch(outbox_id: int):
+        """Get a message by its id"""
+        found = Outbox._db.get_one_or_none(
+            Table.name(Outbox), _where_="id = :outbox_id", outbox_id=outbox_id
+        )
+        return None if found is None else Outbox(**found)
+
+    @staticmethod
+    def claim(limit: int = 1, now: float = None, claim_seconds: float = CLAIM_SECONDS):
+        """Atomically take up to limit due messages for delivery (oldest due first)
+        Messages claimed longer than claim_seconds ago (the worker died) are due again
+        """
+        now = time.time() if now is None else now
+        table = Table.name(Outbox)
+        found = Outbox._db.fetch_all(
+            f"""UPDATE {table}
+                SET state = :sending, attempts = attempts + 1, next_attempt = :expires
+                WHERE id IN (
+                    SELECT id FROM {table}
+                    WHERE state IN (:pending, :sending) AND next_attempt <= :now
+                    ORDER BY next_attempt, id LIMIT :limit)
+                RETURNING *;""",
+            sending=OutboxState.SENDING.name,
+            pending=OutboxState.PENDING.name,
+            now=Table.denormalize_field(Outbox, "next_attempt", now),
+            expires=Table.denormalize_field(
+                Outbox, "next_attempt", now + claim_seconds
+            ),
+            limit=limit,
+            _commit_=True,
+        )
+        return sorted((Outbox(**m) for m in found), key=lambda m: m.id)
+
+    def __finish(self, **_to_update_):
+        for field in _to_update_:
+            _to_update_[field] = Table.denormalize_field(
+                Outbox, field, _to_update_[field]
+            )
+
+        Outbox._db.change(
+            Table.name(Outbox),
+            "outbox_id",
+            _where_="id = :outbox_id",
+            outbox_id=self.id,
+            **_to_update_,
+        )
+
+        for field, value in _to_update_.items():
+            self.__dict__[field] = Table.normalize_field(Outbox, field, value)
+
+    def delivered(self, now: float = None):
+        """Mark the message as sent"""
+        self.__finish(
+            state=OutboxState.SENT,
+            sent=time.time() if now is None else now,
+            error=None,
+        )
+
+    def failed(self, error: str, retry_at: float = None):
+        """Mark the attempt as failed
+        retry_at - when to try again (seconds since the epoch), None to give up (DEAD)
+        """
+        self.__finish(
+            state=OutboxState.DEAD if retry_at is None else OutboxState.PENDING,
+            next_attempt=self.next_attempt if retry_at is None else retry_at,
+            error=str(error)[:ERROR_LENGTH],
+        )
+
+    @staticmethod
+    def depth() -> dict:
+        """Count messages in each state: {OutboxState: count} (every state)"""
+        found = Outbox._db.aggregate(Table.name(Outbox), _group_by_="state")
+        counts = {s: 0 for s in OutboxState}
+        counts.update({OutboxState[c["state"]]: c["count"] for c in found})
+        return counts
+
+    @staticmethod
+    def dead(limit: int = None):
+        """Get the messages that were given up on, oldest first"""
+        found = Outbox._db.get_all(
+            Table.name(Outbox),
+            _where_="state = :dead",
+            _order_by_="id",
+            _limit_=limit,
+            dead=OutboxState.DEAD.name,
+        )
+        return [Outbox(**m) for m in found]
@@ -5,31 +5,83 @@
 
 
 import hashlib
+import hmac
+import secrets
+import threading
+import concurrent.futures
 import enum
 import datetime
 
 
 from financial_game.table import Table, Identifier, String, ForeignKey
-from financial_game.table import Enum, Fixed, Money, Integer, Date
+from financial_game.table import Enum, Fixed, Integer, IntDate, preloadable
+from financial_game.table import Money as MoneyColumn
 from financial_game.model_bank import AccountType
+from financial_game.database import Join
+from financial_game.money import Money
+
+
+HASH_ALGORITHM = "pbkdf2_sha256"
+HASH_ITERATIONS = 260000  # cost of a password hash, raise as hardware gets faster
+HASH_SALT_BYTES = 16
+HASH_WORKERS = 4  # most passwords that will be hashed at the same time
+HASH_WAITING = 2 * HASH_WORKERS  # most threads hashing or queued for a hasher
+HASH_WAIT_SECONDS = 5.0  # longest a password check waits for a place in the queue
+
+
+class HashersBusy(RuntimeError):
+    """HASH_WAITING threads were waiting on password checks for HASH_WAIT_SECONDS"""
 
 
 class User(Table):
     """User info"""
 
+    __indexes__ = [("name", "id")]
     _db = None
     id = Identifier()
     name = String(50, allow_null=False)
     email = String(50, allow_null=False)
-    password_hash = String(64, allow_null=False)
+    password_hash = String(128, allow_null=False)
     sponsor_id = ForeignKey("User")
+    _hashers = None
+    _hashers_lock = threading.Lock()
+    _waiting = threading.BoundedSemaphore(HASH_WAITING)
 
     @staticmethod
-    def hash_password(text):
-        """hash utf-8 text"""
-        hasher = hashlib.new("sha256")
-        hasher.update(text.encode("utf-8"))
-        return hasher.hexdigest()
+    def hash_password(text, salt: bytes = None, iterations: int = None):
+        """salted, slow hash of utf-8 text
+        salt - (random) bytes to salt the hash with
+        iterations - (HASH_ITERATIONS) the cost of the hash
+        returns pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+        """
+        salt = secrets.token_bytes(HASH_SALT_BYTES) if salt is None else salt
+        iterations = HASH_ITERATIONS if iterations is None else iterations
+        digest = hashlib.pbkdf2_hmac("sha256", text.encode("utf-8"), salt, iterations)
+        return f"{HASH_ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+    @staticmethod
+    def check_password(text, password_hash) -> bool:
+        """Does the text hash to password_hash (either encoded or legacy sha256 hex)"""
+        if "$" in password_hash:
+            algorithm, iterations, salt, _ = password_hash.split("$")
+            assert algorithm == HASH_ALGORITHM, f"Unknown hash: {algorithm}"
+            expected = User.hash_password(text, bytes.fromhex(salt), int(iterations))
+
+        else:
+            expected = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+        return hmac.compare_digest(expected, password_hash)
+
+    @staticmethod
+    def hashers() -> concurrent.futures.Executor:
+        """The bounded pool of threads that hash passwords"""
+        with User._hashers_lock:
+            if User._hashers is None:
+                User._hashers = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=HASH_WORKERS, thread_name_prefix="password"
+                )
+
+        return User._hashers
 
     @staticmethod
     def create(email: str, password: str, name: str, sponsor=None, pw_hashed=False):
@@ -65,23 +117,71 @@ class User(Table):
         return None if found is None else User(**found)
 
     @staticmethod
-    def every():
-        """Get list of all users"""
-        return [User(**u) for u in User._db.get_all(Table.name(User))]
+    def every(after: (str, int) = None, limit: int = None):
+        """Get list of all users, by name
+        after - (name, id) of the last user of the previous page
+        limit - most users to return (None for all)
+        """
+        found = User._db.get_all(
+            Table.name(User), _order_by_=["name", "id"], _after_=after, _limit_=limit
+        )
+        return [User(**u) for u in found]
 
     @staticmethod
     def total():
         """Count total users"""
-        return User._db.get_one_or_none(Table.name(User), "COUNT(*)")["COUNT(*)"]
+        return User._db.aggregate(Table.name(User))[0]["count"]
 
     def password_matches(self, password):
-        """Verify that the user's password matches the given password"""
-        return User.hash_password(password) == self.password_hash
+        """Verify that the user's password matches the given password
+        The hash is computed on the hashers() pool while this thread waits.
+        At most HASH_WAITING threads wait at once, so a burst of logins
+        cannot tie up every request thread. Others queue for HASH_WAIT_SECONDS
+        then HashersBusy is raised.
+        """
+        # pylint: disable-next=consider-using-with
+        if not User._waiting.acquire(timeout=HASH_WAIT_SECONDS):
+            raise HashersBusy(f"{HASH_WAITING} password checks are already waiting")
+
+        try:
+            return (
+                User.hashers()
+                .submit(User.check_password, password, self.password_hash)
+                .result()
+            )
+
+        finally:
+            User._waiting.release()
+
+    def password_outdated(self):
+        """Is the password hash legacy or weaker than the current cost"""
+        parts = self.__dict__["password_hash"].split("$")
+        return (
+            len(parts) != 4
+            or parts[0] != HASH_ALGORITHM
+            or int(parts[1]) < HASH_ITERATIONS
+        )
+
+    @staticmethod
+    def fetch_graph(user_id: int, include: [str] = None):
+        """Get a user with related objects preloaded (one query per relation level)
+        include - relation paths, e.g. ["accounts.statements", "accounts.account_type.bank"]
+        """
+        user = User.fetch(user_id)
+
+        if user is not None:
+            Table.preload([user], [] if include is None else include)
+
+        return user
 
+    @preloadable
     def sponsored(self):
         """Get the people this person has sponsored"""
         found = User._db.get_all(
-            Table.name(User), _where_="sponsor_id = :user_id", user_id=self.id
+            Table.name(User),
+            _where_="sponsor_id = :user_id",
+            _order_by_="id",
+            user_id=self.id,
         )
         return [User(**u) for u in found]
 
@@ -111,10 +211,44 @@ class User(Table):
         for field, value in _to_update_.items():
             self.__dict__[field] = Table.normalize_field(User, field, value)
 
+    def purpose_totals(
+        self, start: datetime.date = None, end: datetime.date = None
+    ) -> dict:
+        """Totals of the user's statements (that overlap start to end) by account purpose
+        returns {AccountPurpose or None: {"statements": count,
+                                          "deposits", "withdrawals", "interest", "fees": Money}}
+        """
+        statement_table = Table.name(Statement)
+        account_table = Table.name(Account)
+        clauses, dates = Statement.overlapping(start, end, f"{statement_table}.")
+        sums = ["deposits", "withdrawals", "interest", "fees"]
+        found = User._db.aggregate(
+            statement_table,
+            _group_by_=f"{account_table}.purpose",
+            _sums_=[f"{statement_table}.{c}" for c in sums],
+            _join_=Join(
+                account_table, f"{account_table}.id = {statement_table}.account_id"
+            ),
+            _where_=" AND ".join([f"{account_table}.user_id = :user_id"] + clauses),
+            user_id=self.id,
+            **dates,
+        )
+        return {
+            Table.normalize_field(Account, "purpose", t["purpose"]): {
+                "statements": t["count"],
+                **{c: Table.normalize_field(Statement, c, t[f"sum_{c}"]) for c in sums},
+            }
+            for t in found
+        }
+
+    @preloadable
     def accounts(self):
         """Gets all the user's accounts"""
         found = User._db.get_all(
-            Table.name(Account), _where_="user_id = :user_id", user_id=self.id
+            Table.name(Account),
+            _where_="user_id = :user_id",
+            _order_by_="id",
+            user_id=self.id,
         )
         return [Account(**u) for u in found]
 
@@ -176,6 +310,20 @@ class Account(Table):
         )
         return None if found is None else Account(**found)
 
+    @staticmethod
+    def count_by_bank() -> dict:
+        """Count the accounts at each bank: {bank id: accounts} (banks with accounts)"""
+        account_table = Table.name(Account)
+        type_table = Table.name(AccountType)
+        found = Account._db.aggregate(
+            account_table,
+            _group_by_=f"{type_table}.bank_id",
+            _join_=Join(
+                type_table, f"{type_table}.id = {account_table}.account_type_id"
+            ),
+        )
+        return {c["bank_id"]: c["count"] for c in found}
+
     def change(self, **_to_update_):
         """Change information about the account"""
         assert "id" not in _to_update_
@@ -197,20 +345,50 @@ class Account(Table):
         for field, value in _to_update_.items():
             self.__dict__[field] = Table.normalize_field(Account, field, value)
 
+    @preloadable
     def account_type(self):
         """Get the account type"""
         return AccountType.fetch(self.account_type_id)
 
+    @preloadable
     def user(self):
         """Get the owner of the account"""
         return User.fetch(self.user_id)
 
-    def statements(self):
-        """Get the statements for the account"""
+    @preloadable
+    def statements(
+        self,
+        start: datetime.date = None,
+        end: datetime.date = None,
+        limit: int = None,
+        order: str = "ASC",
+        after: (datetime.date, int) = None,
+    ):  # pylint: disable=too-many-arguments
+        """Get the statements for the account, by start date
+        start - only statements that end on or after this date
+        end - only statements that start on or before this date
+        limit - most statements to return (None for all)
+        order - "ASC" (oldest first) or "DESC" (newest first)
+        after - (start_date, id) of the last statement of the previous page
+        """
+        assert order in ("ASC", "DESC"), f"Unknown order: {order}"
+        clauses, dates = Statement.overlapping(start, end)
         found = Account._db.get_all(
             Table.name(Statement),
-            _where_="account_id = :account_id",
+            _where_=" AND ".join(["account_id = :account_id"] + clauses),
+            _order_by_=["start_date", "id"],
+            _descending_=order == "DESC",
+            _limit_=limit,
+            _after_=(
+                None
+                if after is None
+                else (
+                    Table.denormalize_field(Statement, "start_date", after[0]),
+                    after[1],
+                )
+            ),
             account_id=self.id,
+            **dates,
         )
         return [Statement(**s) for s in found]
 
@@ -225,17 +403,22 @@ class InterestRate(Fixed):
 class Statement(Table):
     """bank account statement"""
 
+    __indexes__ = [
+        ("account_id", "start_date", "end_date"),
+        ("start_date",),
+        ("end_date",),
+    ]
     _db = None
     id = Identifier()
     account_id = ForeignKey(Account, allow_null=False)
-    start_date = Date(allow_null=False)
-    end_date = Date(allow_null=False)
-    start_value = Money(allow_null=False)
-    end_value = Money(allow_null=False)
-    withdrawals = Money(allow_null=False)
-    deposits = Money(allow_null=False)
-    interest = Money(allow_null=False)  # positive = earning interest
-    fees = Money(allow_null=False)
+    start_date = IntDate(allow_null=False)
+    end_date = IntDate(allow_null=False)
+    start_value = MoneyColumn(allow_null=False)
+    end_value = MoneyColumn(allow_null=False)
+    withdrawals = MoneyColumn(allow_null=False)
+    deposits = MoneyColumn(allow_null=False)
+    interest = MoneyColumn(allow_null=False)  # positive = earning interest
+    fees = MoneyColumn(allow_null=False)
     rate = InterestRate(allow_null=False)
     mileage = Integer()
 
@@ -266,10 +449,6 @@ class Statement(Table):
         assert fees is not None
         assert interest is not None
         assert rate is not None
-        accounting_value = (
-            start_value + deposits - withdrawals + interest - fees - end_value
-        )
-        assert abs(accounting_value) < 0.001, f"difference = {accounting_value:0.2f}"
         statement = Statement(
             account_id=account.id if isinstance(account, Account) else account,
             start_date=start_date,
@@ -283,10 +462,29 @@ class Statement(Table):
             rate=rate,
             mileage=mileage,
             _normalize_=False,
-        ).denormalize()
+        )
+        statement.check()
+        statement = statement.denormalize()
         created = Statement._db.insert(Table.name(Statement), **statement)
         return Statement(**created)
 
+    def check(self):
+        """Assert that the values account for the change in balance (to the cent)"""
+        values = [
+            Money.parse(v)
+            for v in (
+                self.start_value,
+                self.deposits,
+                self.withdrawals,
+                self.interest,
+                self.fees,
+                self.end_value,
+            )
+        ]
+        start, deposits, withdrawals, interest, fees, end = values
+        accounting_value = start + deposits - withdrawals + interest - fees - end
+        assert not accounting_value, f"difference = {accounting_value}"
+
     @staticmethod
     def fetch(statement_id: int):
         """Get a statement by its id"""
@@ -319,6 +517,62 @@ class Statement(Table):
         for field, value in _to_update_.items():
             self.__dict__[field] = Table.normalize_field(Statement, field, value)
 
+    @staticmethod
+    def overlapping(
+        start: datetime.date = None, end: datetime.date = None, prefix: str = ""
+    ) -> ([str], dict):
+        """WHERE clauses and replacements for statements that overlap start to end
+        start, end - None for no limit
+        prefix - table name and dot to qualify the columns with, eg. "Statement."
+        """
+        dates = {"range_start": start, "range_end": end}
+        clauses = {
+            "range_start": f"{prefix}end_date >= :range_start",
+            "range_end": f"{prefix}start_date <= :range_end",
+        }
+        return [clauses[n] for n, d in dates.items() if d is not None], {
+            n: Table.denormalize_field(Statement, "start_date", d)
+            for n, d in dates.items()
+            if d is not None
+        }
+
+    @staticmethod
+    def in_range(user, start: datetime.date, end: datetime.date):
+        """Get the statements, in any of the user's accounts, that overlap start to end
+        returns statements by start date
+        """
+        assert isinstance(user, (int, User))
+        statement_table = Table.name(Statement)
+        account_table = Table.name(Account)
+        clauses, dates = Statement.overlapping(start, end, f"{statement_table}.")
+        found = Statement._db.get_all(
+            statement_table,
+            f"{statement_table}.*",
+            _join_=Join(
+                account_table, f"{account_table}.id = {statement_table}.account_id"
+            ),
+            _where_=" AND ".join([f"{account_table}.user_id = :user_id"] + clauses),
+            _order_by_=[f"{statement_table}.start_date", f"{statement_table}.id"],
+            user_id=user.id if isinstance(user, User) else user,
+            **dates,
+        )
+        return [Statement(**s) for s in found]
+
+    @preloadable
     def account(self):
         """Get the account for the statement"""
         return Account.fetch(self.account_id)
+
+
+User.__relations__ = {
+    "accounts": (Account, "user_id", "id", True, ["id"]),
+    "sponsored": (User, "sponsor_id", "id", True, ["id"]),
+}
+Account.__relations__ = {
+    "statements": (Statement, "account_id", "id", True, ["start_date", "id"]),
+    "account_type": (AccountType, "id", "account_type_id", False, ["id"]),
+    "user": (User, "id", "user_id", False, ["id"]),
+}
+Statement.__relations__ = {
+    "account": (Account, "id", "account_id", False, ["id"]),
+}
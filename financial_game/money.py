@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+""" Exact currency amounts
+"""
+
+
+import decimal
+import functools
+import numbers
+
+
+@functools.total_ordering
+class Money:
+    """An amount of currency stored as an integer number of cents
+    Adding or subtracting Money (or whole numbers) stays exact,
+    adding or subtracting a float gives a float
+    """
+
+    __slots__ = ("cents",)
+    PRECISION = 2  # digits after the decimal point
+    SCALE = pow(10, PRECISION)
+
+    def __init__(self, cents: int = 0):
+        self.cents = int(cents)
+
+    @staticmethod
+    def parse(value):
+        """Get Money from Money, a number (10.25) or a string ("10.25")"""
+        if value is None or isinstance(value, Money):
+            return value
+
+        if isinstance(value, str):
+            value = decimal.Decimal(value)
+
+        return Money(round(value * Money.SCALE))
+
+    @staticmethod
+    def __cents_of(other):
+        """cents in other (int or Money) or None if not exact"""
+        if isinstance(other, Money):
+            return other.cents
+
+        if isinstance(other, numbers.Integral):
+            return other * Money.SCALE
+
+        return None
+
+    def __add__(self, other):
+        cents = self.__cents_of(other)
+
+        if cents is None:
+            return float(self) + other if isinstance(other, float) else NotImplemented
+
+        return Money(self.cents + cents)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        cents = self.__cents_of(other)
+
+        if cents is None:
+            return float(self) - other if isinstance(other, float) else NotImplemented
+
+        return Money(self.cents - cents)
+
+    def __rsub__(self, other):
+        return -self + other
+
+    def __mul__(self, other):
+        """Scale by a number (rounded to the nearest cent)"""
+        if not isinstance(other, numbers.Real):
+            return NotImplemented
+
+        return Money(round(self.cents * other))
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __abs__(self):
+        return Money(abs(self.cents))
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __float__(self):
+        return self.cents / Money.SCALE
+
+    def __eq__(self, other):
+        cents = self.__cents_of(other)
+
+        if cents is None:
+            return float(self) == other if isinstance(other, float) else NotImplemented
+
+        return self.cents == cents
+
+    def __lt__(self, other):
+        cents = self.__cents_of(other)
+
+        if cents is None:
+            return float(self) < other if isinstance(other, float) else NotImplemented
+
+        return self.cents < cents
+
+    def __hash__(self):
+        return hash(float(self))  # equal ints and floats hash the same
+
+    def __str__(self):
+        return str(decimal.Decimal(self.cents).scaleb(-Money.PRECISION))
+
+    def __repr__(self):
+        return f"Money({self.cents})"
+
+    def __format__(self, spec: str):
+        """Format like a Decimal (exact), eg. f"{amount:,.2f}" """
+        return format(decimal.Decimal(self.cents).scaleb(-Money.PRECISION), spec)
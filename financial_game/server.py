@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+""" Production (pre-fork) web server
+"""
+
+
+import fcntl
+import multiprocessing
+import threading
+import urllib.parse
+
+import gunicorn.app.base
+
+import financial_game.webserver
+import financial_game.database
+import financial_game.delivery
+import financial_game.email
+import financial_game.model
+import financial_game.settings
+import financial_game.table
+
+
+DEFAULT_THREADS = 4  # threads in each worker process
+GRACEFUL_TIMEOUT = 30  # seconds to let requests finish on shutdown
+DESIGNATE_SECONDS = 5.0  # how often other workers try to take over email delivery
+
+
+def default_workers():
+    """Number of worker processes to use if not specified"""
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def delivery_lock_path(database: str) -> str:
+    """The lock file held by the worker that delivers email (None for in-memory)"""
+    path = urllib.parse.urlparse(database).path
+    in_memory = path in financial_game.database.IN_MEMORY
+    return None if in_memory else path + ".delivery.lock"
+
+
+class Designated:
+    """Calls start() in one process at a time, the one holding a lock on path
+    The other processes try again every retry seconds, so one takes over when it exits
+    path - the lock file (None: start() now, there is nothing to share)
+    """
+
+    def __init__(self, path: str, start, retry: float = DESIGNATE_SECONDS):
+        self.held = False
+        self.__path = path
+        self.__start = start
+        self.__retry = retry
+        self.__file = None
+        self.__stopping = threading.Event()
+        self.__thread = None
+
+    def acquire(self) -> bool:
+        """Take the lock and start() if no other process has it, returns held"""
+        if self.held:
+            return True
+
+        if self.__path is not None:
+            lock_file = open(  # pylint: disable=consider-using-with
+                self.__path, "a", encoding="utf-8"
+            )
+
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+            except OSError:  # another process delivers
+                lock_file.close()
+                return False
+
+            self.__file = lock_file
+
+        self.held = True
+        self.__start()
+        return True
+
+    def start(self):
+        """acquire() now and, if that did not, every retry seconds in a thread"""
+        self.__stopping.clear()
+
+        if not self.acquire():
+            self.__thread = threading.Thread(
+                target=self.__retry_acquire, name="designated", daemon=True
+            )
+            self.__thread.start()
+
+        return self
+
+    def __retry_acquire(self):
+        while not self.__stopping.wait(self.__retry) and not self.acquire():
+            pass
+
+    def stop(self):
+        """Stop trying to acquire() and release the lock (if held)"""
+        self.__stopping.set()
+
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+        if self.__file is not None:
+            self.__file.close()  # releases the lock
+            self.__file = None
+
+        self.held = False
+
+
+def on_starting(arbiter):
+    """Create (or --reset) and migrate the database once, in the master before forking"""
+    args = arbiter.app.args
+    financial_game.model.Database(
+        args.database, serialized=getattr(args, "reset", None)
+    ).close()
+
+
+def post_fork(_, worker):
+    """Each worker gets its own database connection, email delivery
+    and settings watcher (new smtp settings, cache sizes and log level are used
+    without a restart) after fork
+    The database was prepared by on_starting(), so workers only connect to it
+    Only the Designated worker delivers email (the others enqueue to the outbox),
+    so the delivery rate does not grow with the number of workers
+    """
+    worker.app.database = financial_game.model.Database(
+        worker.app.args.database, prepare=False
+    )
+    worker.app.delivery = financial_game.delivery.Delivery(worker.app.args)
+    worker.app.designated = Designated(
+        delivery_lock_path(worker.app.args.database), worker.app.delivery.start
+    ).start()
+    worker.app.watcher = financial_game.settings.Watcher(worker.app.args)
+    worker.app.delivery.watch(worker.app.watcher)
+    financial_game.settings.watch_log_level(worker.app.watcher)
+    financial_game.table.watch(worker.app.watcher)
+    financial_game.email.watch(worker.app.watcher)
+    worker.app.watcher.start()
+
+
+def worker_exit(_, worker):
+    """Stop watching settings, delivering email and close the worker's database connection"""
+    if worker.app.watcher is not None:
+        worker.app.watcher.stop()
+        worker.app.watcher = None
+
+    if worker.app.designated is not None:
+        worker.app.designated.stop()
+        worker.app.designated = None
+
+    if worker.app.delivery is not None:
+        worker.app.delivery.stop()
+        worker.app.delivery = None
+
+    if worker.app.database is not None:
+        worker.app.database.close()
+        worker.app.database = None
+
+
+class Server(gunicorn.app.base.BaseApplication):
+    """Runs create_app(args) in multiple worker processes
+    args.port - the port to listen on
+    args.workers - (default_workers()) number of worker processes
+    args.threads - (DEFAULT_THREADS) number of threads in each worker
+    args.database - the database url each worker connects to
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.database = None
+        self.delivery = None
+        self.designated = None
+        self.watcher = None
+        super().__init__()
+
+    def init(self, parser, opts, args):
+        """Command line parsing is done by financial_game, not gunicorn"""
+
+    def load_config(self):
+        """Pass our settings to gunicorn"""
+        workers = self.args.workers
+        threads = self.args.threads
+        self.cfg.set("bind", f"0.0.0.0:{self.args.port}")
+        self.cfg.set("workers", default_workers() if workers is None else workers)
+        self.cfg.set("threads", DEFAULT_THREADS if threads is None else threads)
+        self.cfg.set("worker_class", "gthread")
+        self.cfg.set("graceful_timeout", GRACEFUL_TIMEOUT)
+        self.cfg.set("loglevel", "debug" if self.args.debug else "info")
+        self.cfg.set("on_starting", on_starting)
+        self.cfg.set("post_fork", post_fork)
+        self.cfg.set("worker_exit", worker_exit)
+
+    def load(self):
+        """Create the flask app (in the worker)"""
+        return financial_game.webserver.create_app(self.args, self.delivery)
@@ -11,7 +11,7 @@ import re
 import financial_game.encryption
 
 
-SESSION_PATTERN = re.compile(r"^(\d+):([0-9a-fA-F]+)$")
+SESSION_PATTERN = re.compile(r"^(\d+):([0-9a-zA-Z_$]+)$")
 
 
 def create(user, headers, secret, hour_delta=0):
@@ -4,16 +4,46 @@
 """
 
 
+import copy
+import logging
 import os
 import platform
-
-import yaml
+import threading
 
 
 DEFAULT_DATABASE = os.path.abspath("objects/test.sqlite3")
 DEFAULT_WEB_PORT = 8000
-DEFAULT_SMTP_PORT = 857
+DEFAULT_SMTP_PORT = 587
 DEFAULT_SMTP_SERVER = "smtp.gmail.com"
+WATCH_SECONDS = 2.0  # how often the Watcher checks the settings file
+SETTING_TYPES = {
+    "port": int,
+    "database": str,
+    "secret": str,
+    "debug": bool,
+    "reset": str,
+    "smtp-port": int,
+    "smtp-server": str,
+    "smtp-tls": bool,
+    "smtp-user": str,
+    "smtp-password": str,
+    "email-from": str,
+    "smtp-pool-size": int,
+    "date-cache-size": int,
+    "part-cache-bytes": int,
+}
+SMTP_KEYS = (
+    "smtp_port",
+    "smtp_server",
+    "smtp_tls",
+    "smtp_user",
+    "smtp_password",
+    "email_from",
+)
+CACHE_KEYS = ("smtp_pool_size", "date_cache_size", "part_cache_bytes")  # None: default
+RELOADABLE = SMTP_KEYS + CACHE_KEYS + ("debug",)  # args a Watcher swaps in
+LOGGERS = ("", "gunicorn.error")  # loggers set to DEBUG (args.debug) or INFO level
+MAINTENANCE = ("backup", "restore", "digest", "startup_profile")  # never --reset
 
 # TODO: Get the correct path on each platform (dict)  # pylint: disable=fixme
 PLATFORM = platform.system()
@@ -31,18 +61,80 @@ def default_path():
     return DEFAULT_SETTINGS[PLATFORM]
 
 
-def load(args):
-    """Fill in unset args with either default or values from settings file"""
-    if args.settings is None:
-        args.settings = default_path()
+def read(path: str) -> dict:
+    """The validated settings in the file at path ({} if there is no file)
+    raises ValueError if the file is not yaml or a setting has the wrong type
+    """
+    import yaml  # pylint: disable=import-outside-toplevel
 
     try:
-        with open(args.settings, "r", encoding="utf-8") as settings_file:
+        with open(path, "r", encoding="utf-8") as settings_file:
             settings = yaml.safe_load(settings_file.read())
 
     except FileNotFoundError:
-        settings = {}
+        return {}
+
+    except yaml.YAMLError as error:
+        raise ValueError(f"{path}: {error}") from error
+
+    settings = {} if settings is None else settings
+
+    if not isinstance(settings, dict):
+        raise ValueError(f"{path}: settings should be a mapping")
+
+    for key, expected in SETTING_TYPES.items():
+        value = settings.get(key, None)
+
+        if value is not None and not isinstance(value, expected):
+            raise ValueError(f"{path}: {key} should be {expected.__name__}: {value}")
+
+    return settings
+
 
+def maintenance(args) -> bool:
+    """True if args run a maintenance mode, which uses the database as it is"""
+    return any(getattr(args, k, None) for k in MAINTENANCE)
+
+
+def load(args):
+    """Fill in unset args with either default or values from settings file
+    args.command_line is set to a copy of args as given (see Watcher)
+    args.reset is cleared for maintenance() modes (even if it is in the settings file)
+    """
+    if args.settings is None:
+        args.settings = default_path()
+
+    args.command_line = copy.copy(args)
+    settings = read(args.settings)
+    apply(args, settings)
+
+    if args.secret is None and not os.path.isfile(args.settings):
+        print(f"Creating settings file: {args.settings}")
+        write(
+            args.settings,
+            {
+                "port": args.port,
+                "database": args.database,
+                "secret": args.secret,
+                "debug": args.debug,
+                "reset": args.reset,
+                "smtp-port": args.smtp_port,
+                "smtp-server": args.smtp_server,
+                "smtp-tls": args.smtp_tls,
+                "smtp-user": args.smtp_user,
+                "smtp-password": args.smtp_password,
+                "email-from": args.email_from,
+            },
+        )
+
+    if maintenance(args):
+        args.reset = None
+
+    return args
+
+
+def apply(args, settings: dict):
+    """Fill in unset args with either default or values from settings"""
     args.port = (
         settings.get("port", DEFAULT_WEB_PORT) if args.port is None else args.port
     )
@@ -85,23 +177,10 @@ def load(args):
         else args.email_from
     )
 
-    if args.secret is None and not os.path.isfile(args.settings):
-        print(f"Creating settings file: {args.settings}")
-        write(
-            args.settings,
-            {
-                "port": args.port,
-                "database": args.database,
-                "secret": args.secret,
-                "debug": args.debug,
-                "reset": args.reset,
-                "smtp-port": args.smtp_port,
-                "smtp-server": args.smtp_server,
-                "smtp-tls": args.smtp_tls,
-                "smtp-user": args.smtp_user,
-                "smtp-password": args.smtp_password,
-                "email-from": args.email_from,
-            },
+    for key in CACHE_KEYS:
+        value = getattr(args, key, None)
+        setattr(
+            args, key, settings.get(key.replace("_", "-")) if value is None else value
         )
 
     return args
@@ -109,7 +188,121 @@ def load(args):
 
 def write(path, settings):
     """Creates the file and writes the settings"""
+    import yaml  # pylint: disable=import-outside-toplevel
+
     os.makedirs(os.path.split(path)[0], exist_ok=True)
 
     with open(path, "w", encoding="utf-8") as settings_file:
         yaml.dump(settings, settings_file)
+
+
+def log_level(args):
+    """Set the LOGGERS to DEBUG level if args.debug, INFO otherwise"""
+    level = logging.DEBUG if args.debug else logging.INFO
+
+    for name in LOGGERS:
+        logging.getLogger(name).setLevel(level)
+
+
+def watch_log_level(watcher):
+    """log_level() now and whenever the watcher's debug setting changes
+    (flask's debugger and reloader still need a restart)
+    """
+    log_level(watcher.current)
+    watcher.subscribe(["debug"], lambda _, new: log_level(new))
+
+
+def file_stamp(path: str) -> tuple:
+    """(modified time, size) of the file at path (None if there is no file)"""
+    try:
+        info = os.stat(path)
+
+    except (OSError, TypeError):
+        return None
+
+    return (info.st_mtime_ns, info.st_size)
+
+
+class Watcher:  # pylint: disable=too-many-instance-attributes
+    """Reloads the settings file when it changes
+    current is swapped (never changed) for new args, subscribers are told what changed
+    """
+
+    def __init__(self, args, poll: float = WATCH_SECONDS):
+        """args - from load(), args.command_line still overrides the settings file
+        poll - seconds between checks of the settings file
+        """
+        self.current = args
+        self.error = None  # why the last change to the file was not loaded
+        self.__path = getattr(args, "settings", None)
+        self.__stamp = file_stamp(self.__path)
+        self.__poll = poll
+        self.__subscribers = []
+        self.__lock = threading.Lock()
+        self.__stopping = threading.Event()
+        self.__thread = None
+
+    def subscribe(self, keys, callback):
+        """callback(old args, new args) after a reload changes any of the args in keys"""
+        with self.__lock:
+            self.__subscribers.append((set(keys), callback))
+
+    def check(self) -> bool:
+        """Reload the settings file if it changed, returns True if new args were swapped in
+        A file that does not validate is ignored (see error) until it changes again
+        """
+        with self.__lock:
+            stamp = file_stamp(self.__path)
+
+            if stamp is None or stamp == self.__stamp:
+                return False
+
+            self.__stamp = stamp
+
+            try:
+                settings = read(self.__path)
+
+            except ValueError as error:
+                self.error = error
+                return False
+
+            old = self.current
+            command_line = getattr(old, "command_line", old)
+            reloaded = apply(copy.copy(command_line), settings)
+            new = copy.copy(old)
+
+            for key in RELOADABLE:
+                setattr(new, key, getattr(reloaded, key))
+
+            changed = {
+                k for k in RELOADABLE if getattr(old, k, None) != getattr(new, k)
+            }
+            self.current = new
+            self.error = None
+            subscribers = [c for k, c in self.__subscribers if k & changed]
+
+        for callback in subscribers:
+            callback(old, new)
+
+        return True
+
+    def start(self):
+        """Check the settings file every poll seconds in a thread"""
+        self.__stopping.clear()
+        self.__thread = threading.Thread(
+            target=self.__watch, name="settings", daemon=True
+        )
+        self.__thread.start()
+        return self
+
+    def __watch(self):
+        while not self.__stopping.wait(self.__poll):
+            self.check()
+
+    def stop(self):
+        """Stop checking the settings file"""
+        self.__stopping.set()
+
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
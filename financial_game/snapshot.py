@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+""" Compact, columnar binary snapshot of the serialized database
+
+    MAGIC, then the schema:
+        <u16 section count> per section: <name> <u16 column count>
+            per column: <name> <u8 kind>
+    then blocks of up to BLOCK_ROWS rows of one section (blocks of different
+    sections may be interleaved, so snapshots can be written in one pass):
+        <u16 section index> <u32 row count> per column:
+            null bitmap (1 bit per row, set = None)
+            INTEGER, CENTS, DAY - <i64> per row
+            TEXT - <u32> offset per row + 1 (into the utf-8 bytes that follow)
+    then <u16 END>
+    names are <u16 length> utf-8 bytes, all values are little endian
+"""
+
+
+import datetime
+import mmap
+import struct
+
+
+MAGIC = b"FGSNAP01"
+BLOCK_ROWS = 4096  # most rows of a section held in memory while writing
+END = 0xFFFF  # section index that marks the end of the snapshot
+INTEGER = 1  # int or None
+TEXT = 2  # str or None
+CENTS = 3  # float with 2 decimal places (money, rates) as an integer
+DAY = 4  # YYYY-MM-DD as days since 1970-01-01
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+OPTIONAL = ("password_hash", "password")  # left out of records when None
+SECTIONS = (
+    ("Bank", (("id", INTEGER), ("name", TEXT), ("url", TEXT), ("type", TEXT))),
+    (
+        "AccountType",
+        (
+            ("id", INTEGER),
+            ("bank_id", INTEGER),
+            ("name", TEXT),
+            ("type", TEXT),
+            ("url", TEXT),
+        ),
+    ),
+    (
+        "User",
+        (
+            ("id", INTEGER),
+            ("name", TEXT),
+            ("email", TEXT),
+            ("password_hash", TEXT),
+            ("password", TEXT),
+            ("sponsor_id", INTEGER),
+        ),
+    ),
+    (
+        "Account",
+        (
+            ("id", INTEGER),
+            ("user_id", INTEGER),
+            ("label", TEXT),
+            ("hint", TEXT),
+            ("purpose", TEXT),
+            ("account_type", INTEGER),
+        ),
+    ),
+    (
+        "Statement",
+        (
+            ("id", INTEGER),
+            ("account_id", INTEGER),
+            ("start_date", DAY),
+            ("end_date", DAY),
+            ("start_value", CENTS),
+            ("end_value", CENTS),
+            ("withdrawals", CENTS),
+            ("deposits", CENTS),
+            ("interest", CENTS),
+            ("fees", CENTS),
+            ("rate", CENTS),
+            ("mileage", INTEGER),
+        ),
+    ),
+)
+CHILDREN = {  # section: (parent section, parent id column, key in parent record)
+    "AccountType": ("Bank", "bank_id", "account_types"),
+    "Account": ("User", "user_id", "accounts"),
+    "Statement": ("Account", "account_id", "statements"),
+}
+ENCODE = {
+    INTEGER: lambda v: v,
+    CENTS: lambda v: int(round(v * 100)),
+    DAY: lambda v: datetime.date.fromisoformat(v).toordinal() - EPOCH,
+}
+DECODE = {
+    INTEGER: lambda v: v,
+    CENTS: lambda v: v / 100,
+    DAY: lambda v: datetime.date.fromordinal(v + EPOCH).isoformat(),
+}
+
+
+def is_snapshot(path: str) -> bool:
+    """Does the file at path start like a snapshot"""
+    with open(path, "rb") as snapshot_file:
+        return snapshot_file.read(len(MAGIC)) == MAGIC
+
+
+def encode_name(name: str) -> bytes:
+    """<u16 length> utf-8 bytes"""
+    encoded = name.encode("utf-8")
+    return struct.pack("<H", len(encoded)) + encoded
+
+
+def encode_column(kind: int, values: list) -> bytes:
+    """null bitmap followed by the values"""
+    nulls = bytearray((len(values) + 7) // 8)
+
+    for index, value in enumerate(values):
+        if value is None:
+            nulls[index // 8] |= 1 << (index % 8)
+
+    if kind == TEXT:
+        encoded = [b"" if v is None else v.encode("utf-8") for v in values]
+        offsets = [0]
+
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+
+        data = struct.pack(f"<{len(offsets)}I", *offsets) + b"".join(encoded)
+    else:
+        data = struct.pack(
+            f"<{len(values)}q", *[0 if v is None else ENCODE[kind](v) for v in values]
+        )
+
+    return bytes(nulls) + data
+
+
+class Writer:
+    """Writes rows to a snapshot, a block at a time"""
+
+    def __init__(self, stream, block_rows: int = BLOCK_ROWS):
+        """stream - binary stream to write to
+        block_rows - most rows of a section to buffer before writing
+        """
+        self.__stream = stream
+        self.__block_rows = block_rows
+        self.__index = {name: i for i, (name, _) in enumerate(SECTIONS)}
+        self.__pending = {name: [] for name, _ in SECTIONS}
+        stream.write(MAGIC + struct.pack("<H", len(SECTIONS)))
+
+        for name, columns in SECTIONS:
+            stream.write(encode_name(name) + struct.pack("<H", len(columns)))
+
+            for column, kind in columns:
+                stream.write(encode_name(column) + struct.pack("<B", kind))
+
+    def __flush(self, section: str):
+        rows = self.__pending[section]
+        columns = dict(SECTIONS)[section]
+        self.__stream.write(struct.pack("<HI", self.__index[section], len(rows)))
+
+        for column, kind in columns:
+            self.__stream.write(encode_column(kind, [r.get(column) for r in rows]))
+
+        rows.clear()
+
+    def add(self, section: str, row: dict):
+        """Add a row (column name: value) to a section"""
+        self.__pending[section].append(row)
+
+        if len(self.__pending[section]) >= self.__block_rows:
+            self.__flush(section)
+
+    def close(self):
+        """Write any buffered rows and the end marker (does not close the stream)"""
+        for section, rows in self.__pending.items():
+            if rows:
+                self.__flush(section)
+
+        self.__stream.write(struct.pack("<H", END))
+
+
+def add_users(writer: Writer, users, progress=None):
+    """Add serialized users, their accounts and statements
+    users - iterator of (id, serialized user)
+    progress - called with ("users", users added so far)
+    """
+    for count, (user_id, user) in enumerate(users, start=1):
+        writer.add("User", dict(user, id=user_id))
+
+        for account_id, account in (user.get("accounts") or {}).items():
+            writer.add("Account", dict(account, id=account_id, user_id=user_id))
+
+            for statement_id, statement in (account.get("statements") or {}).items():
+                writer.add(
+                    "Statement", dict(statement, id=statement_id, account_id=account_id)
+                )
+
+        if progress is not None:
+            progress("users", count)
+
+
+def add_banks(writer: Writer, banks, progress=None):
+    """Add serialized banks and their account types
+    banks - iterator of (id, serialized bank)
+    progress - called with ("banks", banks added so far)
+    """
+    for count, (bank_id, bank) in enumerate(banks, start=1):
+        writer.add("Bank", dict(bank, id=bank_id))
+
+        for type_id, account_type in (bank.get("account_types") or {}).items():
+            writer.add("AccountType", dict(account_type, id=type_id, bank_id=bank_id))
+
+        if progress is not None:
+            progress("banks", count)
+
+
+def write(stream, users, banks, progress=None, block_rows: int = BLOCK_ROWS):
+    """Write serialized records to a snapshot as they are produced
+    stream - binary stream to write to
+    users - iterator of (id, serialized user), eg. serialize()["users"].items()
+    banks - iterator of (id, serialized bank)
+    progress - called with (section name, records written so far in section)
+    """
+    writer = Writer(stream, block_rows)
+    add_users(writer, users, progress)
+    add_banks(writer, banks, progress)
+    writer.close()
+
+
+def decode_name(data, offset: int) -> (str, int):
+    """Returns the name and the offset after it"""
+    (length,) = struct.unpack_from("<H", data, offset)
+    start = offset + 2
+    end = start + length
+    return data[start:end].decode("utf-8"), end
+
+
+def decode_column(data, offset: int, kind: int, count: int) -> (list, int):
+    """Returns the values and the offset after them"""
+    end = offset + (count + 7) // 8
+    nulls = data[offset:end]
+    offset = end
+
+    if kind == TEXT:
+        offsets = struct.unpack_from(f"<{count + 1}I", data, offset)
+        offset += 4 * (count + 1)
+        end = offset + offsets[-1]
+        text = data[offset:end]
+        values = [text[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+        offset = end
+    else:
+        values = [
+            DECODE[kind](v) for v in struct.unpack_from(f"<{count}q", data, offset)
+        ]
+        offset += 8 * count
+
+    return [
+        None if nulls[i // 8] & (1 << (i % 8)) else v for i, v in enumerate(values)
+    ], offset
+
+
+def decode_schema(data) -> ([(str, [(str, int)])], int):
+    """Returns [(section name, [(column name, kind)])] and the offset after it"""
+    offset = len(MAGIC)
+    (section_count,) = struct.unpack_from("<H", data, offset)
+    offset += 2
+    sections = []
+
+    for _ in range(0, section_count):
+        name, offset = decode_name(data, offset)
+        (column_count,) = struct.unpack_from("<H", data, offset)
+        offset += 2
+        columns = []
+
+        for _ in range(0, column_count):
+            column, offset = decode_name(data, offset)
+            columns.append((column, data[offset]))
+            offset += 1
+
+        sections.append((name, columns))
+
+    return sections, offset
+
+
+def read_tables(path: str) -> {str: [dict]}:
+    """Read (memory-mapped) every row of every section: {section name: [row]}"""
+    with open(path, "rb") as snapshot_file:
+        with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            assert data[: len(MAGIC)] == MAGIC, f"Not a snapshot: {path}"
+            sections, offset = decode_schema(data)
+            tables = {name: [] for name, _ in sections}
+
+            while True:
+                (index,) = struct.unpack_from("<H", data, offset)
+
+                if index == END:
+                    return tables
+
+                (count,) = struct.unpack_from("<I", data, offset + 2)
+                offset += 6
+                values = []
+
+                for _, kind in sections[index][1]:
+                    column_values, offset = decode_column(data, offset, kind, count)
+                    values.append(column_values)
+
+                names = [c for c, _ in sections[index][1]]
+                tables[sections[index][0]].extend(
+                    dict(zip(names, row)) for row in zip(*values)
+                )
+
+
+def read(path: str) -> dict:
+    """Read a snapshot into the serialize() format
+    ids must be unique within each section (as serialize() produces)
+    raises ValueError for a duplicate id (eg. statement ids numbered per account)
+    """
+    tables = read_tables(path)
+    records = {}
+
+    for section, columns in SECTIONS:
+        parent = CHILDREN.get(section, (None, None, None))
+        records[section] = {}
+
+        for row in tables.get(section, []):
+            if row["id"] in records[section]:
+                raise ValueError(
+                    f"{path}: duplicate {section} id {row['id']}"
+                    + " (ids must be unique across the file, not just in their parent)"
+                )
+
+            record = {
+                c: row.get(c)
+                for c, _ in columns
+                if c not in ("id", parent[1])
+                and not (c in OPTIONAL and row.get(c) is None)
+            }
+            record.update({k: {} for p, _, k in CHILDREN.values() if p == section})
+            records[section][row["id"]] = record
+
+            if parent[0] is not None:
+                records[parent[0]][row[parent[1]]][parent[2]][row["id"]] = record
+
+    return {"users": records["User"], "banks": records["Bank"]}
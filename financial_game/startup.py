@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+""" Where the time goes when starting up (see --startup-profile)
+
+    Import times come from a cold import in a new interpreter
+    (python -X importtime), init times from timing each step of
+    starting the server in this one (on a copy of the database).
+"""
+
+
+import copy
+import importlib
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import financial_game.backup
+import financial_game.database
+import financial_game.delivery
+import financial_game.model
+
+
+SERVER_MODULES = ("financial_game.__main__", "financial_game.webserver")
+REPORT_MODULES = 25  # slowest imports reported
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def import_times(modules=SERVER_MODULES) -> list:
+    """Time a cold import of modules (in a new interpreter)
+    returns [{"module", "self", "cumulative" (seconds), "depth"}] in import order
+    """
+    imported = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    found = [IMPORT_TIME.match(line) for line in imported.stderr.split("\n")]
+    return [
+        {
+            "module": m.group(4),
+            "self": int(m.group(1)) / 1000000.0,
+            "cumulative": int(m.group(2)) / 1000000.0,
+            "depth": len(m.group(3)) // 2,
+        }
+        for m in found
+        if m is not None
+    ]
+
+
+def database_copy(url: str, workspace: str) -> str:
+    """url of a copy (in workspace) of the sqlite database at url
+    (an empty database if there is no database file at url)
+    """
+    parts = urllib.parse.urlparse(url)
+    path = os.path.join(workspace, "startup.sqlite3")
+
+    if os.path.isfile(parts.path):
+        connection = financial_game.database.Connection.connect(url)
+        financial_game.backup.backup(connection, path)
+        connection.close()
+
+    return urllib.parse.urlunparse(parts._replace(path=path))
+
+
+def init_times(args) -> list:
+    """Time each step of starting the server with args (the app is not run)
+    The database is a copy (it is never reset or migrated) and delivery threads
+    are not started (queued emails are not sent)
+    returns [{"step", "seconds"}]
+    """
+    steps = []
+
+    def timed(step: str, function, *arguments):
+        start = time.perf_counter()
+        result = function(*arguments)
+        steps.append({"step": step, "seconds": time.perf_counter() - start})
+        return result
+
+    with tempfile.TemporaryDirectory() as workspace:
+        args = copy.copy(args)
+        args.database = database_copy(args.database, workspace)
+        database = timed("open database", financial_game.model.Database, args.database)
+        delivery = timed("create delivery", financial_game.delivery.Delivery, args)
+        webserver = timed(
+            "import financial_game.webserver",
+            importlib.import_module,
+            "financial_game.webserver",
+        )
+        timed("create app", webserver.create_app, args, delivery)
+        timed("close database", database.close)
+
+    return steps
+
+
+def report(imports: list, steps: list, top: int = REPORT_MODULES) -> list:
+    """Lines describing import_times() (the slowest top modules) and init_times()"""
+    total = sum(i["cumulative"] for i in imports if i["depth"] == 0)
+    slowest = sorted(imports, key=lambda i: i["cumulative"], reverse=True)[:top]
+    lines = [f"imports {1000.0 * total:9.3f} ms  ({len(imports)} modules)"]
+    lines.extend(
+        f"  {1000.0 * i['cumulative']:9.3f} ms  (self {1000.0 * i['self']:7.3f} ms)"
+        + f"  {i['module']}"
+        for i in slowest
+    )
+    lines.append(f"init    {1000.0 * sum(s['seconds'] for s in steps):9.3f} ms")
+    lines.extend(f"  {1000.0 * s['seconds']:9.3f} ms  {s['step']}" for s in steps)
+    return lines
@@ -5,6 +5,14 @@
 
 
 import datetime
+import functools
+
+import financial_game.money
+
+
+PRELOAD_BATCH = 500  # most ids in one IN (...) clause when preloading
+DATE_CACHE_SIZE = 4096  # distinct dates memoized by IntDate.normalize
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
 
 
 class DatabaseType:
@@ -45,18 +53,23 @@ class Fixed(Integer):
 
     def normalize(self, value):
         """convert value (100) to usable type (10.00)"""
-        return float(value) / pow(10, self.__precision)
+        return None if value is None else float(value) / pow(10, self.__precision)
 
     def denormalize(self, value):
         """convert usable type (10.00) to database value (100)"""
-        return int(round(value * pow(10, self.__precision)))
+        return None if value is None else int(round(value * pow(10, self.__precision)))
 
 
-class Money(Fixed):
-    """Currency"""
+class Money(Integer):
+    """Currency, stored as integer cents and used as financial_game.money.Money"""
 
-    def __init__(self, precision: int = 2, allow_null: bool = True):
-        super().__init__(precision, allow_null)
+    def normalize(self, value):
+        """convert value (1025) to usable type (Money 10.25)"""
+        return None if value is None else financial_game.money.Money(value)
+
+    def denormalize(self, value):
+        """convert usable type (Money or number 10.25) to database value (1025)"""
+        return None if value is None else financial_game.money.Money.parse(value).cents
 
 
 class Identifier(DatabaseType):
@@ -89,6 +102,16 @@ class String(DatabaseType):
         return f"VARCHAR({self.length}){self.null_clause()}"
 
 
+class Text(DatabaseType):
+    """text of any length"""
+
+    def __init__(self, allow_null: bool = True):
+        super().__init__(allow_null)
+
+    def __str__(self):
+        return f"TEXT{self.null_clause()}"
+
+
 class Enum(String):
     """enum"""
 
@@ -141,33 +164,67 @@ class Date(String):
         return value.strftime("%Y-%m-%d") + " 00:00:00.000"
 
 
-class IntDate(Integer):
-    """Date as days since epoch"""
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def date_from_days(days: int) -> datetime.date:
+    """The date days after 1970-01-01 (memoized, statements share a few dates)"""
+    return datetime.date.fromordinal(days + EPOCH_ORDINAL)
 
-    ONE_DAY_IN_SECONDS = 60.0 * 60.0 * 24.0
+
+def date_cache_size(size: int = None):
+    """Memoize up to size (DATE_CACHE_SIZE if None) dates in date_from_days
+    the memo is emptied if the size changes
+    """
+    global date_from_days  # pylint: disable=global-statement,invalid-name
+    size = DATE_CACHE_SIZE if size is None else size
+
+    if date_from_days.cache_parameters()["maxsize"] != size:
+        date_from_days = functools.lru_cache(maxsize=size)(date_from_days.__wrapped__)
+
+
+def watch(watcher):
+    """date_cache_size() now and whenever the watcher's date_cache_size changes"""
+    date_cache_size(getattr(watcher.current, "date_cache_size", None))
+    watcher.subscribe(
+        ["date_cache_size"], lambda _, new: date_cache_size(new.date_cache_size)
+    )
+
+
+class IntDate(Integer):
+    """Date as days since 1970-01-01"""
 
     def normalize(self, value):
-        """convert value (YYYY-MM-DD HH:MM:SS.SSS) to usable type"""
-        return (
-            None
-            if value is None
-            else datetime.datetime.fromtimestamp(
-                value * IntDate.ONE_DAY_IN_SECONDS
-            ).date()
-        )
+        """convert value (days since 1970-01-01) to usable type"""
+        return None if value is None else date_from_days(round(value))
 
     def denormalize(self, value):
-        """convert usable type to database value (YYYY-MM-DD HH:MM:SS.SSS)"""
-        return int(
-            datetime.datetime.combine(value, datetime.datetime.min.time()).timestamp()
-            / IntDate.ONE_DAY_IN_SECONDS
-        )
+        """convert usable type to database value (days since 1970-01-01)"""
+        return None if value is None else value.toordinal() - EPOCH_ORDINAL
+
+
+def preloadable(method):
+    """Relation method that returns the value Table.preload() stored, if any
+    (only when called without arguments)
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        preloaded = self.__dict__.get("_preloaded_", {})
+
+        if args or kwargs or method.__name__ not in preloaded:
+            return method(self, *args, **kwargs)
+
+        value = preloaded[method.__name__]
+        return list(value) if isinstance(value, list) else value
+
+    return wrapper
 
 
 class Table:
     """Table model"""
 
-    __IGNORE_TYPES = ["function", "staticmethod"]
+    __IGNORE_TYPES = ["function", "staticmethod", "classmethod"]
+    __FIELDS = {}  # {Table subclass: [field names]}, dir() is too slow per row
+    _db = None
 
     @staticmethod
     def name(table_subclass: type) -> str:
@@ -182,6 +239,11 @@ class Table:
             for t in tables
         }
 
+    @staticmethod
+    def database_indexes(*tables):
+        """Get the indexes (from __indexes__) that can be passed to database"""
+        return {Table.name(t): list(t.__dict__.get("__indexes__", [])) for t in tables}
+
     @staticmethod
     def __is_field(name: str, table_subclass: type) -> bool:
         maybe = not name.startswith("_") and name in table_subclass.__dict__
@@ -201,7 +263,12 @@ class Table:
 
     @staticmethod
     def __fields(table_subclass: type) -> [str]:
-        return [f for f in dir(table_subclass) if Table.__is_field(f, table_subclass)]
+        if table_subclass not in Table.__FIELDS:
+            Table.__FIELDS[table_subclass] = [
+                f for f in dir(table_subclass) if Table.__is_field(f, table_subclass)
+            ]
+
+        return Table.__FIELDS[table_subclass]
 
     @staticmethod
     def normalize_field(table_subclass: type, field: str, value: any) -> any:
@@ -241,6 +308,100 @@ class Table:
         if do_normalize:
             self.normalize()
 
+    @staticmethod
+    def relations(table_subclass: type) -> dict:
+        """Get the relations that can be preloaded for the type
+        returns {method name: (related Table type, related column, field, many, order)}
+            related rows are those where related column == self.field
+            order - the columns the method sorts by (so preloading sorts the same)
+        """
+        return table_subclass.__dict__.get("__relations__", {})
+
+    @classmethod
+    def fetch_in(cls, column: str, keys: list, order: [str] = ("id",)) -> list:
+        """Get every row where column is one of keys (in batches of PRELOAD_BATCH)
+        sorted by column then order
+        """
+        found = []
+
+        for start in range(0, len(keys), PRELOAD_BATCH):
+            end = start + PRELOAD_BATCH
+            batch = keys[start:end]
+            names = [f"key{i}" for i in range(0, len(batch))]
+            found.extend(
+                cls(**r)
+                for r in cls._db.get_all(
+                    Table.name(cls),
+                    _where_=f"{column} IN ({', '.join(':' + n for n in names)})",
+                    _order_by_=[column, *order],
+                    **dict(zip(names, batch)),
+                )
+            )
+
+        return found
+
+    @staticmethod
+    def preload(objects: list, include: [str]):
+        """Fetch related objects, one query per relation level (and batch of ids)
+        objects - list of instances of one Table type
+        include - relation paths, e.g. ["accounts.statements", "accounts.account_type"]
+        """
+        tree = {}
+
+        for path in include:
+            level = tree
+
+            for relation in path.split("."):
+                level = level.setdefault(relation, {})
+
+        Table.__preload(objects, tree)
+
+    @staticmethod
+    def __preload(objects: list, tree: dict):
+        if not objects:
+            return
+
+        relations = Table.relations(objects[0].__class__)
+
+        for relation, subtree in tree.items():
+            related_type, column, field, many, order = relations[relation]
+            found = {}
+
+            for row in related_type.fetch_in(
+                column, list({o.__dict__[field] for o in objects} - {None}), order
+            ):
+                found.setdefault(row.__dict__[column], []).append(row)
+
+            for instance in objects:
+                matches = found.get(instance.__dict__[field], [])
+                preloaded = instance.__dict__.setdefault("_preloaded_", {})
+                preloaded[relation] = matches if many else (matches or [None])[0]
+
+            Table.__preload([r for m in found.values() for r in m], subtree)
+
+    @staticmethod
+    def validate(objects: list):
+        """Assert that no non-nullable field is None in objects (of one Table type)
+        and that each passes its check()
+        """
+        if not objects:
+            return
+
+        table_subclass = objects[0].__class__
+        required = [
+            f
+            for f in Table.__fields(table_subclass)
+            if not Table.__type(table_subclass, f).allow_null
+        ]
+
+        for instance in objects:
+            missing = [f for f in required if instance.__dict__.get(f, None) is None]
+            assert not missing, f"{missing} missing in {instance!r}"
+            instance.check()
+
+    def check(self):
+        """Assert the (not normalized) values are consistent, see validate()"""
+
     def normalize(self):
         """Converts database types to user-friendly types"""
         for field in Table.__fields(self.__class__):
@@ -6,11 +6,14 @@
 
 import os
 
-import mako.lookup
+import financial_game.metrics
 
 
+@financial_game.metrics.timed("render")
 def render(template_path, *search_dirs, **args):
     """Render a template file searching for includes in given directories and using given args"""
+    import mako.lookup  # pylint: disable=import-outside-toplevel
+
     script_dir = os.path.split(os.path.realpath(__file__))[0]
     search_dirs = list(search_dirs)
     script_parent_dir = os.path.split(script_dir)[0]
@@ -0,0 +1,33 @@
+<html>
+    <body>
+        <p>${user_name},</p>
+        <p>
+            Your statements
+            % if start is not None:
+                from ${start.isoformat()}
+            % endif
+            % if end is not None:
+                through ${end.isoformat()}
+            % endif
+        </p>
+        % if totals:
+        <table>
+            <tr>
+                <th>Purpose</th><th>Statements</th><th>Deposits</th><th>Withdrawals</th><th>Interest</th><th>Fees</th>
+            </tr>
+            % for purpose, total in totals.items():
+            <tr>
+                <td>${purpose}</td>
+                <td>${total["statements"]}</td>
+                <td>${format(total["deposits"], ",.2f")}</td>
+                <td>${format(total["withdrawals"], ",.2f")}</td>
+                <td>${format(total["interest"], ",.2f")}</td>
+                <td>${format(total["fees"], ",.2f")}</td>
+            </tr>
+            % endfor
+        </table>
+        % else:
+        <p>No statements.</p>
+        % endif
+    </body>
+</html>
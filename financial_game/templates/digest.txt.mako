@@ -0,0 +1,17 @@
+${user_name},
+
+Your statements\
+% if start is not None:
+ from ${start.isoformat()}\
+% endif
+% if end is not None:
+ through ${end.isoformat()}\
+% endif
+
+
+% for purpose, total in totals.items():
+${purpose}: ${total["statements"]} statements, deposits ${format(total["deposits"], ",.2f")}, withdrawals ${format(total["withdrawals"], ",.2f")}, interest ${format(total["interest"], ",.2f")}, fees ${format(total["fees"], ",.2f")}
+% endfor
+% if not totals:
+No statements.
+% endif
@@ -9,21 +9,27 @@ import flask
 import financial_game.template
 import financial_game.model
 from financial_game.model_bank import Bank, AccountType, TypeOfAccount
-from financial_game.model_user import Account, AccountPurpose
+from financial_game.model_user import Account, AccountPurpose, HashersBusy
 import financial_game.sessionkey
+import financial_game.metrics
 
 
 COOKIE = "user-id"  # name of the cookie that contains the session key
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")  # who may see /metrics
+BUSY_RETRY_SECONDS = 1  # Retry-After when too many logins are waiting
+TIMED = ("db", "render", "session")  # categories recorded for every route
 
 
 def get_user(request, args):
     """Determines the user (or None) that is requesting the page"""
     if COOKIE in request.cookies:
-        user_id, password_hash = financial_game.sessionkey.parse(
-            request.cookies[COOKIE],
-            request.headers,
-            args.secret,
-        )
+        with financial_game.metrics.measure("session"):
+            user_id, password_hash = financial_game.sessionkey.parse(
+                request.cookies[COOKIE],
+                request.headers,
+                args.secret,
+            )
+
         user = financial_game.model.User.fetch(user_id)
 
         if user is not None and user.password_hash == password_hash:
@@ -37,9 +43,51 @@ def none_if_empty(value: str) -> str:
     return value if value else None
 
 
-def create_app(args):
-    """create the flask app"""
+def instrument(app, delivery=None):
+    """Time each request: Server-Timing header and histograms at /metrics
+    delivery - financial_game.delivery.Delivery to report at /metrics/delivery
+    """
+    metrics = financial_game.metrics.Metrics()
+
+    @app.before_request
+    def start_timing():
+        financial_game.metrics.begin()
+
+    @app.after_request
+    def report_timing(response):
+        timings = financial_game.metrics.end()
+        rule = flask.request.url_rule
+        route = f"{flask.request.method} {'*' if rule is None else rule.rule}"
+        metrics.record(route, timings, TIMED)
+        response.headers["Server-Timing"] = timings.server_timing()
+        return response
+
+    @app.route("/metrics")
+    def metrics_report():
+        """Timing histograms per route, only for requests from this machine"""
+        if flask.request.remote_addr not in LOCAL_ADDRESSES:
+            flask.abort(404)
+
+        return flask.jsonify(metrics.to_dict())
+
+    @app.route("/metrics/delivery")
+    def delivery_report():
+        """Outbox depth and delivery latency, only for requests from this machine"""
+        if flask.request.remote_addr not in LOCAL_ADDRESSES or delivery is None:
+            flask.abort(404)
+
+        return flask.jsonify(delivery.to_dict())
+
+    return metrics
+
+
+def create_app(args, delivery=None):
+    """create the flask app
+    delivery - the financial_game.delivery.Delivery emails are sent with (if any)
+    """
     app = flask.Flask(__name__)
+    app.delivery = delivery
+    instrument(app, delivery)
 
     # Mark: Root
 
@@ -112,7 +160,20 @@ def create_app(args):
     def login():
         user = financial_game.model.User.lookup(flask.request.form["email"])
 
-        if user and user.password_matches(flask.request.form["password"]):
+        try:
+            matches = user and user.password_matches(flask.request.form["password"])
+
+        except HashersBusy:
+            return (
+                "Too many logins, try again",
+                503,
+                {"Retry-After": str(BUSY_RETRY_SECONDS)},
+            )
+
+        if matches:
+            if user.password_outdated():
+                user.change(password=flask.request.form["password"])
+
             response = flask.make_response(flask.redirect(flask.url_for("home")))
             session_key = financial_game.sessionkey.create(
                 user, flask.request.headers, args.secret
@@ -132,4 +132,4 @@ if __name__ == "__main__":
     if args.inlined:
         args.inlined = dict(p.split(':') for p in args.inlined)
 
-    financial_game.email.send(args, args.to, args.subject, args.html, args.text, args.attachments, args.inlined, args.encoding)
+    financial_game.email.send(args, args.to, args.subject, args.html, args.text, args.attachments, args.inlined, args.encoding, quiet=False)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import financial_game.__main__
+import financial_game.backup
+import financial_game.database
+import financial_game.model
+from financial_game.model_user import User
+
+
+def names(path):
+    connection = sqlite3.connect(path)
+    found = [r[0] for r in connection.execute("SELECT name FROM user ORDER BY id;")]
+    connection.close()
+    return found
+
+
+def fill(db, start, count):
+    db.insert_many("user", [{"name": f"{'x' * 200} user #{i}"} for i in range(start, start + count)])
+
+
+def test_live_backup():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/test.sqlite3")
+        db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(250)")
+        fill(db, 0, 1000)
+        finished = {}
+
+        def write_during_backup():
+            time.sleep(0.05)
+            db.insert("user", name="during backup")
+            finished["insert"] = time.perf_counter()
+
+        writer = threading.Thread(target=write_during_backup)
+        writer.start()
+        db.backup(f"{workspace}/backup.sqlite3", pages=1, spacing=0.005)
+        finished["backup"] = time.perf_counter()
+        writer.join()
+        assert finished["insert"] < finished["backup"], finished
+        copied = names(f"{workspace}/backup.sqlite3")
+        assert len(copied) in (1000, 1001), len(copied)
+
+        try:
+            db.backup(f"{workspace}/missing/backup.sqlite3")
+            raise AssertionError("should not be able to back up to a missing directory")
+
+        except sqlite3.OperationalError as error:
+            assert "unable to open" in str(error), error
+
+        closer = threading.Thread(target=db.close)
+        backup = threading.Thread(target=db.backup, args=(f"{workspace}/closing.sqlite3", 1, 0.005))
+        backup.start()
+        time.sleep(0.02)
+        closer.start()
+        backup.join()
+        closer.join()
+        assert len(names(f"{workspace}/closing.sqlite3")) == len(names(f"{workspace}/test.sqlite3"))
+
+
+def test_compressed():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/test.sqlite3?threadsafe=false")
+        db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(250)")
+        fill(db, 0, 500)
+        path = financial_game.backup.backup(db, f"{workspace}/backup.gz", compress=True, pages=10, spacing=0.0)
+        assert path == f"{workspace}/backup.gz"
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE);", None)  # so the file has every page
+        assert os.path.getsize(path) < os.path.getsize(f"{workspace}/test.sqlite3") / 4
+
+        with gzip.open(path, "rb") as backup_file:
+            assert backup_file.read(16) == b"SQLite format 3\0"
+
+        assert not os.path.exists(f"{workspace}/backup.gz.partial")
+
+        with open(f"{workspace}/restored.sqlite3-wal", "wb") as stale:
+            stale.write(b"left by an earlier database")
+
+        financial_game.backup.restore(path, f"{workspace}/restored.sqlite3")
+        assert not os.path.exists(f"{workspace}/restored.sqlite3-wal")
+        assert names(f"{workspace}/restored.sqlite3") == names(f"{workspace}/test.sqlite3")
+        db.close()
+
+
+def test_incremental():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/test.sqlite3")
+        db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(250)")
+        fill(db, 0, 1000)
+        destination = f"{workspace}/backup"
+        assert financial_game.backup.backup(db, destination, incremental=True) == destination
+        fill(db, 1000, 10)
+        second = financial_game.backup.backup(db, destination, compress=True, incremental=True)
+        assert second == f"{destination}.1"
+        assert os.path.getsize(second) < os.path.getsize(destination) / 10
+        db.execute("DELETE FROM user WHERE id > 20;", None)
+        db.execute("VACUUM;", None)
+        assert financial_game.backup.backup(db, destination, incremental=True) == f"{destination}.2"
+        assert financial_game.backup.increments(destination) == [destination, f"{destination}.1", f"{destination}.2"]
+
+        financial_game.backup.restore(destination, f"{workspace}/restored.sqlite3")
+        assert names(f"{workspace}/restored.sqlite3") == names(f"{workspace}/test.sqlite3")
+        assert len(names(f"{workspace}/restored.sqlite3")) == 20
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE);", None)  # so the file has every page
+        assert os.path.getsize(f"{workspace}/restored.sqlite3") == os.path.getsize(f"{workspace}/test.sqlite3")
+        full = financial_game.backup.backup(db, f"{workspace}/full")
+
+        try:
+            financial_game.backup.backup(db, full, incremental=True)
+            raise AssertionError("a full backup is not the start of an incremental chain")
+
+        except ValueError as error:
+            assert "incremental" in str(error), error
+
+        assert financial_game.backup.increments(full) == [full]
+        assert not os.path.exists(f"{full}.partial")
+        db.close()
+
+
+def test_main_backup():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/test.sqlite3")
+        db.create_table("note", id="INTEGER PRIMARY KEY", text="VARCHAR(250)")
+        db.close()
+        old_argv = sys.argv
+        sys.argv = ["financial_game", "--settings", f"{workspace}/settings.yaml", "--secret", "secret",
+                    "--db", f"{workspace}/test.sqlite3", "--backup", f"{workspace}/backup.sqlite3"]
+
+        try:
+            financial_game.__main__.main()
+
+        finally:
+            sys.argv = old_argv
+
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/test.sqlite3")
+        assert db.table_columns("Statement") == {}  # the live database was not prepared
+        db.close()
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/backup.sqlite3")
+        assert db.table_columns("note") == {"id": "INTEGER", "text": "VARCHAR(250)"}
+        db.close()
+
+
+def test_model_backup():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database(f"sqlite:///{workspace}/test.sqlite3")
+        User.create("john.appleseed@apple.com", "Setec astronomy", "John")
+        assert db.backup(f"{workspace}/backup.sqlite3") == f"{workspace}/backup.sqlite3"
+        db.close()
+        db = financial_game.model.Database(f"sqlite:///{workspace}/backup.sqlite3")
+        assert User.lookup("john.appleseed@apple.com").name == "John"
+        db.close()
+
+
+if __name__ == "__main__":
+    test_live_backup()
+    test_compressed()
+    test_incremental()
+    test_main_backup()
+    test_model_backup()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import os
+import queue
+import smtplib
+import ssl
+import tempfile
+import types
+from datetime import date
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+import financial_game.campaign
+import financial_game.model
+from financial_game.model_user import User, Account, Statement, AccountPurpose
+from financial_game.model_bank import Bank, AccountType, TypeOfAccount
+
+
+class Handler:
+    def __init__(self, out_queue):
+        self.__queue = out_queue
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("nobody@"):
+            return '550 No such user'
+
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.__queue.put((envelope.rcpt_tos, envelope.content.decode('utf8', errors='replace')))
+        return '250 Message accepted for delivery'
+
+
+def start_server(email_queue, port):
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain('tests/localhost_cert.pem', 'tests/localhost_key.pem')
+    controller = Controller(Handler(email_queue), "localhost", port, auth_require_tls=False,
+                            authenticator=lambda *a: AuthResult(success=True), tls_context=context)
+    controller.start()
+    return controller
+
+
+def campaign_args(port):
+    return types.SimpleNamespace(
+        email_from="Marc Page <Marc@ResolveToExcel.com>",
+        smtp_server="localhost",
+        smtp_port=port,
+        smtp_user="user",
+        smtp_password="password",
+        smtp_tls=True,
+        campaign_workers=2,
+        campaign_rate=1000.0,
+        campaign_batch=2,
+    )
+
+
+def drain(email_queue):
+    messages = []
+
+    while not email_queue.empty():
+        messages.append(email_queue.get())
+
+    return messages
+
+
+def test_checkpoint():
+    with tempfile.TemporaryDirectory() as workspace:
+        path = os.path.join(workspace, "campaign.json")
+        assert financial_game.campaign.read_checkpoint(None) == {"after": None, "sent": 0, "failed": 0}
+        assert financial_game.campaign.read_checkpoint(path) == {"after": None, "sent": 0, "failed": 0}
+        financial_game.campaign.write_checkpoint(path, {"after": ("John", 3), "sent": 2, "failed": 1})
+        assert financial_game.campaign.read_checkpoint(path) == {"after": ("John", 3), "sent": 2, "failed": 1}
+        assert os.listdir(workspace) == ["campaign.json"]
+
+
+def test_digest():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        john = User.create("john.appleseed@apple.com", "hash", "John", pw_hashed=True)
+        jane = User.create("jane.doe@apple.com", "hash", "Jane", pw_hashed=True)
+        boa = Bank.create("Bank of America", "https://www.bankofamerica.com/")
+        boa_check = AccountType.create(boa.id, "Advantage Banking", TypeOfAccount.CHCK)
+        john_checking = Account.create(john, boa_check, "budget", "usual", AccountPurpose.BUDG)
+        john_other = Account.create(john, boa_check, "other", "usual")
+        Statement.create(account=john_checking, start_date=date(2022, 6, 1), end_date=date(2022, 6, 30), start_value=3.14, end_value=13.37, deposits=12.95, withdrawals=2.72, fees=0.00, interest=0.00, rate=0.50)
+        Statement.create(account=john_checking, start_date=date(2022, 5, 1), end_date=date(2022, 5, 31), start_value=0.00, end_value=3.14, deposits=12.95, withdrawals=9.20, fees=0.81, interest=0.20, rate=0.50)
+        Statement.create(account=john_other, start_date=date(2022, 6, 1), end_date=date(2022, 6, 30), start_value=0.00, end_value=1.00, deposits=1.00, withdrawals=0.00, fees=0.00, interest=0.00, rate=0.50)
+        context = financial_game.campaign.digest(date(2022, 6, 1), date(2022, 6, 30))
+        john_context = context(john)
+        assert john_context["user_name"] == "John"
+        assert list(john_context["totals"]) == ["OTHER", "BUDG"], john_context
+        assert john_context["totals"]["BUDG"]["statements"] == 1
+        assert john_context["totals"]["BUDG"]["deposits"] == 12.95
+        html, text = financial_game.campaign.render_bodies(financial_game.campaign.DIGEST_HTML, financial_game.campaign.DIGEST_TEXT, john_context)
+        assert "<td>12.95</td>" in html, html
+        assert "from 2022-06-01 through 2022-06-30" in text, text
+        assert "BUDG: 1 statements, deposits 12.95, withdrawals 2.72" in text, text
+        html, text = financial_game.campaign.render_bodies(None, financial_game.campaign.DIGEST_TEXT, financial_game.campaign.digest()(jane))
+        assert html is None
+        assert "No statements." in text, text
+        db.close()
+
+
+def test_campaign():
+    email_queue = queue.Queue()
+    smtp_server = start_server(email_queue, 8030)
+    args = campaign_args(smtp_server.port)
+
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        checkpoint = os.path.join(workspace, "digest.json")
+        users = [User.create(f"{n.lower()}@apple.com", "hash", n, pw_hashed=True) for n in ["Ann", "Bob", "Cat", "Dan", "Eve"]]
+        User.create("nobody@apple.com", "hash", "Cy", pw_hashed=True)  # refused by the server
+        context = financial_game.campaign.digest()
+
+        try:
+            first = financial_game.campaign.Campaign(args, "Digest", context, checkpoint=checkpoint).run(limit=2)
+            assert first == {"after": ("Bob", users[1].id), "sent": 2, "failed": 0, "errors": []}, first
+            assert financial_game.campaign.read_checkpoint(checkpoint)["after"] == ("Bob", users[1].id)
+            resumed = financial_game.campaign.Campaign(args, "Digest", context, checkpoint=checkpoint).run()
+            assert resumed["sent"] == 5, resumed
+            assert resumed["failed"] == 1, resumed
+            assert resumed["errors"][0][0] == User.lookup("nobody@apple.com").id, resumed
+            assert resumed["after"] == ("Eve", users[4].id), resumed
+            messages = drain(email_queue)
+            assert sorted(r for m in messages for r in m[0]) == sorted(u.email for u in users), messages
+            assert all("Subject: =?utf-8?q?Digest?=" in m[1] for m in messages), messages
+            again = financial_game.campaign.Campaign(args, "Digest", context, checkpoint=checkpoint).run()
+            assert again["sent"] == 5, again  # everyone already sent
+            assert drain(email_queue) == []
+
+            def stopping(user):
+                campaign.stop()
+                return context(user)
+
+            campaign = financial_game.campaign.Campaign(args, "Digest", stopping, html_template=None)
+            assert campaign.run()["sent"] == 0
+
+        finally:
+            smtp_server.stop()
+
+        failing = os.path.join(workspace, "failing.json")
+
+        try:
+            financial_game.campaign.Campaign(args, "Digest", context, checkpoint=failing).run()
+            raise AssertionError("server is stopped, sending should fail")
+
+        except (smtplib.SMTPException, OSError) as error:
+            assert not financial_game.delivery.permanent(error), error
+
+        assert not os.path.isfile(failing)
+        db.close()
+
+    financial_game.email.close_pools()
+
+
+if __name__ == "__main__":
+    test_checkpoint()
+    test_digest()
+    test_campaign()
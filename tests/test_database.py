@@ -5,6 +5,7 @@ import tempfile
 import os
 import threading
 import queue
+import json
 
 import financial_game.database
 from financial_game.database import Join
@@ -408,7 +409,355 @@ def test_change():
         db.close()
 
 
+def test_slow_query_log():
+    with tempfile.TemporaryDirectory() as workspace:
+        db_path = os.path.join(workspace, "test.sqlite3")
+        log_path = os.path.join(workspace, "slow.log")
+        db = financial_game.database.Connection.connect(
+            f"sqlite://{db_path}?threadsafe=false&slow_query_ms=0&slow_query_log={log_path}")
+        db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(50)", email="VARCHAR(50)")
+        db.insert('user', name="John", email="john.appleseed@apple.com")
+        db.get_one_or_none('user', email="John.Appleseed@Apple.com", _where_="email LIKE :email")
+        db.get_one_or_none('user', email="John.Appleseed@Apple.com", _where_="email LIKE :email")
+        db.execute("DROP TABLE user;", None)
+        db.close()
+
+        with open(log_path, "r", encoding="utf-8") as log_file:
+            entries = [json.loads(line) for line in log_file]
+
+        assert len(entries) == 5, entries
+        insert = [e for e in entries if e["statement"].startswith("INSERT")][0]
+        assert insert["parameters"] == ["str", "str"], insert
+        lookup = [e for e in entries if "LIKE" in e["statement"]][0]
+        assert lookup["parameters"] == {"email": "str"}, lookup
+        assert lookup["plan"] == ["SCAN user"], lookup
+        assert lookup["ms"] >= 0.0, lookup
+        drop = [e for e in entries if e["statement"].startswith("DROP")][0]
+        assert drop["parameters"] is None, drop
+        assert drop["plan"][0].startswith("ERROR:"), drop
+
+        summary = financial_game.database.slow_query_summary(log_path)
+        assert len(summary) == 4, summary
+        lookup = [q for q in summary if "LIKE" in q["statement"]][0]
+        assert lookup["count"] == 2, lookup
+        assert lookup["scans"] == ["SCAN user"], lookup
+        assert lookup["max_ms"] <= lookup["total_ms"], lookup
+        assert summary[0]["total_ms"] >= summary[-1]["total_ms"], summary
+
+
+def test_slow_query_threshold():
+    with tempfile.TemporaryDirectory() as workspace:
+        db_path = os.path.join(workspace, "test.sqlite3")
+        db = financial_game.database.Connection.connect(f"sqlite://{db_path}?slow_query_ms=60000")
+        db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(50)")
+        db.insert('user', name="John")
+        assert len(db.get_all('user')) == 1
+        db.close()
+        assert not os.path.isfile(db_path + ".slow_queries.log")
+        assert financial_game.database.slow_query_summary(db_path + ".slow_queries.log") == []
+
+
+def test_slow_query_rotation():
+    with tempfile.TemporaryDirectory() as workspace:
+        log_path = os.path.join(workspace, "rotating.log")
+        old_size = financial_game.database.SLOW_QUERY_LOG_BYTES
+        financial_game.database.SLOW_QUERY_LOG_BYTES = 512
+        db = financial_game.database.Connection.connect(
+            f"sqlite://{workspace}/test.sqlite3?threadsafe=false&slow_query_ms=0&slow_query_log={log_path}")
+        financial_game.database.SLOW_QUERY_LOG_BYTES = old_size
+        db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(50)")
+
+        for index in range(0, 20):
+            db.insert('user', name=f"user #{index}")
+
+        db.close()
+        assert os.path.isfile(log_path + ".1")
+        summary = financial_game.database.slow_query_summary(log_path)
+        insert = [q for q in summary if q["statement"].startswith("INSERT")][0]
+        assert insert["count"] > 5, insert
+
+
+def test_journal_mode():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/wal.sqlite3")
+        db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(50)")
+        db.insert("user", name="John")
+        assert db.fetch_one_or_none("PRAGMA journal_mode;").journal_mode == financial_game.database.JOURNAL_MODE
+        assert os.path.isfile(f"{workspace}/wal.sqlite3-wal")
+        assert os.path.isfile(f"{workspace}/wal.sqlite3-shm")
+        db.close()
+        assert not os.path.isfile(f"{workspace}/wal.sqlite3-wal")  # checkpointed on close
+        kept = financial_game.database.Connection(financial_game.database.Sqlite(f"{workspace}/wal.sqlite3", journal_mode=None))
+        assert kept.fetch_one_or_none("PRAGMA journal_mode;").journal_mode == "wal"  # stored in the file
+        kept.close()
+
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/wal.sqlite3?journal_mode=delete")
+        assert db.fetch_one_or_none("PRAGMA journal_mode;").journal_mode == "delete"
+        assert [u.name for u in db.get_all("user")] == ["John"]
+        reader = db.reader()
+        assert reader.fetch_one_or_none("PRAGMA journal_mode;").journal_mode == "delete"  # unchanged
+        reader.close()
+        db.close()
+        assert not os.path.isfile(f"{workspace}/wal.sqlite3-wal")
+
+        for path in financial_game.database.IN_MEMORY:  # not a database file
+            in_memory = financial_game.database.Connection(financial_game.database.Sqlite(path))
+            assert in_memory.fetch_one_or_none("PRAGMA journal_mode;").journal_mode != "wal"
+            in_memory.close()
+
+        try:
+            financial_game.database.Sqlite(f"{workspace}/bad.sqlite3", journal_mode="wal; DROP TABLE user")
+            raise AssertionError("unknown journal mode should fail")
+
+        except ValueError as error:
+            assert "journal_mode" in str(error), error
+
+
+def test_fetch_each():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/test.sqlite3")
+        db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(50)")
+
+        for index in range(0, 25):
+            db.insert('user', name=f"user #{index}")
+
+        reader = db.reader()
+        assert reader.fetch_one_or_none("PRAGMA journal_mode;").journal_mode == "wal"
+        names = [u.name for u in reader.fetch_each("SELECT * FROM user ORDER BY id;", _batch_size_=10)]
+        assert names == [f"user #{i}" for i in range(0, 25)], names
+        rows = list(reader.fetch_each("SELECT * FROM user WHERE id > :id;", id=20, _as_objects_=False))
+        assert [r["id"] for r in rows] == [21, 22, 23, 24, 25], rows
+        assert list(reader.fetch_each("SELECT * FROM user WHERE id > 100;")) == []
+        reader.close()
+        db.close()
+
+        unnamed = financial_game.database.Connection(financial_game.database.Sqlite(f"{workspace}/test.sqlite3"))
+
+        try:
+            unnamed.reader()
+            raise AssertionError("reader() should require a url")
+
+        except AssertionError as error:
+            assert "not opened" in str(error), error
+
+        for url in ("sqlite://", "sqlite://:memory:"):
+            in_memory = financial_game.database.Connection.connect(url)
+
+            try:
+                in_memory.reader()
+                raise AssertionError(f"{url} should not have readers")
+
+            except ValueError as error:
+                assert "database file" in str(error), error
+
+            in_memory.close()
+
+        unnamed.close()
+
+
+def test_insert_many():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/test.sqlite3")
+        db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(50) NOT NULL")
+        assert db.insert_many("user", []) == 0
+
+        with db.transaction():
+            assert db.insert_many("user", [{"id": 5, "name": "John"}, {"id": 7, "name": "Jane"}], _commit_=False) == 2
+
+        assert [(u.id, u.name) for u in db.get_all("user")] == [(5, "John"), (7, "Jane")]
+
+        try:
+            with db.transaction():
+                db.insert_many("user", [{"id": 8, "name": "Bob"}], _commit_=False)
+                db.insert_many("user", [{"id": 9, "name": None}], _commit_=False)
+
+            raise AssertionError("NULL name should have failed")
+
+        except financial_game.database.sqlite3.IntegrityError as error:
+            assert "NOT NULL" in str(error), error
+
+        assert len(db.get_all("user")) == 2
+        began, inserted = threading.Event(), threading.Event()
+
+        def other_thread():
+            began.wait()
+            db.insert("user", id=20, name="Other")  # commits
+            inserted.set()
+
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+
+        try:
+            with db.transaction():
+                db.insert_many("user", [{"id": 10, "name": "Rolled"}], _commit_=False)
+                began.set()
+                assert not inserted.wait(0.2)  # waits for the transaction
+                raise ValueError("roll back")
+
+        except ValueError:
+            pass
+
+        thread.join()
+        assert [u.id for u in db.get_all("user")] == [5, 7, 20]
+        db.close()
+
+
+def test_indexes():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/test.sqlite3")
+        db.create_tables(statement={"id": "INTEGER PRIMARY KEY", "start": "INTEGER", "end": "INTEGER"},
+                         _if_not_exists_=True)
+        assert db.table_columns("statement") == {"id": "INTEGER", "start": "INTEGER", "end": "INTEGER"}
+        assert db.table_columns("missing") == {}
+        db.create_indexes(statement=[("start",), ("start", "end")], _if_not_exists_=True)
+        db.create_indexes(statement=[("start",)])
+        db.create_index("statement", "end", _name_="by_end")
+        indexes = db.fetch_all("SELECT name FROM sqlite_master WHERE type = 'index' ORDER BY name;")
+        assert [i.name for i in indexes] == ["by_end", "statement_start", "statement_start_end"], indexes
+        plan = db.fetch_all("EXPLAIN QUERY PLAN SELECT * FROM statement WHERE start BETWEEN 1 AND 5;")
+        assert "statement_start" in plan[0].detail, plan
+
+        try:
+            db.create_index("statement", "end", _name_="by_end", _if_not_exists_=False)
+            raise AssertionError("index should already exist")
+
+        except financial_game.database.sqlite3.OperationalError as error:
+            assert "already exists" in str(error), error
+
+        db.close()
+
+
+def test_rebuild_table():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.database.Connection.connect(f"sqlite://{workspace}/test.sqlite3")
+        db.create_table("statement", id="INTEGER PRIMARY KEY", day="VARCHAR(10)", note="VARCHAR(20)", extra="INTEGER")
+        db.insert("statement", day="1970-01-11 00:00:00.000", note="first", extra=1)
+        db.insert("statement", day="2022-06-30 00:00:00.000", note="second", extra=2)
+        db.rebuild_table("statement", {"id": "INTEGER PRIMARY KEY", "day": "INTEGER", "note": "VARCHAR(20)"},
+                         day="CAST(julianday(substr(day, 1, 10)) - 2440587.5 AS INTEGER)")
+        assert db.table_columns("statement") == {"id": "INTEGER", "day": "INTEGER", "note": "VARCHAR(20)"}
+        rows = [(r.id, r.day, r.note) for r in db.get_all("statement")]
+        assert rows == [(1, 10, "first"), (2, 19173, "second")], rows
+
+        try:
+            db.rebuild_table("statement", {"id": "INTEGER PRIMARY KEY", "missing": "INTEGER"})
+            raise AssertionError("missing column should fail")
+
+        except financial_game.database.sqlite3.OperationalError as error:
+            assert "missing" in str(error), error
+
+        assert db.table_columns("statement") == {"id": "INTEGER", "day": "INTEGER", "note": "VARCHAR(20)"}
+        assert db.table_columns("_rebuilt_statement") == {}
+        db.close()
+
+
+def test_get_all_order():
+    with tempfile.TemporaryDirectory() as workspace:
+        for threadsafe in ("true", "false"):
+            db = financial_game.database.Connection.connect(f"sqlite://{workspace}/{threadsafe}.sqlite3?threadsafe={threadsafe}")
+            db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(50)", age="INTEGER")
+            db.insert_many("user", [{"id": i, "name": f"user #{i}", "age": i % 3} for i in range(1, 11)])
+            ids = lambda **options: [u.id for u in db.get_all("user", **options)]
+            assert ids(_order_by_="id") == list(range(1, 11))
+            assert ids(_order_by_="id", _descending_=True) == list(range(10, 0, -1))
+            assert ids(_order_by_=["age", "id"]) == [3, 6, 9, 1, 4, 7, 10, 2, 5, 8]
+            assert ids(_order_by_=["age", "id"], _descending_=True) == [8, 5, 2, 10, 7, 4, 1, 9, 6, 3]
+            assert ids(_order_by_="id", _limit_=3) == [1, 2, 3]
+            assert ids(_order_by_="id", _limit_=3, _offset_=8) == [9, 10]
+            assert ids(_order_by_="id", _offset_=7) == [8, 9, 10]
+            assert ids(_order_by_="id", _limit_=None, _offset_=None) == list(range(1, 11))
+            assert ids(_order_by_="id", _where_="age = :age", _limit_=2, age=1) == [1, 4]
+            assert ids(_order_by_=[], _where_="id = 5") == [5]
+            assert ids(_limit_=0) == []
+            db.close()
+
+
+def test_get_all_after():
+    with tempfile.TemporaryDirectory() as workspace:
+        for threadsafe in ("true", "false"):
+            db = financial_game.database.Connection.connect(f"sqlite://{workspace}/{threadsafe}.sqlite3?threadsafe={threadsafe}")
+            db.create_table("user", id="INTEGER PRIMARY KEY", name="VARCHAR(50)", age="INTEGER")
+            db.insert_many("user", [{"id": i, "name": f"user #{i}", "age": i % 3} for i in range(1, 11)])
+            db.create_index("user", "age", "id")
+
+            for descending in (False, True):
+                expected = [u.id for u in db.get_all("user", _order_by_=["age", "id"], _descending_=descending)]
+                pages, after = [], None
+
+                while True:
+                    page = db.get_all("user", _order_by_=["age", "id"], _descending_=descending, _after_=after, _limit_=3)
+
+                    if not page:
+                        break
+
+                    pages.append([u.id for u in page])
+                    after = (page[-1].age, page[-1].id)
+
+                assert [len(p) for p in pages] == [3, 3, 3, 1], pages
+                assert sum(pages, []) == expected, pages
+
+            page = db.get_all("user", _order_by_="id", _after_=(4,), _where_="age = :age OR age = 2", _limit_=2, age=1)
+            assert [u.id for u in page] == [5, 7], page
+            plan = db.fetch_all("EXPLAIN QUERY PLAN SELECT * FROM user WHERE (age, id) > (1, 4) ORDER BY age, id LIMIT 3;")
+            assert "user_age_id" in plan[0].detail, plan
+
+            try:
+                db.get_all("user", _order_by_=["age", "id"], _after_=(1,))
+                raise AssertionError("_after_ should need a value per _order_by_ column")
+
+            except AssertionError as error:
+                assert "does not match" in str(error), error
+
+            db.close()
+
+
+def test_aggregate():
+    with tempfile.TemporaryDirectory() as workspace:
+        for threadsafe in ("true", "false"):
+            db = financial_game.database.Connection.connect(f"sqlite://{workspace}/{threadsafe}.sqlite3?threadsafe={threadsafe}", False)
+            db.create_table("user", id="INTEGER PRIMARY KEY", team="VARCHAR(10)", age="INTEGER", score="INTEGER")
+            db.create_table("team", id="INTEGER PRIMARY KEY", name="VARCHAR(10)")
+            assert db.aggregate("user") == [{"count": 0}]
+            assert db.aggregate("user", _sums_=["score"], _counts_=None) == [{"sum_score": 0}]
+            db.insert_many("team", [{"id": 1, "name": "red"}, {"id": 2, "name": "blue"}])
+            db.insert_many("user", [{"id": i, "team": "red" if i % 3 else "blue", "age": i % 2 or None, "score": i * 10}
+                                    for i in range(1, 11)])
+            assert db.aggregate("user") == [{"count": 10}]
+            assert db.aggregate("user", _where_="score > :score", score=50) == [{"count": 5}]
+            teams = db.aggregate("user", _group_by_="team", _sums_=["score", "age"], _counts_=["age"])
+            assert teams == [{"team": "blue", "sum_score": 180, "sum_age": 2, "count_age": 2},
+                             {"team": "red", "sum_score": 370, "sum_age": 3, "count_age": 3}], teams
+            teams = db.aggregate("user", _group_by_=["team", "age"], _order_by_="COUNT(*)", _descending_=True)
+            assert teams[0] == {"team": "red", "age": None, "count": 4}, teams
+            assert len(teams) == 4, teams
+            teams = db.aggregate("user", _group_by_="team.name", _sums_=["user.score"],
+                                 _join_=financial_game.database.Join("team", "team.name = user.team"))
+            assert teams == [{"name": "blue", "sum_score": 180, "count": 3},
+                             {"name": "red", "sum_score": 370, "count": 7}], teams
+            assert db.get_all("user", "team", _group_by_="team", _order_by_="team") == [{"team": "blue"}, {"team": "red"}]
+
+            try:
+                db.aggregate("user", _counts_=False)
+                raise AssertionError("should need something to aggregate")
+
+            except AssertionError as error:
+                assert "Nothing" in str(error), error
+
+            db.close()
+
+
 if __name__ == "__main__":
+    test_journal_mode()
+    test_aggregate()
+    test_get_all_after()
+    test_get_all_order()
+    test_indexes()
+    test_rebuild_table()
+    test_insert_many()
+    test_fetch_each()
+    test_slow_query_log()
+    test_slow_query_threshold()
+    test_slow_query_rotation()
     test_join()
     test_Sqlite()
     test_Threadsafe()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+import os
+import queue
+import smtplib
+import sqlite3
+import ssl
+import tempfile
+import time
+import types
+
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+import financial_game.delivery
+import financial_game.model
+import financial_game.settings
+from financial_game.model_outbox import Outbox, OutboxState
+
+
+class Handler:
+    def __init__(self, out_queue):
+        self.__queue = out_queue
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("nobody@"):
+            return '550 No such user'
+
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.__queue.put((envelope.rcpt_tos, envelope.content.decode('utf8', errors='replace')))
+        return '250 Message accepted for delivery'
+
+
+def start_server(email_queue, port):
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain('tests/localhost_cert.pem', 'tests/localhost_key.pem')
+    controller = Controller(Handler(email_queue), "localhost", port, auth_require_tls=False,
+                            authenticator=lambda *a: AuthResult(success=True), tls_context=context)
+    controller.start()
+    return controller
+
+
+def smtp_args(port):
+    return types.SimpleNamespace(
+        email_from="Marc Page <Marc@ResolveToExcel.com>",
+        smtp_server="localhost",
+        smtp_port=port,
+        smtp_user="user",
+        smtp_password="password",
+        smtp_tls=True,
+        delivery_workers=2,
+        delivery_rate=100.0,
+    )
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.time() + timeout
+
+    while not condition():
+        assert time.time() < end, "timed out"
+        time.sleep(0.01)
+
+
+def test_database_errors():
+    email_queue = queue.Queue()
+    smtp_server = start_server(email_queue, 8029)
+    old_claim, old_error_seconds = Outbox.claim, financial_game.delivery.ERROR_SECONDS
+    failures = [2]
+
+    def locked_claim(*arguments, **options):
+        if failures[0] > 0:
+            failures[0] -= 1
+            raise sqlite3.OperationalError("database is locked")
+
+        return old_claim(*arguments, **options)
+
+    try:
+        with tempfile.TemporaryDirectory() as workspace:
+            db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+            delivery = financial_game.delivery.Delivery(smtp_args(smtp_server.port), workers=1, rate=1.0, poll=0.01)
+            start = time.time()
+
+            for _ in range(0, 5):  # nothing claimed does not use up the rate
+                assert not delivery.deliver_one()
+
+            assert time.time() - start < 0.5, time.time() - start
+            financial_game.delivery.ERROR_SECONDS = 0.01
+            Outbox.claim = locked_claim
+            delivery.start()
+            delivery.enqueue("john@apple.com", "Locked", text_body="database is locked")
+            wait_for(lambda: delivery.to_dict()["sent"] == 1)
+            delivery.stop()
+            assert delivery.to_dict()["errors"] == 2, delivery.to_dict()
+            assert email_queue.get(timeout=1.0)[0] == ["john@apple.com"]
+            db.close()
+
+    finally:
+        Outbox.claim = old_claim
+        financial_game.delivery.ERROR_SECONDS = old_error_seconds
+        smtp_server.stop()
+
+
+def test_backoff():
+    assert financial_game.delivery.backoff(1) == financial_game.delivery.RETRY_SECONDS
+    assert financial_game.delivery.backoff(2) == 2 * financial_game.delivery.RETRY_SECONDS
+    assert financial_game.delivery.backoff(3) == 4 * financial_game.delivery.RETRY_SECONDS
+    assert financial_game.delivery.backoff(100) == financial_game.delivery.RETRY_MAX_SECONDS
+    assert financial_game.delivery.permanent(smtplib.SMTPRecipientsRefused({}))
+    assert financial_game.delivery.permanent(smtplib.SMTPDataError(554, "rejected"))
+    assert not financial_game.delivery.permanent(smtplib.SMTPDataError(421, "busy"))
+    assert not financial_game.delivery.permanent(smtplib.SMTPServerDisconnected("gone"))
+    assert not financial_game.delivery.permanent(ConnectionRefusedError())
+
+
+def test_rate_limiter():
+    delay = financial_game.delivery.rate_limiter(10.0)
+    delays = [delay() for _ in range(0, 4)]
+    assert delays[0] < 0.01, delays
+    assert all(abs(d - 0.1 * i) < 0.01 for i, d in enumerate(delays)), delays
+
+
+def test_claim():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        first = Outbox.enqueue("john@apple.com", "first", now=100.0)
+        second = Outbox.enqueue("jane@apple.com", "second", now=50.0)
+        Outbox.enqueue("later@apple.com", "later", now=500.0)
+        assert first.state == OutboxState.PENDING and first.attempts == 0
+        assert Outbox.depth() == {OutboxState.PENDING: 3, OutboxState.SENDING: 0, OutboxState.SENT: 0, OutboxState.DEAD: 0}
+        claimed = Outbox.claim(1, now=200.0)
+        assert [m.id for m in claimed] == [second.id], claimed  # oldest due first
+        assert claimed[0].state == OutboxState.SENDING and claimed[0].attempts == 1
+        assert claimed[0].next_attempt == 200.0 + financial_game.model_outbox.CLAIM_SECONDS
+        assert [m.id for m in Outbox.claim(10, now=200.0)] == [first.id]  # later is not due
+        assert Outbox.claim(10, now=200.0) == []
+        expired = Outbox.claim(10, now=200.0 + financial_game.model_outbox.CLAIM_SECONDS)
+        assert [m.id for m in expired] == [first.id, second.id, 3], expired  # worker died
+        assert [m.attempts for m in expired] == [2, 2, 1]
+        expired[0].delivered(now=1000.0)
+        expired[1].failed("too busy", retry_at=2000.0)
+        expired[2].failed(RuntimeError("x" * 2000))
+        assert Outbox.fetch(first.id).sent == 1000.0
+        assert Outbox.fetch(first.id).state == OutboxState.SENT
+        assert Outbox.fetch(second.id).error == "too busy"
+        assert Outbox.fetch(second.id).next_attempt == 2000.0
+        assert len(Outbox.fetch(3).error) == financial_game.model_outbox.ERROR_LENGTH
+        assert [m.id for m in Outbox.dead()] == [3]
+        assert Outbox.fetch(12345) is None
+        assert Outbox.depth() == {OutboxState.PENDING: 1, OutboxState.SENDING: 0, OutboxState.SENT: 1, OutboxState.DEAD: 1}
+        db.close()
+
+
+def test_delivery():
+    email_queue = queue.Queue()
+    smtp_server = start_server(email_queue, 8027)
+
+    try:
+        with tempfile.TemporaryDirectory() as workspace:
+            db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+            delivery = financial_game.delivery.Delivery(smtp_args(smtp_server.port), poll=0.05).start()
+            assert delivery.to_dict()["workers"] == 2
+
+            for i in range(0, 3):
+                queued = delivery.enqueue(f"user{i}@apple.com", f"Message #{i}", text_body="queued", encoding="us-ascii")
+                assert queued.state == OutboxState.PENDING
+
+            delivery.enqueue("nobody@apple.com", "Refused", text_body="dead letter")
+            wait_for(lambda: delivery.to_dict()["sent"] == 3 and delivery.to_dict()["dead"] == 1)
+            delivery.stop()
+            report = delivery.to_dict()
+            assert report["queue"] == {"PENDING": 0, "SENDING": 0, "SENT": 3, "DEAD": 1}, report
+            assert report["latency"]["count"] == 3, report
+            assert report["retried"] == 0 and report["workers"] == 0, report
+            assert sorted(email_queue.get(timeout=1.0)[0][0] for _ in range(0, 3)) == [f"user{i}@apple.com" for i in range(0, 3)]
+            assert "nobody@" in Outbox.dead()[0].error, Outbox.dead()
+            assert not delivery.deliver_one()  # stopping
+            db.close()
+
+    finally:
+        smtp_server.stop()
+
+
+def test_retry():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        args = smtp_args(8028)  # nothing listening
+        delivery = financial_game.delivery.Delivery(args, workers=1, rate=1000.0, max_attempts=2)
+        assert not delivery.deliver_one()  # nothing queued
+        queued = delivery.enqueue("john@apple.com", "Retry", text_body="retry")
+        before = time.time()
+        assert delivery.deliver_one()
+        retried = Outbox.fetch(queued.id)
+        assert retried.state == OutboxState.PENDING and retried.attempts == 1, retried
+        assert retried.next_attempt >= before + financial_game.delivery.RETRY_SECONDS, retried
+        assert not delivery.deliver_one()  # not due yet
+        Outbox._db.execute("UPDATE Outbox SET next_attempt = 0;", {}, commit=True)
+        assert delivery.deliver_one()
+        assert Outbox.fetch(queued.id).state == OutboxState.DEAD
+        report = delivery.to_dict()
+        assert (report["sent"], report["retried"], report["dead"]) == (0, 1, 1), report
+        db.close()
+
+
+def test_reconfigure():
+    email_queue = queue.Queue()
+    first_server = start_server(email_queue, 8031)
+    second_server = start_server(email_queue, 8032)
+
+    try:
+        with tempfile.TemporaryDirectory() as workspace:
+            db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+            settings_path = os.path.join(workspace, "settings.yaml")
+            settings = {"smtp-server": "localhost", "smtp-port": first_server.port, "smtp-tls": True, "smtp-user": "user",
+                        "smtp-password": "password", "email-from": "Marc Page <Marc@ResolveToExcel.com>"}
+            financial_game.settings.write(settings_path, settings)
+            args = financial_game.settings.load(types.SimpleNamespace(
+                port=None, database=None, secret="secret", debug=False, settings=settings_path, reset=None,
+                smtp_port=None, smtp_server=None, smtp_tls=None, smtp_user=None, smtp_password=None, email_from=None))
+            watcher = financial_game.settings.Watcher(args)
+            delivery = financial_game.delivery.Delivery(watcher.current, workers=1, rate=1000.0)
+            delivery.watch(watcher)
+            delivery.enqueue("john@apple.com", "First", text_body="first")
+            assert delivery.deliver_one()
+            assert email_queue.get(timeout=1.0)[0] == ["john@apple.com"]
+            first_server.stop()
+            financial_game.settings.write(settings_path, {**settings, "smtp-port": second_server.port})
+            os.utime(settings_path, ns=(0, 1))
+            assert watcher.check()
+            delivery.enqueue("jane@apple.com", "Second", text_body="second")
+            assert delivery.deliver_one()
+            assert email_queue.get(timeout=1.0)[0] == ["jane@apple.com"]
+            assert delivery.to_dict()["sent"] == 2
+            db.close()
+
+    finally:
+        second_server.stop()
+        financial_game.email.close_pools()
+
+
+if __name__ == "__main__":
+    test_database_errors()
+    test_reconfigure()
+    test_backoff()
+    test_rate_limiter()
+    test_claim()
+    test_delivery()
+    test_retry()
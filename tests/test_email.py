@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
 
 import asyncio
+import base64
+import contextlib
+import email
+import email.mime.text
+import os
+import tempfile
+import io
+import smtplib
+import tracemalloc
 import types
 import queue
 import threading
@@ -16,12 +25,26 @@ class EchoHandler:
     def __init__(self, out_queue):
         self.__queue= out_queue
 
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        if address.startswith("nobody@"):
+            return '553 Not allowed'
+
+        envelope.mail_from = address
+        envelope.mail_options.extend(mail_options)
+        return '250 OK'
+
     async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("nobody@"):
+            return '550 No such user'
+
         envelope.rcpt_tos.append(address)
         return '250 OK'
 
     async def handle_DATA(self, server, session, envelope):
-        self.__queue.put((envelope.mail_from, envelope.rcpt_tos, envelope.content.decode('utf8', errors='replace')))
+        if b"reject this message" in envelope.content:
+            return '554 Rejected'
+
+        self.__queue.put((envelope.mail_from, envelope.rcpt_tos, envelope.content.decode('utf8', errors='replace'), session.peer))
         return '250 Message accepted for delivery'
 
 
@@ -65,7 +88,10 @@ def test_send_email():
         smtp_tls=True,
     )
     recipient = "Marc Page <MarcAllenPage@gmail.com>"
-    financial_game.email.send(
+    output = io.StringIO()
+
+    with contextlib.redirect_stdout(output):
+        financial_game.email.send(
             args,
             recipient,
             "Testing sending emails",
@@ -73,7 +99,10 @@ def test_send_email():
             text_body="Here it is\ntext body",
             attachments={'requirements.txt':{'mime': 'text/plain'}},
             inlined={'image1': 'tests/sign-check-icon.png'},
-            encoding="us-ascii")
+            encoding="us-ascii",
+            quiet=False)
+
+    assert output.getvalue().endswith("mail sent\n"), output.getvalue()
 
     try:
         message = email_queue.get(timeout=0.100)
@@ -87,7 +116,286 @@ def test_send_email():
     assert message is not None
 
 
+def pool_args(port, **extra):
+    return types.SimpleNamespace(
+        email_from="Marc Page <Marc@ResolveToExcel.com>",
+        smtp_server="localhost",
+        smtp_port=port,
+        smtp_user="user",
+        smtp_password="password",
+        smtp_tls=True,
+        **extra,
+    )
+
+
+class Disconnected:
+    def noop(self):
+        return (250, b"OK")
+
+    def ehlo_or_helo_if_needed(self):
+        raise smtplib.SMTPServerDisconnected("gone")
+
+    def sendmail(self, sender, recipient, body):
+        raise smtplib.SMTPServerDisconnected("gone")
+
+    def close(self):
+        pass
+
+
+def test_session_pool():
+    email_queue = queue.Queue()
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain('tests/localhost_cert.pem', 'tests/localhost_key.pem')
+    smtp_server = start_server(email_queue, context, port=8026)
+    args = pool_args(smtp_server.port, smtp_pool_size=1)
+    recipient = "Marc Page <MarcAllenPage@gmail.com>"
+
+    try:
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            for i in range(0, 3):
+                financial_game.email.send(args, recipient, f"Message #{i}", text_body="pooled", quiet=True)
+
+        assert output.getvalue() == "", output.getvalue()
+        messages = [email_queue.get(timeout=1.0) for _ in range(0, 3)]
+        assert len({m[3] for m in messages}) == 1, messages  # one connection
+        smtp_pool = financial_game.email.pool(pool_args(smtp_server.port))
+        assert smtp_pool is financial_game.email.pool(args)
+        assert smtp_pool.connects == 1, smtp_pool.connects
+
+        first, second = smtp_pool.acquire(), smtp_pool.acquire()  # size 1, second is closed on release
+        smtp_pool.release(first)
+        smtp_pool.release(second)
+        assert smtp_pool.connects == 2, smtp_pool.connects
+
+        smtp_pool.acquire().quit()  # take the idle session out of the pool
+        smtp_pool.release(Disconnected())  # passes NOOP, then server hangs up
+        financial_game.email.send(args, recipient, "Reconnect", text_body="after hang up", encoding="us-ascii", quiet=True)
+        assert "after hang up" in email_queue.get(timeout=1.0)[2]
+        assert smtp_pool.connects == 3, smtp_pool.connects
+
+        try:
+            financial_game.email.send(args, "nobody@ResolveToExcel.com", "Refused", text_body="nobody", quiet=True)
+            raise AssertionError("recipient should have been refused")
+
+        except smtplib.SMTPRecipientsRefused as error:
+            assert "nobody@" in str(error), error
+
+        financial_game.email.send(args, recipient, "After refused", text_body="still works", quiet=True)
+        assert email_queue.get(timeout=1.0) is not None
+        smtp_server.stop()
+        smtp_server = start_server(email_queue, context, port=8026)
+        connects = smtp_pool.connects
+        financial_game.email.send(args, recipient, "Restarted", text_body="new server", encoding="us-ascii", quiet=True)
+        assert "new server" in email_queue.get(timeout=1.0)[2]
+        assert smtp_pool.connects == connects + 1, smtp_pool.connects  # NOOP failed, reconnected
+        smtp_pool.acquire().quit()
+        broken = Broken()
+        smtp_pool.release(broken)
+
+        try:
+            smtp_pool.sendmail(args.email_from, recipient, "body")
+            raise AssertionError("ValueError should have been raised")
+
+        except ValueError:
+            pass
+
+        assert broken.closed  # discarded, not returned to the pool
+
+        with contextlib.redirect_stdout(output):
+            financial_game.email.send(args, recipient, "After broken", text_body="new session", encoding="us-ascii")
+
+        assert output.getvalue() == "", output.getvalue()  # quiet by default
+        assert "new session" in email_queue.get(timeout=1.0)[2]
+        assert smtp_pool.connects == connects + 2, smtp_pool.connects
+
+    finally:
+        smtp_server.stop()
+
+    financial_game.email.close_pools()  # server gone, quit fails, session is closed
+    financial_game.email.close_pools()
+
+
+class Broken(Disconnected):
+    def __init__(self):
+        self.closed = False
+
+    def sendmail(self, sender, recipient, body):
+        raise ValueError("not an smtp error")
+
+    def close(self):
+        self.closed = True
+
+
+class Busy(Disconnected):
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, sender):
+        return (250, b"OK")
+
+    def rcpt(self, recipient):
+        return (250, b"OK")
+
+    def docmd(self, command):
+        return (451, b"Busy")
+
+
+def test_streamed():
+    args = types.SimpleNamespace(email_from="Marc Page <Marc@ResolveToExcel.com>")
+    recipient = "Marc Page <MarcAllenPage@gmail.com>"
+    assert b"".join(financial_game.email.encoded_file("tests/sign-check-icon.png", 57 * 2)) == base64.encodebytes(financial_game.email.read_file("tests/sign-check-icon.png")).replace(b"\n", b"\r\n")[:-2]
+
+    with tempfile.TemporaryDirectory() as workspace:
+        large_path = os.path.join(workspace, "large.bin")
+        empty_path = os.path.join(workspace, "empty.txt")
+        spool_path = os.path.join(workspace, "message.eml")
+        large = bytes(range(0, 256)) * (32 * 1024)  # 8 MiB
+
+        with open(large_path, "wb") as large_file:
+            large_file.write(large)
+
+        with open(empty_path, "wb"):
+            pass
+
+        parts = {"html_body": "<b>html</b>", "text_body": "text\n.leading dot",
+                 "attachments": {"large.bin": {"path": large_path}, "empty.txt": {"path": empty_path, "mime": "text/plain"},
+                                 "inline.bin": {"contents": b"raw bytes"}},
+                 "inlined": {"image1": "tests/sign-check-icon.png"}, "encoding": "us-ascii"}
+        financial_game.email.spool(spool_path, args, recipient, "Warm up", **parts)  # caches the image and inline.bin
+        tracemalloc.start()
+        written = financial_game.email.spool(spool_path, args, recipient, "Streamed", **parts)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert written == os.path.getsize(spool_path)
+        assert written > len(large) * 4 // 3, written
+        assert peak < len(large) // 4, peak  # never the whole attachment or message
+
+        with open(spool_path, "rb") as spool_file:
+            streamed = email.message_from_binary_file(spool_file)
+
+        formed = email.message_from_string(financial_game.email.form(args, recipient, "Streamed", **parts))
+        streamed_parts = [(p.get_content_type(), p.get_param("filename", header="Content-Decomposition"), p.get_payload(decode=True)) for p in streamed.walk() if not p.is_multipart()]
+        formed_parts = [(p.get_content_type(), p.get_param("filename", header="Content-Decomposition"), p.get_payload(decode=True)) for p in formed.walk() if not p.is_multipart()]
+        assert streamed_parts == formed_parts
+        assert ("application/octet-stream", "large.bin", large) in streamed_parts
+        assert ("text/plain", "empty.txt", b"") in streamed_parts
+        assert streamed["Subject"] == formed["Subject"], streamed["Subject"]
+        assert b"\r\n.." not in b"".join(financial_game.email.message_chunks(args, recipient, "Spooled", **parts))
+        assert b"\r\n..leading" in b"".join(financial_game.email.message_chunks(args, recipient, "SMTP", smtp=True, **parts))
+
+        email_queue = queue.Queue()
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain('tests/localhost_cert.pem', 'tests/localhost_key.pem')
+        smtp_server = start_server(email_queue, context, port=8029)
+        smtp_args = pool_args(smtp_server.port, smtp_pool_size=1)
+
+        try:
+            financial_game.email.send_streamed(smtp_args, recipient, "Streamed", **parts)
+            received = email.message_from_string(email_queue.get(timeout=5.0)[2])
+            received_parts = [(p.get_content_type(), p.get_param("filename", header="Content-Decomposition"), p.get_payload(decode=True)) for p in received.walk() if not p.is_multipart()]
+            assert received_parts[1:] == formed_parts[1:]
+            assert received_parts[0][2] == b"text\r\n.leading dot", received_parts[0]  # un-stuffed by the server
+            financial_game.email.send_streamed(smtp_args, recipient, "Ends with a newline", text_body="line\n", encoding="us-ascii")
+            assert "line" in email_queue.get(timeout=1.0)[2]
+            smtp_pool = financial_game.email.pool(smtp_args)
+            smtp_pool.acquire().quit()  # take the idle session out of the pool
+            smtp_pool.release(Disconnected())
+            connects = smtp_pool.connects
+            financial_game.email.send_streamed(smtp_args, recipient, "Reconnect", text_body="after hang up", encoding="us-ascii")
+            assert "after hang up" in email_queue.get(timeout=1.0)[2]
+            assert smtp_pool.connects == connects + 1, smtp_pool.connects
+
+            nobody_args = pool_args(smtp_server.port, smtp_pool_size=1)
+            nobody_args.email_from = "nobody@ResolveToExcel.com"
+
+            for send_args, to, body, error_type in [
+                    (nobody_args, recipient, "refused sender", smtplib.SMTPSenderRefused),
+                    (smtp_args, "nobody@ResolveToExcel.com", "refused recipient", smtplib.SMTPRecipientsRefused),
+                    (smtp_args, recipient, "reject this message", smtplib.SMTPDataError)]:
+                try:
+                    financial_game.email.send_streamed(send_args, to, "Refused", text_body=body, encoding="us-ascii")
+                    raise AssertionError(f"{body} should have failed")
+
+                except error_type:
+                    pass
+
+            smtp_pool.acquire().quit()
+            smtp_pool.release(Busy())
+
+            try:
+                financial_game.email.send_streamed(smtp_args, recipient, "Busy", text_body="busy")
+                raise AssertionError("DATA should have failed")
+
+            except smtplib.SMTPDataError as error:
+                assert error.smtp_code == 451, error
+
+        finally:
+            smtp_server.stop()
+
+    financial_game.email.close_pools()
+
+
+def test_part_cache():
+    args = types.SimpleNamespace(email_from="Marc Page <Marc@ResolveToExcel.com>")
+    financial_game.email.PARTS.clear()
+    hits, misses = financial_game.email.PARTS.hits, financial_game.email.PARTS.misses
+
+    with tempfile.TemporaryDirectory() as workspace:
+        attachment_path = os.path.join(workspace, "report.txt")
+
+        with open(attachment_path, "w", encoding="utf-8") as attachment_file:
+            attachment_file.write("first version")
+
+        def message():
+            return financial_game.email.form(
+                args, "Marc Page <MarcAllenPage@gmail.com>", "Cached", html_body="<b>html</b>", text_body="text",
+                attachments={"report.txt": {"path": attachment_path, "mime": "text/plain"},
+                             "inline.bin": {"contents": b"raw bytes"}},
+                inlined={"image1": "tests/sign-check-icon.png"})
+
+        first = message()
+        assert financial_game.email.PARTS.misses - misses == 3
+        second = message()
+        assert financial_game.email.PARTS.hits - hits == 3
+        assert financial_game.email.PARTS.misses - misses == 3
+        assert first.count(base64.b64encode(b"first version").decode("ascii")) == 1, first
+        assert second.count(base64.b64encode(b"first version").decode("ascii")) == 1, second
+        assert second.count("Content-ID: image1") == 1, second
+        assert second.count('filename="report.txt"') == 1, second
+        assert second.count(base64.b64encode(b"raw bytes").decode("ascii")) == 1, second
+
+        with open(attachment_path, "w", encoding="utf-8") as attachment_file:
+            attachment_file.write("second version")
+
+        os.utime(attachment_path, ns=(0, 1))
+        third = message()
+        assert financial_game.email.PARTS.misses - misses == 4
+        assert third.count(base64.b64encode(b"second version").decode("ascii")) == 1, third
+
+    cache = financial_game.email.PartCache(max_bytes=30)
+    make = lambda size: lambda: email.mime.text.MIMEText("x" * size)
+    assert cache.part(("a",), make(10)).get_payload() == "x" * 10
+    cache.part(("b",), make(10)).add_header("Content-ID", "changed")
+    assert cache.part(("b",), make(10))["Content-ID"] is None  # copies, not the cached part
+    cache.part(("a",), make(10))  # a is now the most recently used
+    cache.part(("c",), make(15))  # evicts b
+    assert cache.bytes == 25, cache.bytes
+    cache.part(("d",), make(100))  # too big to keep
+    assert cache.bytes == 25, cache.bytes
+    misses = cache.misses
+    cache.part(("a",), make(10))
+    cache.part(("c",), make(15))
+    assert cache.misses == misses
+    cache.part(("b",), make(10))
+    assert cache.misses == misses + 1
+
+
 if __name__ == "__main__":
+    test_streamed()
+    test_part_cache()
+    test_session_pool()
     test_form_email_text_simple()
     test_form_email_html_simple()
     test_send_email()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+
+import time
+
+import financial_game.metrics
+
+
+def test_histogram():
+    histogram = financial_game.metrics.Histogram((1, 10, 100))
+    histogram.add(0.5)
+    histogram.add(1)
+    histogram.add(5)
+    histogram.add(1000)
+    described = histogram.to_dict()
+    assert described["count"] == 4, described
+    assert described["maximum"] == 1000, described
+    assert abs(described["total"] - 1006.5) < 0.001, described
+    assert described["buckets"] == {"<=1": 2, "<=10": 1, "<=100": 0, ">100": 1}, described
+    assert financial_game.metrics.Histogram((1,)).to_dict()["average"] == 0.0
+
+
+def test_measure():
+    financial_game.metrics.end()
+
+    with financial_game.metrics.measure("db"):
+        pass  # not timing a request, so nothing is recorded
+
+    timings = financial_game.metrics.begin()
+
+    for _ in range(0, 3):
+        with financial_game.metrics.measure("db"):
+            time.sleep(0.001)
+
+    @financial_game.metrics.timed("render")
+    def render(value):
+        return value * 2
+
+    assert render(21) == 42
+    assert financial_game.metrics.end() is timings
+    assert timings.calls == {"db": 3, "render": 1}, timings.calls
+    assert timings.durations["db"] >= 0.003, timings.durations
+    header = timings.server_timing()
+    assert 'db;dur=' in header, header
+    assert 'desc="3 calls"' in header, header
+    assert 'render;dur=' in header, header
+    assert 'total;dur=' in header, header
+    assert financial_game.metrics.end().calls == {}
+
+
+def test_metrics():
+    metrics = financial_game.metrics.Metrics()
+    timings = financial_game.metrics.Timings()
+
+    for _ in range(0, 12):
+        timings.add("db", 0.002)
+
+    metrics.record("GET /", timings, ["db", "render"])
+    metrics.record("GET /", financial_game.metrics.Timings(), ["db", "render"])
+    described = metrics.to_dict()
+    assert list(described) == ["GET /"], described
+    route = described["GET /"]
+    assert route["total"]["count"] == 2, route
+    assert route["db calls"]["maximum"] == 12, route
+    assert route["db calls"]["buckets"]["<=20"] == 1, route
+    assert route["db calls"]["buckets"]["<=0"] == 1, route
+    assert route["render calls"]["count"] == 2, route
+    assert route["render"]["total"] == 0.0, route
+
+
+if __name__ == "__main__":
+    test_histogram()
+    test_measure()
+    test_metrics()
@@ -2,13 +2,24 @@
 
 import tempfile
 import os
+import hashlib
+import io
+import json
+import threading
+import time
 from datetime import date
 
+import yaml
+
 import financial_game.model
+import financial_game.model_user
 from financial_game.model_user import User, Account, Statement, AccountPurpose
 from financial_game.model_bank import Bank, TypeOfBank, AccountType, TypeOfAccount
 from financial_game.table import Table
 import financial_game.database
+import financial_game.metrics
+import financial_game.money
+import financial_game.table
 
 
 TEST_YAML_PATH = os.path.join(os.path.split(__file__)[0], "model.yaml")
@@ -199,6 +210,246 @@ def test_serialize():
         assert chase_cc.bank_id == chase.id
 
 
+def test_export():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3", TEST_YAML_PATH)
+        john = User.lookup("john.appleseed@apple.com")
+        checking = Account.create(john, AccountType.fetch(1), "budget", "usual", AccountPurpose.BUDG)
+        Account.create(john, AccountType.fetch(3), "unused")
+        Statement.create(account=checking, start_date=date(2022, 6, 1), end_date=date(2022, 6, 30), start_value=3.14, end_value=13.37, deposits=12.95, withdrawals=2.72, fees=0.00, interest=0.00, rate=0.50)
+        Statement.create(account=checking, start_date=date(2022, 5, 1), end_date=date(2022, 5, 31), start_value=0.00, end_value=3.14, deposits=12.95, withdrawals=9.20, fees=0.81, interest=0.20, rate=0.50)
+        expected = db.serialize()
+        progress = []
+
+        exported = io.StringIO()
+        db.export(exported, progress=lambda *p: progress.append(p))
+        assert yaml.safe_load(exported.getvalue()) == expected, exported.getvalue()
+        assert progress == [("users", 1), ("users", 2), ("banks", 1), ("banks", 2)], progress
+
+        exported = io.StringIO()
+        db.export(exported, fmt="json")
+        as_json = financial_game.model.with_integer_ids(json.loads(exported.getvalue()))
+        assert as_json == expected, exported.getvalue()
+        assert list(as_json["users"]) == list(expected["users"]), list(expected["users"])
+        assert list(as_json["banks"]) == list(expected["banks"]), list(expected["banks"])
+
+        def write_during_export(section, count):
+            if (section, count) == ("users", 1):  # the export's read transaction is open
+                User.create("late.comer@apple.com", "hash", "Late", pw_hashed=True)
+
+        during = io.StringIO()
+        old_batch = financial_game.model.EXPORT_BATCH
+        financial_game.model.EXPORT_BATCH = 1
+        db.export(during, progress=write_during_export)
+        financial_game.model.EXPORT_BATCH = old_batch
+        assert yaml.safe_load(during.getvalue()) == expected, during.getvalue()
+        assert User.lookup("late.comer@apple.com") is not None
+        db.close()
+        db = financial_game.model.Database("sqlite:///" + workspace + "test2.sqlite3", json.loads(exported.getvalue()))
+        assert db.serialize() == expected
+        db.close()
+
+        db = financial_game.model.Database("sqlite:///" + workspace + "test3.sqlite3")
+        exported = io.StringIO()
+        db.export(exported)
+        assert yaml.safe_load(exported.getvalue()) == {"users": {}, "banks": {}}, exported.getvalue()
+        exported = io.StringIO()
+        db.export(exported, fmt="json")
+        assert json.loads(exported.getvalue()) == {"users": {}, "banks": {}}, exported.getvalue()
+        db.close()
+
+
+def test_snapshot():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3", TEST_YAML_PATH)
+        john = User.lookup("john.appleseed@apple.com")
+        checking = Account.create(john, AccountType.fetch(1), "budget", "usual", AccountPurpose.BUDG)
+        Statement.create(account=checking, start_date=date(2022, 6, 1), end_date=date(2022, 6, 30), start_value=3.14, end_value=13.37, deposits=12.95, withdrawals=2.72, fees=0.00, interest=0.00, rate=0.50)
+        expected = db.serialize()
+        snapshot_path = os.path.join(workspace, "export.fgsnap")
+        progress = []
+
+        with open(snapshot_path, "wb") as snapshot_file:
+            db.export(snapshot_file, fmt="snapshot", progress=lambda *p: progress.append(p))
+
+        db.close()
+        assert progress == [("users", 1), ("users", 2), ("banks", 1), ("banks", 2)], progress
+        assert financial_game.model.load(snapshot_path) == expected
+        db = financial_game.model.Database("sqlite:///" + workspace + "test2.sqlite3", snapshot_path)
+        assert db.serialize() == expected
+        db.close()
+
+        yaml_path = os.path.join(workspace, "export.yaml")
+        round_trip_path = os.path.join(workspace, "round_trip.fgsnap")
+        financial_game.model.convert(snapshot_path, yaml_path)
+        assert financial_game.model.load(yaml_path) == expected
+        financial_game.model.convert(yaml_path, round_trip_path)
+        assert financial_game.model.load(round_trip_path) == expected
+
+
+def test_migrate_dates():
+    with tempfile.TemporaryDirectory() as workspace:
+        db_path = os.path.join(workspace, "test.sqlite3")
+        old = financial_game.database.Connection.connect(f"sqlite://{db_path}")
+        description = Table.database_description(Statement)["Statement"]
+        description.update(start_date="VARCHAR(10) NOT NULL", end_date="VARCHAR(10) NOT NULL")
+        old.create_table("Statement", **description, _if_not_exists_=True)
+        old.execute('ALTER TABLE Statement ADD COLUMN "_if_not_exists_" True;', None)
+        old.insert("Statement", account_id=1, start_date="2022-05-15 00:00:00.000", end_date="2022-06-14 00:00:00.000",
+                   start_value=311, end_value=1336, withdrawals=271, deposits=1297, interest=2, fees=3, rate=432,
+                   mileage=None)
+        old.close()
+
+        financial_game.model.Database(f"sqlite:///{db_path}", prepare=False).close()
+        connection = financial_game.database.Connection.connect(f"sqlite://{db_path}")
+        assert connection.table_columns("Statement")["start_date"].startswith("VARCHAR")
+        assert connection.table_columns("User") == {}
+        connection.close()
+
+        connections = [financial_game.database.Connection.connect(f"sqlite://{db_path}") for _ in range(0, 4)]
+        migrations = [threading.Thread(target=financial_game.model.migrate, args=(c,)) for c in connections]
+
+        for migration in migrations:
+            migration.start()
+
+        for migration in migrations:
+            migration.join()
+
+        start = time.time()
+
+        with connections[1].transaction(immediate=True):  # another process is writing
+            financial_game.model.migrate(connections[0])  # already migrated, no lock needed
+
+        assert time.time() - start < 1.0, time.time() - start
+        raw = connections[0].get_one_or_none("Statement", "start_date", "end_date", _where_="id = 1")
+        assert (raw.start_date, raw.end_date) == (19127, 19157), raw
+
+        for connection in connections:
+            connection.close()
+
+        db = financial_game.model.Database(f"sqlite:///{db_path}")
+        statement = Statement.fetch(1)
+        assert statement.start_date == date(2022, 5, 15), statement
+        assert statement.end_date == date(2022, 6, 14), statement
+        assert statement.end_value == 13.36
+        connection = financial_game.database.Connection.connect(f"sqlite://{db_path}")
+        assert connection.table_columns("Statement")["start_date"] == "INTEGER"
+        assert "_if_not_exists_" not in connection.table_columns("Statement")
+        assert "_if_not_exists_" not in connection.table_columns("User")
+        raw = connection.get_one_or_none("Statement", "start_date", "end_date", _where_="id = 1")
+        assert (raw.start_date, raw.end_date) == (19127, 19157), raw
+        indexes = connection.fetch_all("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'Statement';")
+        assert {"Statement_start_date", "Statement_end_date"} <= {i.name for i in indexes}, indexes
+        connection.close()
+        db.close()
+
+
+def test_bulk_load():
+    statement = {"start_date": "2022-06-01", "end_date": "2022-06-30", "start_value": 3.14, "end_value": 13.37,
+                 "deposits": 12.95, "withdrawals": 2.72, "fees": 0.0, "interest": 0.0, "rate": 0.5, "mileage": None}
+    serialized = {
+        "users": {
+            20: {"name": "Jane", "email": "jane@apple.com", "password": "secret", "sponsor_id": 10,
+                 "accounts": {7: {"label": "budget", "purpose": "BUDG", "account_type": 30,
+                                  "statements": {9: statement, 4: dict(statement, start_date="2022-05-01")}}}},
+            10: {"name": "John", "email": "john@apple.com", "password_hash": User.hash_password("hashed"),
+                 "accounts": {3: {"label": "savings", "purpose": None, "account_type": 30}}},
+        },
+        "banks": {15: {"name": "Bank", "type": "BANK", "account_types": {30: {"name": "Checking", "type": "CHCK"}}}},
+    }
+
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3", serialized)
+        john = User.fetch(1)
+        jane = User.fetch(2)
+        assert john.email == "john@apple.com" and john.password_matches("hashed")
+        assert jane.sponsor_id == john.id and jane.password_matches("secret")
+        assert [a.label for a in john.accounts()] == ["savings"]
+        budget = jane.accounts()[0]
+        assert budget.account_type().bank().name == "Bank"
+        assert [s.start_date for s in budget.statements()] == [date(2022, 5, 1), date(2022, 6, 1)]
+        db.close()
+
+    unbalanced = dict(statement, end_value=13.38)
+    drift = dict(statement, start_value=0.1, deposits=0.2, withdrawals=0.0, end_value=0.3)
+    serialized["users"][20]["accounts"][7]["statements"] = {1: drift}
+
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3", serialized)
+        statement_values = Statement.fetch(1)
+        assert statement_values.end_value == statement_values.start_value + statement_values.deposits
+        assert financial_game.model.serialized_statement(statement_values)["end_value"] == 0.3
+        db.close()
+
+    missing = dict(statement, start_date=None)
+
+    for broken, message in ((unbalanced, "difference"), (missing, "['start_date'] missing")):
+        serialized["users"][20]["accounts"][7]["statements"] = {1: broken}
+
+        with tempfile.TemporaryDirectory() as workspace:
+            db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+
+            try:
+                db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3", serialized)
+                raise AssertionError("should not have loaded")
+
+            except AssertionError as error:
+                assert message in str(error), error
+
+            assert User.total() == 0
+            assert Bank.total() == 0
+            db.close()
+
+
+def test_fetch_graph():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        john = User.create("john.appleseed@apple.com", "Setec astronomy", "John", None)
+        jane = User.create("Jane.Doe@apple.com", "too many secrets", "Jane", john.id)
+        lonely = User.create("lonely@apple.com", "nobody", "Lonely", None)
+        boa = Bank.create("Bank of America", "https://www.bankofamerica.com/")
+        boa_cc = AccountType.create(boa.id, "Customized Cash Rewards", TypeOfAccount.CRED)
+        boa_check = AccountType.create(boa.id, "Advantage Banking", TypeOfAccount.CHCK)
+        john_cc = Account.create(john, boa_cc, "daily", "password")
+        john_checking = Account.create(john, boa_check, "budget", "usual", AccountPurpose.BUDG)
+        Account.create(jane, boa_check, "budget", "refresh")
+
+        for month in (3, 1, 10, 2, 9, 4, 8, 5, 7, 6):  # not in date order
+            Statement.create(john_checking, date(2022, month, 1), date(2022, month, 28), 1.00, 1.00, 0.00, 0.00, 0.00, 0.00, 0.50)
+
+        old_batch = financial_game.table.PRELOAD_BATCH
+        financial_game.table.PRELOAD_BATCH = 1
+        financial_game.metrics.begin()
+        graph = User.fetch_graph(john.id, include=["accounts.statements", "accounts.account_type.bank", "sponsored"])
+        queries = financial_game.metrics.end().calls["db"]
+        assert queries == 1 + 1 + 2 + 2 + 1 + 1, queries  # a batch per account for statements, types
+        financial_game.table.PRELOAD_BATCH = old_batch
+
+        financial_game.metrics.begin()
+        accounts = graph.accounts()
+        assert len(accounts) == 2, accounts
+        checking = [a for a in accounts if a.id == john_checking.id][0]
+        assert len(checking.statements()) == 10
+        assert checking.statements()[0].account_id == checking.id
+        assert checking.account_type().name == "Advantage Banking"
+        assert checking.account_type().bank().name == "Bank of America"
+        cc = [a for a in accounts if a.id == john_cc.id][0]
+        assert cc.statements() == []
+        assert cc.account_type().bank() is checking.account_type().bank()
+        assert [u.id for u in graph.sponsored()] == [jane.id]
+        assert "db" not in financial_game.metrics.end().calls
+
+        graph.accounts().clear()  # callers get their own list
+        assert len(graph.accounts()) == 2
+        queried = Account.fetch(checking.id).statements()  # not preloaded, so queried
+        assert [s.id for s in checking.statements()] == [s.id for s in queried]
+        assert [s.start_date.month for s in queried] == list(range(1, 11)), queried
+        assert User.fetch_graph(lonely.id, include=["accounts.statements"]).accounts() == []
+        assert User.fetch_graph(lonely.id).accounts() == []
+        assert User.fetch_graph(9999, include=["accounts"]) is None
+        db.close()
+
+
 def test_user_class():
     with tempfile.TemporaryDirectory() as workspace:
         db_url = "sqlite:///" + workspace + "test.sqlite3"
@@ -277,6 +528,71 @@ def test_user_class():
         User._db.close()
 
 
+def test_password_hashing():
+    with tempfile.TemporaryDirectory() as workspace:
+        db_url = "sqlite:///" + workspace + "test.sqlite3"
+        User._db = financial_game.database.Connection.connect(db_url, False)
+        User._db.create_tables(**Table.database_description(User))
+
+        first = User.hash_password("Setec astronomy")
+        second = User.hash_password("Setec astronomy")
+        assert first != second, "hashes should be salted"
+        assert first.startswith("pbkdf2_sha256$"), first
+        assert len(first) <= 128, len(first)
+        assert User.check_password("Setec astronomy", first)
+        assert User.check_password("Setec astronomy", second)
+        assert not User.check_password("setec astronomy", first)
+        cheap = User.hash_password("Setec astronomy", iterations=1000)
+        assert cheap.split("$")[1] == "1000", cheap
+        assert User.check_password("Setec astronomy", cheap)
+
+        legacy = hashlib.sha256("Setec astronomy".encode("utf-8")).hexdigest()
+        john = User.create("john.appleseed@apple.com", legacy, "John", pw_hashed=True)
+        assert john.password_matches("Setec astronomy")
+        assert not john.password_matches("setec astronomy")
+        assert john.password_outdated()
+        john.change(password="Setec astronomy")
+        assert not john.password_outdated()
+        assert john.password_hash.startswith("pbkdf2_sha256$")
+        assert User.fetch(john.id).password_matches("Setec astronomy")
+
+        jane = User.create("Jane.Doe@apple.com", cheap, "Jane", pw_hashed=True)
+        assert jane.password_matches("Setec astronomy")
+        assert jane.password_outdated()
+        assert User.hashers() is User.hashers()
+
+        assert financial_game.model_user.HASH_WAITING >= financial_game.model_user.HASH_WORKERS
+        checks = [threading.Thread(target=jane.password_matches, args=("Setec astronomy",)) for _ in range(0, 12)]
+
+        for check in checks:  # more than HASH_WAITING queue instead of failing
+            check.start()
+
+        assert all(jane.password_matches("Setec astronomy") for _ in range(0, 2))
+
+        for check in checks:
+            check.join()
+
+        old_wait = financial_game.model_user.HASH_WAIT_SECONDS
+        financial_game.model_user.HASH_WAIT_SECONDS = 0.01
+
+        for _ in range(0, financial_game.model_user.HASH_WAITING):
+            User._waiting.acquire()
+
+        try:
+            jane.password_matches("Setec astronomy")
+            raise AssertionError("should be too busy")
+
+        except financial_game.model_user.HashersBusy:
+            pass
+
+        for _ in range(0, financial_game.model_user.HASH_WAITING):
+            User._waiting.release()
+
+        financial_game.model_user.HASH_WAIT_SECONDS = old_wait
+        assert jane.password_matches("Setec astronomy")
+        User._db.close()
+
+
 def test_bank_class():
     with tempfile.TemporaryDirectory() as workspace:
         db_url = "sqlite:///" + workspace + "test.sqlite3"
@@ -727,6 +1043,141 @@ def test_statement_class():
         assert jane_savings_june.mileage == 120000
 
 
+def test_statement_range():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        john = User.create("john.appleseed@apple.com", "Setec astronomy", "John")
+        jane = User.create("Jane.Doe@apple.com", "too many secrets", "Jane")
+        bank = Bank.create("Bank of America", "https://www.bankofamerica.com/")
+        checking_type = AccountType.create(bank, "Advantage Banking", TypeOfAccount.CHCK)
+        checking = Account.create(john, checking_type, "budget")
+        savings = Account.create(john, checking_type, "emergency")
+        janes = Account.create(jane, checking_type, "budget")
+
+        for month in (3, 1, 2, 5, 4):
+            for account in (checking, savings, janes):
+                Statement.create(account, date(2022, month, 1), date(2022, month, 28), 1.00, 1.00, 0.00, 0.00, 0.00, 0.00, 0.50)
+
+        starts = lambda statements: [s.start_date.month for s in statements]
+        assert starts(checking.statements()) == [1, 2, 3, 4, 5]
+        assert starts(checking.statements(order="DESC")) == [5, 4, 3, 2, 1]
+        assert starts(checking.statements(limit=2, order="DESC")) == [5, 4]
+        assert starts(checking.statements(start=date(2022, 2, 28))) == [2, 3, 4, 5]
+        assert starts(checking.statements(start=date(2022, 3, 1))) == [3, 4, 5]
+        assert starts(checking.statements(end=date(2022, 3, 1))) == [1, 2, 3]
+        assert starts(checking.statements(date(2022, 2, 15), date(2022, 3, 15))) == [2, 3]
+        assert starts(checking.statements(date(2022, 2, 15), date(2022, 4, 15), limit=1, order="DESC")) == [4]
+        assert checking.statements(start=date(2023, 1, 1)) == []
+        assert {s.account_id for s in checking.statements()} == {checking.id}
+
+        try:
+            checking.statements(order="SIDEWAYS")
+            raise AssertionError("order should be ASC or DESC")
+
+        except AssertionError as error:
+            assert "SIDEWAYS" in str(error), error
+
+        in_range = Statement.in_range(john, date(2022, 2, 15), date(2022, 3, 15))
+        assert starts(in_range) == [2, 2, 3, 3], in_range
+        assert {s.account_id for s in in_range} == {checking.id, savings.id}
+        assert len(Statement.in_range(jane.id, date(2022, 1, 1), date(2022, 12, 31))) == 5
+        assert Statement.in_range(jane, date(2021, 1, 1), date(2021, 12, 31)) == []
+
+        plan = Statement._db.fetch_all(
+            "EXPLAIN QUERY PLAN SELECT * FROM Statement WHERE account_id = 1 AND end_date >= 19000 ORDER BY start_date;")
+        assert "Statement_account_id_start_date_end_date" in plan[0]["detail"], plan
+        db.close()
+
+
+def test_pagination():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        users = [User.create(f"user{i}@company.org", "password", f"user {i % 4}") for i in range(0, 10)]
+        banks = [Bank.create(f"bank {i % 3}") for i in range(0, 7)]
+        account_type = AccountType.create(banks[0], "Advantage Banking", TypeOfAccount.CHCK)
+        checking = Account.create(users[0], account_type, "budget")
+
+        for month in (3, 1, 2, 5, 4, 1):
+            Statement.create(checking, date(2022, month, 1), date(2022, month, 28), 1.00, 1.00, 0.00, 0.00, 0.00, 0.00, 0.50)
+
+        def every_page(fetch, key):
+            pages, after = [], None
+
+            while True:
+                page = fetch(after=after, limit=3)
+
+                if not page:
+                    return pages
+
+                pages.append(page)
+                after = key(page[-1])
+
+        user_pages = every_page(User.every, lambda u: (u.name, u.id))
+        assert [len(p) for p in user_pages] == [3, 3, 3, 1]
+        assert [u.id for p in user_pages for u in p] == [u.id for u in User.every()]
+        assert [u.name for u in User.every()] == sorted(u.name for u in users)
+
+        bank_pages = every_page(Bank.every, lambda b: (b.name, b.id))
+        assert [len(p) for p in bank_pages] == [3, 3, 1]
+        assert [b.id for p in bank_pages for b in p] == [b.id for b in Bank.every()]
+        assert [b.name for b in Bank.every(limit=4)] == ["bank 0", "bank 0", "bank 0", "bank 1"]
+
+        for order in ("ASC", "DESC"):
+            fetch = lambda after, limit: checking.statements(after=after, limit=limit, order=order)
+            statement_pages = every_page(fetch, lambda s: (s.start_date, s.id))
+            assert [len(p) for p in statement_pages] == [3, 3]
+            assert [s.id for p in statement_pages for s in p] == [s.id for s in checking.statements(order=order)]
+
+        assert [s.start_date.month for s in checking.statements(after=(date(2022, 2, 1), 0))] == [2, 3, 4, 5]
+        db.close()
+
+
+def test_statistics():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        assert User.total() == 0
+        assert Bank.total() == 0
+        assert Account.count_by_bank() == {}
+        john = User.create("john.appleseed@apple.com", "Setec astronomy", "John")
+        jane = User.create("Jane.Doe@apple.com", "too many secrets", "Jane")
+        assert john.purpose_totals() == {}
+        boa = Bank.create("Bank of America")
+        chase = Bank.create("Chase")
+        Bank.create("Empty")
+        boa_check = AccountType.create(boa, "Advantage Banking", TypeOfAccount.CHCK)
+        boa_cc = AccountType.create(boa, "Customized Cash Rewards", TypeOfAccount.CRED)
+        chase_savings = AccountType.create(chase, "Chase Savings", TypeOfAccount.SAVE)
+        budget = Account.create(john, boa_check, "budget", purpose=AccountPurpose.BUDG)
+        daily = Account.create(john, boa_cc, "daily")
+        emergency = Account.create(john, chase_savings, "emergency", purpose=AccountPurpose.MRGC)
+        Account.create(jane, boa_check, "budget", purpose=AccountPurpose.BUDG)
+        assert User.total() == 2
+        assert Bank.total() == 3
+        assert Account.count_by_bank() == {boa.id: 3, chase.id: 1}
+
+        for _ in range(0, 10):  # floats would drift, cents add up exactly
+            Statement.create(budget, date(2022, 5, 1), date(2022, 5, 31), 0.10, 0.20, 0.20, 0.30, 0.00, 0.00, 0.50)
+
+        Statement.create(budget, date(2022, 6, 1), date(2022, 6, 30), 0.20, 0.00, 0.20, 0.00, 0.00, 0.00, 0.50)
+        Statement.create(daily, date(2022, 6, 1), date(2022, 6, 30), 0.00, 1.01, 0.00, 1.00, 0.00, 0.01, 0.50)
+        Statement.create(emergency, date(2022, 6, 1), date(2022, 6, 30), 100.00, 100.02, 0.00, 0.00, 0.03, 0.05, 0.50)
+        totals = john.purpose_totals()
+        assert set(totals) == {AccountPurpose.BUDG, AccountPurpose.MRGC, None}, totals
+        assert totals[AccountPurpose.BUDG] == {"statements": 11, "deposits": financial_game.money.Money(300),
+                                               "withdrawals": financial_game.money.Money(220),
+                                               "interest": 0, "fees": 0}, totals
+        assert totals[AccountPurpose.BUDG]["deposits"] == 3
+        assert isinstance(totals[AccountPurpose.BUDG]["deposits"], financial_game.money.Money)
+        assert totals[None]["deposits"] == financial_game.money.Money.parse("1.00")
+        assert totals[AccountPurpose.MRGC]["fees"] == financial_game.money.Money(3)
+        june = john.purpose_totals(start=date(2022, 6, 1))
+        assert june[AccountPurpose.BUDG]["statements"] == 1, june
+        assert june[AccountPurpose.BUDG]["withdrawals"] == financial_game.money.Money(20), june
+        assert john.purpose_totals(end=date(2022, 5, 31)).keys() == {AccountPurpose.BUDG}
+        assert jane.purpose_totals() == {}
+        db.close()
+
+
 def test_all_account_types():
     with tempfile.TemporaryDirectory() as workspace:
         db_url = "sqlite:///" + workspace + "test.sqlite3"
@@ -760,11 +1211,20 @@ def test_all_account_types():
 
 
 if __name__ == "__main__":
+    test_statistics()
+    test_pagination()
+    test_statement_range()
+    test_migrate_dates()
+    test_snapshot()
+    test_bulk_load()
+    test_export()
     test_all_account_types()
     test_statement_class()
     test_account_class()
     test_account_type_class()
     test_bank_class()
     test_user_class()
+    test_password_hashing()
+    test_fetch_graph()
     test_serialize()
 
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+from financial_game.money import Money
+
+
+def test_parse():
+    assert Money.parse(None) is None
+    assert Money.parse(3.14).cents == 314
+    assert Money.parse(0.1 + 0.2).cents == 30
+    assert Money.parse("10.25").cents == 1025
+    assert Money.parse("-0.05").cents == -5
+    assert Money.parse(7).cents == 700
+    amount = Money(5)
+    assert Money.parse(amount) is amount
+
+
+def test_arithmetic():
+    assert Money(314) + Money(100) == Money(414)
+    assert Money(314) + 1 == Money(414)
+    assert 1 + Money(314) == Money(414)
+    assert Money(314) - Money(14) == Money(300)
+    assert Money(314) - 3 == Money(14)
+    assert 5 - Money(314) == Money(186)
+    assert isinstance(5 - Money(314), Money)
+    assert abs(Money(314) - 3.14) < 0.001
+    assert isinstance(Money(314) - 3.14, float)
+    assert isinstance(Money(314) + 3.14, float)
+    assert abs(5.0 - Money(314) - 1.86) < 0.001
+    assert sum([Money(1), Money(2), Money(3)]) == Money(6)
+    assert -Money(5) == Money(-5)
+    assert abs(Money(-5)) == Money(5)
+    assert Money(314) * 2 == Money(628)
+    assert 0.5 * Money(315) == Money(158)
+    assert not Money(0)
+    assert Money(1)
+    assert float(Money(314)) == 3.14
+    assert sum(Money(10) for _ in range(0, 10)) == 1  # no float drift
+
+    for unsupported in (lambda: Money(1) + "1", lambda: Money(1) - "1", lambda: Money(1) * "1"):
+        try:
+            unsupported()
+            raise AssertionError("should not be supported")
+
+        except TypeError:
+            pass
+
+
+def test_comparison():
+    assert Money(314) == 3.14
+    assert Money(300) == 3
+    assert Money(314) != Money(315)
+    assert Money(314) != "3.14"
+    assert Money(314) < Money(315)
+    assert Money(314) < 4
+    assert Money(314) > 3.13
+    assert Money(314) <= 3.14
+    assert len({Money(100), Money(100), 1, 1.0}) == 1
+    assert hash(Money(314)) == hash(3.14)
+
+    try:
+        assert Money(1) < "2"
+        raise AssertionError("should not be comparable")
+
+    except TypeError:
+        pass
+
+
+def test_format():
+    assert str(Money(314)) == "3.14"
+    assert str(Money(0)) == "0.00"
+    assert str(Money(-5)) == "-0.05"
+    assert repr(Money(314)) == "Money(314)"
+    assert f"{Money(123456789):,.2f}" == "1,234,567.89"
+    assert f"{Money(314)}" == "3.14"
+    assert f"{Money(314):>8}" == "    3.14"
+
+
+if __name__ == "__main__":
+    test_parse()
+    test_arithmetic()
+    test_comparison()
+    test_format()
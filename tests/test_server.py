@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+
+import os
+import tempfile
+import time
+import types
+
+import financial_game.server
+import financial_game.delivery
+import financial_game.model
+
+
+def test_config():
+    with tempfile.TemporaryDirectory() as workspace:
+        args = types.SimpleNamespace(
+            port=8123,
+            workers=3,
+            threads=2,
+            debug=False,
+            secret="gobble de gook",
+            database="sqlite:///" + workspace + "test.sqlite3",
+        )
+        server = financial_game.server.Server(args)
+        assert server.cfg.bind == ["0.0.0.0:8123"], server.cfg.bind
+        assert server.cfg.workers == 3, server.cfg.workers
+        assert server.cfg.threads == 2, server.cfg.threads
+        assert server.cfg.worker_class_str == "gthread", server.cfg.worker_class_str
+        assert server.cfg.on_starting is financial_game.server.on_starting
+        assert server.cfg.post_fork is financial_game.server.post_fork
+        assert server.cfg.worker_exit is financial_game.server.worker_exit
+        assert server.load().name == "financial_game.webserver"
+
+
+def test_defaults():
+    with tempfile.TemporaryDirectory() as workspace:
+        args = types.SimpleNamespace(
+            port=8123,
+            workers=None,
+            threads=None,
+            debug=True,
+            secret="gobble de gook",
+            database="sqlite:///" + workspace + "test.sqlite3",
+        )
+        server = financial_game.server.Server(args)
+        assert server.cfg.workers == financial_game.server.default_workers()
+        assert server.cfg.threads == financial_game.server.DEFAULT_THREADS
+        assert server.cfg.loglevel == "debug", server.cfg.loglevel
+
+
+def test_worker_database():
+    with tempfile.TemporaryDirectory() as workspace:
+        args = types.SimpleNamespace(
+            port=8123,
+            workers=1,
+            threads=1,
+            debug=False,
+            secret="gobble de gook",
+            database="sqlite:///" + os.path.join(workspace, "test.sqlite3"),
+        )
+        worker = types.SimpleNamespace(app=financial_game.server.Server(args))
+        financial_game.server.on_starting(worker)
+        financial_game.server.post_fork(None, worker)
+        assert worker.app.database is not None
+        assert worker.app.delivery.to_dict()["workers"] == financial_game.delivery.DELIVERY_WORKERS
+        assert worker.app.designated.held
+        assert worker.app.load().delivery is worker.app.delivery
+        assert worker.app.watcher.current is args
+        financial_game.model.User.create("john.appleseed@apple.com", "Setec astronomy", "John")
+        assert financial_game.model.User.total() == 1
+        financial_game.server.worker_exit(None, worker)
+        assert worker.app.database is None
+        assert worker.app.delivery is None
+        assert worker.app.designated is None
+        assert worker.app.watcher is None
+        financial_game.server.worker_exit(None, worker)
+
+
+def test_designated():
+    with tempfile.TemporaryDirectory() as workspace:
+        path = financial_game.server.delivery_lock_path("sqlite://" + os.path.join(workspace, "test.sqlite3"))
+        assert path == os.path.join(workspace, "test.sqlite3.delivery.lock"), path
+        assert financial_game.server.delivery_lock_path("sqlite://") is None
+        assert financial_game.server.delivery_lock_path("sqlite::memory:") is None
+        started = []
+        first = financial_game.server.Designated(path, lambda: started.append("first")).start()
+        second = financial_game.server.Designated(path, lambda: started.append("second"), retry=0.01).start()
+        assert first.held and not second.held
+        assert first.acquire()
+        time.sleep(0.05)
+        assert started == ["first"], started
+        first.stop()
+        end = time.time() + 5.0
+
+        while not second.held:
+            assert time.time() < end, "timed out"
+            time.sleep(0.01)
+
+        assert started == ["first", "second"], started
+        assert not first.acquire()
+        second.stop()
+        second.stop()
+        assert not second.held
+        alone = financial_game.server.Designated(None, lambda: started.append("alone")).start()
+        assert alone.held and started[-1] == "alone"
+        alone.stop()
+
+
+if __name__ == "__main__":
+    test_designated()
+    test_config()
+    test_defaults()
+    test_worker_database()
@@ -26,6 +26,22 @@ def test_basic():
     assert password_hash == user.password_hash, f"user.password_hash: {user.password_hash} password_hash: {password_hash}"
 
 
+def test_encoded_hash():
+    while time.localtime().tm_min == 59:
+        time.sleep(0.100)  # To prevent test flakiness around hour changes
+
+    secret = "Setec astronomy"
+    user_agent = "Mozilla/5.0 (Windows; U; Windows NT 5.1; en-GB; rv:1.9.0.3) Gecko/2008092417 Firefox/3.0.3"
+    password_hash = "pbkdf2_sha256$260000$" + "0f" * 16 + "$" + hashlib.sha256("password".encode()).hexdigest()
+    user = types.SimpleNamespace(id=5, password_hash=password_hash)
+    headers = {'User-Agent': user_agent}
+
+    key = financial_game.sessionkey.create(user, headers, secret)
+    user_id, parsed_hash = financial_game.sessionkey.parse(key, headers, secret)
+    assert user_id == user.id, f"user.id: {user.id} user_id: {user_id}"
+    assert parsed_hash == user.password_hash, f"user.password_hash: {user.password_hash} password_hash: {parsed_hash}"
+
+
 def test_old():
     while time.localtime().tm_min == 59:
         time.sleep(0.100)  # To prevent test flakiness around hour changes
@@ -75,6 +91,7 @@ def test_bad_unicode():
 
 if __name__ == "__main__":
     test_basic()
+    test_encoded_hash()
     test_old()
     test_bad()
     test_bad_unicode()
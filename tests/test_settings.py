@@ -4,8 +4,220 @@
 import types
 import tempfile
 import os
+import sys
+import time
+import logging
 
 import financial_game.settings
+import financial_game.__main__
+import financial_game.email
+import financial_game.table
+
+
+def command_line(path, **overrides):
+    return types.SimpleNamespace(**{
+        "port": None,
+        "database": None,
+        "secret": "secret",
+        "debug": False,
+        "settings": path,
+        "reset": None,
+        "smtp_port": None,
+        "smtp_server": None,
+        "smtp_tls": None,
+        "smtp_user": None,
+        "smtp_password": None,
+        "email_from": None,
+        **overrides,
+    })
+
+
+def test_maintenance_never_resets():
+    with tempfile.TemporaryDirectory() as workspace:
+        path = os.path.join(workspace, "settings.yaml")
+        database = os.path.join(workspace, "test.sqlite3")
+        reset = os.path.join(workspace, "reset.yaml")
+
+        for file_path in (database, reset):
+            with open(file_path, "w", encoding="utf-8") as test_file:
+                test_file.write("")
+
+        financial_game.settings.write(path, {"secret": "secret", "database": database, "reset": reset})
+        assert financial_game.settings.load(command_line(path, secret=None)).reset == reset
+
+        for mode in financial_game.settings.MAINTENANCE:
+            assert financial_game.settings.load(command_line(path, **{mode: "value"})).reset is None, mode
+
+        old_argv = sys.argv
+        sys.argv = ["financial_game", "--settings", path, "--backup", os.path.join(workspace, "backup.sqlite3")]
+
+        try:
+            args = financial_game.__main__.parse_command_line()
+
+        finally:
+            sys.argv = old_argv
+
+        assert args.reset is None, args.reset
+        assert args.command_line.smtp_port is None and args.command_line.smtp_server is None
+        assert args.smtp_port == 587, args.smtp_port
+        assert args.database == f"sqlite:///{database}", args.database
+        assert os.path.isfile(database)
+
+
+def test_read():
+    with tempfile.TemporaryDirectory() as workspace:
+        path = os.path.join(workspace, "settings.yaml")
+        assert financial_game.settings.read(path) == {}
+
+        with open(path, "w", encoding="utf-8") as settings_file:
+            settings_file.write("")
+
+        assert financial_game.settings.read(path) == {}
+
+        for contents in ["- port\n", "port: eighty\n", "debug: 1\n", "port: [80\n"]:
+            with open(path, "w", encoding="utf-8") as settings_file:
+                settings_file.write(contents)
+
+            try:
+                financial_game.settings.read(path)
+                raise AssertionError(f"{contents} should not validate")
+
+            except ValueError:
+                pass
+
+        financial_game.settings.write(path, {"port": 80, "debug": True, "secret": None, "future": [1, 2]})
+        assert financial_game.settings.read(path) == {"port": 80, "debug": True, "secret": None, "future": [1, 2]}
+
+
+def test_watcher():
+    with tempfile.TemporaryDirectory() as workspace:
+        path = os.path.join(workspace, "settings.yaml")
+        settings = {"port": 8000, "debug": False, "smtp-server": "smtp.apple.com", "smtp-user": "john", "smtp-password": "1234"}
+        financial_game.settings.write(path, settings)
+        args = financial_game.settings.load(command_line(path, smtp_server="localhost"))
+        assert args.command_line.smtp_user is None
+        watcher = financial_game.settings.Watcher(args, poll=0.05)
+        smtp_changes, debug_changes = [], []
+        watcher.subscribe(financial_game.settings.SMTP_KEYS, lambda old, new: smtp_changes.append((old, new)))
+        watcher.subscribe(["debug"], lambda old, new: debug_changes.append((old, new)))
+        assert not watcher.check()  # unchanged
+
+        def change(new_settings, stamp):
+            financial_game.settings.write(path, new_settings)
+            os.utime(path, ns=(0, stamp))
+
+        change({**settings, "smtp-password": "5678", "smtp-server": "smtp.google.com", "port": 9000}, 1)
+        assert watcher.check()
+        assert watcher.current is not args
+        assert watcher.current.smtp_password == "5678", watcher.current
+        assert watcher.current.smtp_server == "localhost"  # the command line still wins
+        assert watcher.current.port == 8000  # needs a restart
+        assert args.smtp_password == "1234"  # the old args are not changed
+        assert len(smtp_changes) == 1 and smtp_changes[0] == (args, watcher.current), smtp_changes
+        assert debug_changes == []
+        assert watcher.current.smtp_port == financial_game.settings.DEFAULT_SMTP_PORT
+        change({**settings, "smtp-password": "5678", "smtp-port": 2525, "debug": True}, 2)
+        assert watcher.check()
+        assert watcher.current.smtp_port == 2525
+        assert watcher.current.debug
+        assert len(smtp_changes) == 2 and len(debug_changes) == 1, debug_changes
+
+        with open(path, "w", encoding="utf-8") as settings_file:
+            settings_file.write("smtp-port: none of your business\n")
+
+        os.utime(path, ns=(0, 3))
+        current = watcher.current
+        assert not watcher.check()
+        assert watcher.current is current
+        assert "smtp-port" in str(watcher.error), watcher.error
+        assert not watcher.check()  # waits for the next change
+        change({**settings, "debug": True}, 4)
+        watcher.start()
+        end = time.time() + 5.0
+
+        while watcher.current.smtp_password != "1234":
+            assert time.time() < end, "timed out"
+            time.sleep(0.01)
+
+        watcher.stop()
+        watcher.stop()
+        assert watcher.error is None
+        assert len(debug_changes) == 1, debug_changes
+        os.unlink(path)
+        assert not watcher.check()
+        assert not financial_game.settings.Watcher(types.SimpleNamespace(debug=False)).check()
+
+
+class Session:
+    def __init__(self):
+        self.closed = False
+
+    def noop(self):
+        return (250, b"OK")
+
+    def quit(self):
+        self.closed = True
+
+
+def test_reload_caches():
+    with tempfile.TemporaryDirectory() as workspace:
+        path = os.path.join(workspace, "settings.yaml")
+        settings = {"smtp-server": "localhost", "smtp-port": 2525, "email-from": "me@apple.com"}
+        financial_game.settings.write(path, settings)
+        args = financial_game.settings.load(command_line(path))
+        assert (args.smtp_pool_size, args.date_cache_size, args.part_cache_bytes) == (None, None, None)
+        levels = {n: logging.getLogger(n).level for n in financial_game.settings.LOGGERS}
+        watcher = financial_game.settings.Watcher(args)
+        financial_game.settings.watch_log_level(watcher)
+        financial_game.table.watch(watcher)
+        financial_game.email.watch(watcher)
+        assert logging.getLogger().level == logging.INFO
+        assert financial_game.table.date_from_days.cache_parameters()["maxsize"] == financial_game.table.DATE_CACHE_SIZE
+        assert financial_game.email.PARTS.max_bytes == financial_game.email.PART_CACHE_BYTES
+        smtp_pool = financial_game.email.pool(args)
+        sessions = [Session() for _ in range(0, financial_game.email.SMTP_POOL_SIZE)]
+
+        for session in sessions:
+            smtp_pool.release(session)
+
+        financial_game.email.PARTS.clear()
+
+        for index in range(0, 4):
+            financial_game.email.PARTS.part(("test", index), lambda: types.SimpleNamespace(get_payload=lambda: "x" * 10))
+
+        assert financial_game.email.PARTS.bytes == 40
+        financial_game.table.date_from_days(1)
+        financial_game.settings.write(path, {**settings, "debug": True, "smtp-pool-size": 1, "date-cache-size": 16, "part-cache-bytes": 25})
+        os.utime(path, ns=(0, 1))
+
+        try:
+            assert watcher.check()
+            assert watcher.current.smtp_pool_size == 1 and watcher.current.date_cache_size == 16
+            assert logging.getLogger().level == logging.DEBUG
+            assert logging.getLogger("gunicorn.error").level == logging.DEBUG
+            assert financial_game.table.date_from_days.cache_parameters()["maxsize"] == 16
+            assert financial_game.table.date_from_days.cache_info().currsize == 0
+            assert financial_game.table.date_from_days(1).isoformat() == "1970-01-02"
+            assert financial_game.email.PARTS.max_bytes == 25 and financial_game.email.PARTS.bytes == 20
+            assert [s.closed for s in sessions] == [False, True], [s.closed for s in sessions]
+            assert smtp_pool.acquire() is sessions[0]
+            financial_game.settings.write(path, settings)
+            os.utime(path, ns=(0, 2))
+            assert watcher.check()
+            assert logging.getLogger().level == logging.INFO
+            assert financial_game.table.date_from_days.cache_parameters()["maxsize"] == financial_game.table.DATE_CACHE_SIZE
+            assert financial_game.email.PARTS.max_bytes == financial_game.email.PART_CACHE_BYTES
+
+        finally:
+            financial_game.table.date_cache_size()
+            financial_game.email.PARTS.resize(financial_game.email.PART_CACHE_BYTES)
+            financial_game.email.PARTS.clear()
+
+            with financial_game.email.POOLS_LOCK:
+                financial_game.email.POOLS.clear()
+
+            for name, level in levels.items():
+                logging.getLogger(name).setLevel(level)
 
 
 def test_basics():
@@ -112,6 +324,10 @@ def test_override():
 
 
 if __name__ == "__main__":
+    test_reload_caches()
+    test_maintenance_never_resets()
+    test_read()
+    test_watcher()
     test_basics()
     test_no_secrets()
     test_override()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import tempfile
+
+import yaml
+
+import financial_game.snapshot
+
+
+TEST_YAML_PATH = os.path.join(os.path.split(__file__)[0], "model.yaml")
+STATEMENT = {"start_date": "2022-06-01", "end_date": "2022-06-30", "start_value": 3.14, "end_value": 13.37,
+             "withdrawals": 2.72, "deposits": 12.95, "interest": 0.0, "fees": 0.0, "rate": 0.5, "mileage": None}
+SERIALIZED = {
+    "users": {
+        1: {"name": "John", "email": "john@apple.com", "password_hash": "pbkdf2_sha256$1$00$00",
+            "sponsor_id": None, "accounts": {
+                3: {"label": "budget", "hint": "usual", "purpose": "BUDG", "account_type": 2, "statements": {
+                    5: STATEMENT,
+                    6: dict(STATEMENT, start_date="1969-12-01", end_date="1969-12-31", mileage=100000),
+                }},
+                4: {"label": "savings", "hint": None, "purpose": None, "account_type": 1, "statements": {}},
+            }},
+        2: {"name": "Zoë", "email": "zoe@apple.com", "password": "too many secrets", "sponsor_id": 1,
+            "accounts": {}},
+    },
+    "banks": {
+        1: {"name": "Bank", "url": None, "type": "BANK", "account_types": {
+            1: {"name": "Savings", "type": "SAVE", "url": None},
+            2: {"name": "Checking", "type": "CHCK", "url": "https://bank.com/checking"},
+        }},
+        2: {"name": "Empty", "url": "https://empty.com/", "type": "BANK", "account_types": {}},
+    },
+}
+
+
+def test_round_trip():
+    with tempfile.TemporaryDirectory() as workspace:
+        path = os.path.join(workspace, "test.fgsnap")
+
+        for block_rows in (1, 2, financial_game.snapshot.BLOCK_ROWS):
+            progress = []
+
+            with open(path, "wb") as snapshot_file:
+                financial_game.snapshot.write(snapshot_file, SERIALIZED["users"].items(),
+                                              SERIALIZED["banks"].items(),
+                                              progress=lambda *p: progress.append(p), block_rows=block_rows)
+
+            assert financial_game.snapshot.is_snapshot(path)
+            assert financial_game.snapshot.read(path) == SERIALIZED, financial_game.snapshot.read(path)
+            assert progress == [("users", 1), ("users", 2), ("banks", 1), ("banks", 2)], progress
+
+        tables = financial_game.snapshot.read_tables(path)
+        assert [r["start_value"] for r in tables["Statement"]] == [3.14, 3.14]
+        assert len(tables["Account"]) == 2
+        assert os.path.getsize(path) < len(yaml.safe_dump(SERIALIZED))
+
+
+def test_yaml_script():
+    with open(TEST_YAML_PATH, "r", encoding="utf-8") as script_file:
+        serialized = yaml.safe_load(script_file)
+
+    snapshot = io.BytesIO()
+    financial_game.snapshot.write(snapshot, serialized["users"].items(), serialized["banks"].items())
+
+    with tempfile.TemporaryDirectory() as workspace:
+        path = os.path.join(workspace, "test.fgsnap")
+
+        with open(path, "wb") as snapshot_file:
+            snapshot_file.write(snapshot.getvalue())
+
+        loaded = financial_game.snapshot.read(path)
+        assert loaded["users"][2]["password"] == "too many secrets", loaded
+        assert "password_hash" not in loaded["users"][2], loaded
+        assert loaded["users"][2]["sponsor_id"] == 1, loaded
+        assert loaded["banks"][1]["account_types"][2]["url"] == serialized["banks"][1]["account_types"][2].get("url")
+
+
+def test_invalid():
+    with tempfile.TemporaryDirectory() as workspace:
+        path = os.path.join(workspace, "test.yaml")
+
+        with open(path, "w", encoding="utf-8") as yaml_file:
+            yaml_file.write("users: {}\nbanks: {}\n")
+
+        assert not financial_game.snapshot.is_snapshot(path)
+
+        try:
+            financial_game.snapshot.read(path)
+            raise AssertionError("yaml should not read as a snapshot")
+
+        except AssertionError as error:
+            assert "Not a snapshot" in str(error), error
+
+        duplicates = {1: {"name": "John", "email": "john@apple.com", "accounts": {3: {"label": "a", "account_type": 1}}},
+                      2: {"name": "Jane", "email": "jane@apple.com", "accounts": {3: {"label": "b", "account_type": 1}}}}
+
+        with open(path, "wb") as snapshot_file:
+            financial_game.snapshot.write(snapshot_file, duplicates.items(), [])
+
+        try:
+            financial_game.snapshot.read(path)
+            raise AssertionError("duplicate account ids should not read")
+
+        except ValueError as error:
+            assert "duplicate Account id 3" in str(error), error
+
+        duplicates = {1: {"name": "John", "email": "john@apple.com", "accounts": {
+            3: {"label": "a", "account_type": 1, "statements": {1: {"start_date": "2021-01-01", "end_date": "2021-02-01", "start_balance": 1.0, "end_balance": 2.0}}},
+            4: {"label": "b", "account_type": 1, "statements": {1: {"start_date": "2021-01-01", "end_date": "2021-02-01", "start_balance": 3.0, "end_balance": 4.0}}}}}}
+
+        with open(path, "wb") as snapshot_file:
+            financial_game.snapshot.write(snapshot_file, duplicates.items(), [])
+
+        try:
+            financial_game.snapshot.read(path)
+            raise AssertionError("statement ids numbered per account should not read")
+
+        except ValueError as error:
+            assert "duplicate Statement id 1" in str(error), error
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_yaml_script()
+    test_invalid()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import threading
+import types
+
+import financial_game.model
+import financial_game.startup
+from financial_game.model_user import User
+
+
+def test_import_times():
+    imports = financial_game.startup.import_times(["financial_game.settings"])
+    modules = {i["module"]: i for i in imports}
+    assert "financial_game.settings" in modules, imports
+    assert modules["financial_game.settings"]["depth"] == 0
+    assert all(i["cumulative"] >= i["self"] >= 0 for i in imports), imports
+    server_modules = {i["module"] for i in financial_game.startup.import_times(["financial_game.__main__"])}
+    assert "financial_game.campaign" in server_modules, server_modules
+
+    for heavy in ["yaml", "mako.lookup", "Crypto.Cipher", "flask"]:  # imported on first use
+        assert heavy not in server_modules, heavy
+
+
+def test_init_times():
+    with tempfile.TemporaryDirectory() as workspace:
+        db_path = os.path.join(workspace, "test.sqlite3")
+        args = types.SimpleNamespace(database="sqlite://" + db_path, reset=None, secret="secret", debug=False)
+        steps = financial_game.startup.init_times(args)
+        assert not os.path.isfile(db_path)
+        db = financial_game.model.Database(args.database)
+        User.create("john.appleseed@apple.com", "hash", "John", pw_hashed=True)
+        db.close()
+
+        with open(db_path, "rb") as db_file:
+            before = db_file.read()
+
+        threads = threading.active_count()
+        steps = financial_game.startup.init_times(args)
+        assert threading.active_count() == threads  # no delivery threads
+
+        with open(db_path, "rb") as db_file:
+            assert db_file.read() == before
+
+        assert args.database == "sqlite://" + db_path, args.database
+        assert [s["step"] for s in steps] == ["open database", "create delivery", "import financial_game.webserver", "create app", "close database"]
+        assert all(s["seconds"] >= 0 for s in steps), steps
+        imports = [{"module": "a", "self": 0.001, "cumulative": 0.003, "depth": 0}, {"module": "b", "self": 0.002, "cumulative": 0.002, "depth": 1}]
+        lines = financial_game.startup.report(imports, steps, top=1)
+        assert lines[0] == "imports     3.000 ms  (2 modules)", lines
+        assert lines[1].endswith("  a") and len(lines) == 3 + len(steps), lines
+        assert lines[2].startswith("init "), lines
+
+
+if __name__ == "__main__":
+    test_import_times()
+    test_init_times()
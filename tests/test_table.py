@@ -3,9 +3,14 @@
 
 import datetime
 import enum
+import os
+import time
 
 
-from financial_game.table import Table, Integer, Identifier, String, Date, Fixed, IntEnum, Enum, Money, ForeignKey, IntDate
+from financial_game.table import Table, Integer, Identifier, String, Date, Fixed, IntEnum, Enum, Money, ForeignKey, IntDate, Text
+from financial_game.table import preloadable
+import financial_game.money
+import financial_game.table
 
 
 def test_basic():
@@ -84,6 +89,42 @@ def test_integer_date():
     assert user.name == "John"
     assert user.birthday == datetime.date(1973, 6, 30), f"{user.birthday} <> {datetime.date(1973, 6, 30)}"
     assert user.denormalize()['birthday'] == int(birthday_in_days), f"{user.denormalize()['birthday']} <> {birthday_in_days}"
+    assert User(name="John", birthday=-1).birthday == datetime.date(1969, 12, 31)
+    assert User(name="John", birthday=0).birthday == datetime.date(1970, 1, 1)
+    assert User(name="John", birthday=None).birthday is None
+    assert User(name="John", birthday=None).denormalize()['birthday'] is None
+    assert User(name="John", birthday=datetime.date(2000, 3, 1), _normalize_=False).denormalize()['birthday'] == 11017
+
+
+def test_integer_date_timezones():
+    class Statement(Table):
+        id = Identifier()
+        start_date = IntDate()
+
+    old_timezone = os.environ.get("TZ")
+    days = [-1, 0, 11017, 19173]
+    dates = [datetime.date(1969, 12, 31), datetime.date(1970, 1, 1),
+             datetime.date(2000, 3, 1), datetime.date(2022, 6, 30)]
+
+    try:
+        for timezone in ("UTC", "Pacific/Kiritimati", "America/Los_Angeles", "Asia/Kolkata", "Etc/GMT+12"):
+            os.environ["TZ"] = timezone
+            time.tzset()
+            financial_game.table.date_from_days.cache_clear()
+            assert [Statement(start_date=d).start_date for d in days] == dates, timezone
+            assert [Statement(start_date=d).start_date for d in days] == dates, timezone
+            assert [Statement(start_date=d, _normalize_=False).denormalize()["start_date"] for d in dates] == days
+
+    finally:
+        if old_timezone is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = old_timezone
+
+        time.tzset()
+
+    info = financial_game.table.date_from_days.cache_info()
+    assert info.hits == len(days) and info.currsize == len(days), info
 
 
 def test_fixed():
@@ -100,6 +141,20 @@ def test_fixed():
     for_db = user.denormalize()
     assert for_db['balance'] == 13544
     assert for_db['rate'] == 367
+    assert User(name="Jane").balance is None
+    assert User(name="Jane", _normalize_=False).denormalize()['rate'] is None
+
+
+def test_text():
+    class Message(Table):
+        id = Identifier()
+        body = Text(allow_null=False)
+        note = Text()
+
+    description = Table.database_description(Message)
+    assert description["Message"]["body"] == "TEXT NOT NULL", description
+    assert description["Message"]["note"] == "TEXT", description
+    assert Message(body="x" * 100000).body == "x" * 100000
 
 
 def test_methods():
@@ -170,6 +225,10 @@ def test_money():
     account = Account(id=1, name="John", balance=314)
     assert abs(account.balance - 3.14) < 0.001
     assert account.denormalize()['balance'] == 314
+    assert account.balance == financial_game.money.Money(314)
+    assert Account(id=1, name="John", balance=None).balance is None
+    assert Account(id=1, name="John", balance=None).denormalize()['balance'] is None
+    assert Account(id=1, name="John", balance=3.14, _normalize_=False).denormalize()['balance'] == 314
 
     account = Account(id=1, name="John", balance=313)
     assert abs(account.balance - 3.13) < 0.001
@@ -326,12 +385,57 @@ def test_more_methods():
     assert 'change' not in description['User'], description
 
 
+def test_preloadable():
+    class User(Table):
+        id = Identifier()
+        name = String(50)
+
+        @preloadable
+        def friends(self, prefix=None):
+            return ["queried" if prefix is None else prefix + "queried"]
+
+    user = User(id=1, name="John")
+    assert Table.database_indexes(User) == {"User": []}
+    assert user.friends() == ["queried"]
+    assert Table.relations(User) == {}
+    assert 'friends' not in Table.database_description(User)['User']
+    user.__dict__["_preloaded_"] = {"friends": ["preloaded"]}
+    assert user.friends() == ["preloaded"]
+    assert user.friends("not ") == ["not queried"]
+    assert user.friends(prefix="not ") == ["not queried"]
+
+
+def test_validate():
+    class Account(Table):
+        id = Identifier()
+        name = String(50, allow_null=False)
+        balance = Money()
+
+        def check(self):
+            assert self.balance is None or self.balance >= 0, f"negative balance {self.balance}"
+
+    Table.validate([])
+    Table.validate([Account(id=1, name="John", balance=1.0, _normalize_=False), Account(id=2, name="Jane", balance=None, _normalize_=False)])
+
+    for invalid, message in ((Account(id=1, balance=1.0, _normalize_=False), "['name'] missing"),
+                             (Account(id=1, name="John", balance=-1.0, _normalize_=False), "negative")):
+        try:
+            Table.validate([invalid])
+            raise AssertionError("should not be valid")
+
+        except AssertionError as error:
+            assert message in str(error), error
+
+
 if __name__ == "__main__":
+    test_validate()
+    test_preloadable()
     test_basic()
     test_table_name()
     test_normalize()
     test_date()
     test_fixed()
+    test_text()
     test_methods()
     test_enums()
     test_multiple_tables()
@@ -340,5 +444,6 @@ if __name__ == "__main__":
     test_foreign_key()
     test_more_methods()
     test_integer_date()
+    test_integer_date_timezones()
     test_intenum()
     test_init_normalize()
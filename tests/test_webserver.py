@@ -7,7 +7,10 @@ import types
 import hashlib
 
 import financial_game.webserver
+import financial_game.delivery
+import financial_game.model_outbox
 import financial_game.model
+import financial_game.model_user
 import financial_game.sessionkey
 from financial_game.model_bank import TypeOfAccount
 from financial_game.model_user import AccountPurpose
@@ -56,6 +59,59 @@ def test_login_success():
         assert b'invalid login' not in response.data.lower(), response.data
 
 
+def test_login_upgrades_legacy_hash():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        legacy = hashlib.sha256("Setec astronomy".encode("utf-8")).hexdigest()
+        user = financial_game.model.User.create("john.appleseed@apple.com", legacy, "John", pw_hashed=True)
+        app = financial_game.webserver.create_app(ARGS)
+        app.config.update({"TESTING": True})
+        client = app.test_client()
+        response = client.post("/login", data={
+            'email': 'john.appleseed@apple.com',
+            'password': 'Setec astronomy'
+        }, follow_redirects=True)
+        assert response.status_code == 200, response.status_code
+        assert b'invalid login' not in response.data.lower(), response.data
+        upgraded = financial_game.model.User.fetch(user.id)
+        assert upgraded.password_hash != legacy
+        assert not upgraded.password_outdated()
+        assert upgraded.password_matches("Setec astronomy")
+
+
+def test_login_busy():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        financial_game.model.User.create("john.appleseed@apple.com", "Setec astronomy", "John")
+        app = financial_game.webserver.create_app(ARGS)
+        app.config.update({"TESTING": True})
+        client = app.test_client()
+
+        old_wait = financial_game.model_user.HASH_WAIT_SECONDS
+        financial_game.model_user.HASH_WAIT_SECONDS = 0.01
+
+        for _ in range(0, financial_game.model_user.HASH_WAITING):
+            financial_game.model.User._waiting.acquire()
+
+        response = client.post("/login", data={
+            'email': 'john.appleseed@apple.com',
+            'password': 'Setec astronomy'
+        })
+
+        for _ in range(0, financial_game.model_user.HASH_WAITING):
+            financial_game.model.User._waiting.release()
+
+        financial_game.model_user.HASH_WAIT_SECONDS = old_wait
+
+        assert response.status_code == 503, response.status_code
+        assert response.headers["Retry-After"] == "1"
+        response = client.post("/login", data={
+            'email': 'john.appleseed@apple.com',
+            'password': 'Setec astronomy'
+        }, follow_redirects=True)
+        assert b'invalid login' not in response.data.lower(), response.data
+
+
 def test_bad_session_password():
     while time.localtime().tm_min == 59:
         time.sleep(0.100)  # To prevent test flakiness around hour changes
@@ -76,6 +132,53 @@ def test_bad_session_password():
         assert b'password' in response.data.lower(), response.data
 
 
+def test_server_timing():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        financial_game.model.User.create("john.appleseed@apple.com", "Setec astronomy", "John")
+        app = financial_game.webserver.create_app(ARGS)
+        app.config.update({"TESTING": True})
+        client = app.test_client()
+        response = client.get("/")
+        assert 'render;dur=' in response.headers["Server-Timing"], response.headers
+        assert 'total;dur=' in response.headers["Server-Timing"], response.headers
+        response = client.post("/login", data={
+            'email': 'john.appleseed@apple.com',
+            'password': 'Setec astronomy'
+        }, follow_redirects=True)
+        assert 'db;dur=' in response.headers["Server-Timing"], response.headers
+        assert 'session;dur=' in response.headers["Server-Timing"], response.headers
+        client.get("/not_found")
+        response = client.get("/metrics")
+        assert response.status_code == 200, response.status_code
+        report = response.get_json()
+        assert report["GET /"]["total"]["count"] == 2, report
+        assert report["GET /"]["db calls"]["maximum"] > 0, report
+        assert report["POST /login"]["db calls"]["maximum"] > 0, report
+        assert report["GET *"]["total"]["count"] == 1, report
+        response = client.get("/metrics", environ_base={"REMOTE_ADDR": "10.0.0.1"})
+        assert response.status_code == 404, response.status_code
+
+
+def test_delivery_metrics():
+    with tempfile.TemporaryDirectory() as workspace:
+        db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
+        client = financial_game.webserver.create_app(ARGS).test_client()
+        assert client.get("/metrics/delivery").status_code == 404
+        delivery = financial_game.delivery.Delivery(ARGS)
+        financial_game.model_outbox.Outbox.enqueue("john.appleseed@apple.com", "message")
+        app = financial_game.webserver.create_app(ARGS, delivery)
+        assert app.delivery is delivery
+        client = app.test_client()
+        response = client.get("/metrics/delivery")
+        assert response.status_code == 200, response.status_code
+        report = response.get_json()
+        assert report["queue"]["PENDING"] == 1, report
+        assert report["sent"] == 0, report
+        response = client.get("/metrics/delivery", environ_base={"REMOTE_ADDR": "10.0.0.1"})
+        assert response.status_code == 404, response.status_code
+
+
 def test_404():
     with tempfile.TemporaryDirectory() as workspace:
         db = financial_game.model.Database("sqlite:///" + workspace + "test.sqlite3")
@@ -207,11 +310,15 @@ def test_add_account():
 
 
 if __name__ == "__main__":
+    test_login_busy()
+    test_delivery_metrics()
     test_add_account_no_login()
     test_add_account()
     test_root()
     test_login_fail()
     test_login_success()
+    test_login_upgrades_legacy_hash()
     test_bad_session_password()
+    test_server_timing()
     test_404()
     test_logout()